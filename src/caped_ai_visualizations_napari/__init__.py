@@ -3,15 +3,39 @@ try:
 except ImportError:
     __version__ = "unknown"
 
-from ._reader import napari_get_reader
-from ._sample_data import make_sample_data
-from ._widget import plugin_wrapper_caped_ai_visualization
-from ._writer import write_multiple, write_single_image
+# the public functions are imported on first access, so that napari only
+# pays for the modules (and tensorflow) that a contribution actually uses
+_LAZY_ATTRIBUTES = {
+    "napari_get_reader": "._reader",
+    "make_sample_data": "._sample_data",
+    "plugin_wrapper_caped_ai_visualization": "._widget",
+    "write_multiple": "._writer",
+    "write_points": "._writer",
+    "write_shapes": "._writer",
+    "write_single_image": "._writer",
+}
 
 __all__ = (
     "napari_get_reader",
     "write_single_image",
     "write_multiple",
+    "write_points",
+    "write_shapes",
     "make_sample_data",
     "plugin_wrapper_caped_ai_visualization",
 )
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+
+    module = importlib.import_module(_LAZY_ATTRIBUTES[name], __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,188 @@
+"""
+Activation maps of intermediate layers of the oneat networks.
+
+The network is truncated after the requested layer and only that sub-model
+is run, on the same tiles and temporal windows as the prediction. Maps are
+cached per (source, layer, timepoint, tile) in a bounded LRU cache and
+exposed as lazy dask stacks over time, so that browsing layers and
+timepoints only runs the network for maps that were not seen before.
+"""
+import weakref
+
+import numpy as np
+
+from ._cache import LRUCache
+from ._normalization import normalize
+from ._prediction import model_lock, prediction_timepoints, time_window
+from ._profiling import span
+from ._tiling import halo_from_parameters, tile_grid
+
+ACTIVATION_CACHE_BYTES = 2**30
+
+# shared by all widgets of a napari session
+ACTIVATIONS = LRUCache(ACTIVATION_CACHE_BYTES)
+
+_sub_models = weakref.WeakKeyDictionary()
+
+
+def network_input(window, event_type):
+    """Batch of one window laid out like ``make_patches`` of oneat does.
+
+    Dynamic windows are reshaped, not transposed, from (T, ...) to
+    (..., T), exactly as the networks were fed during training.
+    """
+    window = np.asarray(window, dtype=np.float32)
+    if event_type == "dynamic":
+        return window.reshape((1,) + window.shape[1:] + window.shape[:1])
+    return window[np.newaxis, ..., np.newaxis]
+
+
+def sub_model(network, layer):
+    """Keras model from the inputs of ``network`` to its layer ``layer``."""
+    from tensorflow import keras
+
+    models = _sub_models.setdefault(network, {})
+    if layer not in models:
+        models[layer] = keras.Model(
+            inputs=network.inputs, outputs=network.layers[layer].output
+        )
+    return models[layer]
+
+
+class ActivationExtractor:
+    """Activation maps of one model on one movie.
+
+    Parameters
+    ----------
+    model : NEATVollNet, NEATLRNet, NEATTResNet or NEATResNet
+        A oneat model instance whose network is built.
+    image : np.ndarray
+        TZYX movie for volumetric models, TYX movie otherwise.
+    key : hashable
+        Identifies the model and movie in the activation cache.
+    n_tiles : tuple of int
+        Number of spatial tiles per axis, see ``tile_grid``.
+    norm_image : bool
+        Normalize the movie as for prediction.
+    stats : PercentileStats, optional
+        Intensity histograms of ``image``, computed if not given.
+    cache : LRUCache, optional
+        Defaults to the cache shared by the session.
+    per_timepoint : bool
+        Normalize every timepoint on its own, as for prediction.
+    """
+
+    def __init__(
+        self,
+        model,
+        image,
+        key,
+        n_tiles=(1, 1, 1),
+        norm_image=True,
+        cache=None,
+        stats=None,
+        per_timepoint=False,
+    ):
+        self.model = model
+        self.x = normalize(image, norm_image, stats, per_timepoint)
+        self.key = key
+        self.cache = ACTIVATIONS if cache is None else cache
+        halo = halo_from_parameters(model.config, self.x.ndim - 1)
+        self.tiles = tile_grid(self.x.shape[1:], n_tiles, halo)
+        self.timepoints = prediction_timepoints(model, self.x.shape[0])
+
+    def layer_names(self):
+        return [layer.name for layer in self.model.model.layers]
+
+    def tile_activations(self, layer, t, i):
+        """Maps of tile ``i``, of shape (C, Z, Y, X) or (C, Y, X)."""
+
+        def _compute():
+            window, event_type = time_window(
+                self.model, self.x, t, self.tiles[i].read
+            )
+            window = network_input(window, event_type)
+            with model_lock(self.model), span(
+                "activation inference", layer=layer, t=t
+            ):
+                maps = sub_model(self.model.model, layer).predict(
+                    window, verbose=0
+                )
+            return np.moveaxis(np.asarray(maps[0], dtype=np.float32), -1, 0)
+
+        return self.cache.get((self.key, layer, t, i), _compute)
+
+    def activations(self, layer, t):
+        """Maps of all tiles of timepoint ``t`` stitched together.
+
+        Returns
+        -------
+        maps : np.ndarray
+            Array of shape (C, Z, Y, X) or (C, Y, X), downsampled by the
+            network with respect to the movie.
+        scale : tuple of float
+            Size of an activation pixel in movie pixels, per spatial axis.
+        """
+        shape = self.x.shape[1:]
+        maps, scale = None, None
+        for i, tile in enumerate(self.tiles):
+            tile_maps = self.tile_activations(layer, t, i)
+            if maps is None:
+                read = [r.stop - r.start for r in tile.read]
+                scale = tuple(r / s for r, s in zip(read, tile_maps.shape[1:]))
+                maps = np.zeros(
+                    tile_maps.shape[:1]
+                    + tuple(int(round(n / f)) for n, f in zip(shape, scale)),
+                    dtype=np.float32,
+                )
+            # copy the core of the tile, in downsampled coordinates
+            target, source = [slice(None)], [slice(None)]
+            for read, (start, stop), f, n, m in zip(
+                tile.read,
+                tile.core,
+                scale,
+                maps.shape[1:],
+                tile_maps.shape[1:],
+            ):
+                start, stop = int(round(start / f)), int(round(stop / f))
+                offset = int(round(read.start / f))
+                stop = min(stop, n, m + offset)
+                target.append(slice(start, stop))
+                source.append(slice(start - offset, stop - offset))
+            maps[tuple(target)] = tile_maps[tuple(source)]
+        return maps, scale
+
+    def stack(self, layer, t):
+        """Lazy stack of the maps of ``layer`` over all timepoints.
+
+        The maps of timepoint ``t`` are computed right away to learn their
+        shape, all other timepoints only when the stack is sliced there.
+        Timepoints without a full temporal window are zero.
+
+        Returns
+        -------
+        stack : dask.array.Array
+            Array of shape (C, T, Z, Y, X) or (C, T, Y, X).
+        scale : tuple of float
+            Scale of the stack axes in movie pixels.
+        """
+        import dask.array as da
+        from dask import delayed
+
+        maps, scale = self.activations(layer, t)
+
+        def _maps(t):
+            if t not in self.timepoints:
+                return np.zeros_like(maps)
+            return self.activations(layer, t)[0]
+
+        stack = da.stack(
+            [
+                da.from_delayed(
+                    delayed(_maps)(t), shape=maps.shape, dtype=maps.dtype
+                )
+                for t in range(self.x.shape[0])
+            ],
+            axis=1,
+        )
+        return stack, (1.0, 1.0) + scale
@@ -0,0 +1,488 @@
+"""
+Headless oneat prediction over many movies.
+
+The same model selection, prediction parameters and non maximal suppression
+as in the widget, without napari or a display::
+
+    caped-ai-oneat-predict "movies/*.tif" -o results --model-class \\
+        NEATVollNet --pretrained <name> --jobs 2
+
+Movies are distributed over a pool of processes, each loading the model
+once. Every finished movie is recorded in ``manifest.jsonl`` in the output
+folder with the model and parameters it was processed with. Movies that
+are unchanged since they were recorded with the same settings are skipped
+when the command is run again, so an interrupted run resumes where it
+stopped. Detections are written as the per event csv files of oneat, which
+the reader groups with their movie, and optionally as structured ``.npy``
+files.
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+
+from ._cache import cache_key, save_columns
+from ._models import build, load_model
+from ._nms import NMS_FUNCTIONS, nms
+from ._prediction import (
+    DETECTION_COLUMNS,
+    empty_detections,
+    predict_timepoints,
+    spatial_columns,
+)
+from ._profiling import METRICS
+from ._projection import END_PROJECT_MID, START_PROJECT_MID, model_input
+from ._reader import IMAGE_SUFFIXES, lazy_imread
+from ._registry import MODEL_MODULES
+from ._tiling import default_workers
+
+MANIFEST = "manifest.jsonl"
+OUTPUT_FORMATS = ("csv", "npy")
+
+# same defaults as the widget
+DEFAULT_PARAMETERS = dict(
+    n_tiles=(1, 1, 1),
+    event_threshold=0.9,
+    event_confidence=0.9,
+    norm_image=True,
+    per_timepoint=False,
+    nms_space=20,
+    nms_time=2,
+    nms_function=NMS_FUNCTIONS[0],
+    start_project_mid=START_PROJECT_MID,
+    end_project_mid=END_PROJECT_MID,
+)
+
+_model = None
+_model_class = None
+
+
+def find_movies(patterns):
+    """Sorted tiff files matching paths, folders or glob patterns."""
+    movies = set()
+    for pattern in patterns:
+        for match in glob.glob(str(pattern), recursive=True) or [pattern]:
+            match = Path(match)
+            if match.is_dir():
+                movies.update(
+                    f for f in match.iterdir() if f.suffix in IMAGE_SUFFIXES
+                )
+            elif match.suffix in IMAGE_SUFFIXES and match.exists():
+                movies.add(match)
+    return sorted(str(m) for m in movies)
+
+
+class Manifest:
+    """Append-only record of the movies that were processed.
+
+    Parameters
+    ----------
+    path : str
+        Json lines file, one entry per finished movie.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = {}
+        if self.path.exists():
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # torn last line of an interrupted run
+                        continue
+                    self.entries[entry["movie"]] = entry
+
+    def done(self, movie, settings=None, formats=()):
+        """Whether ``movie`` was processed in its current version.
+
+        Parameters
+        ----------
+        movie : str
+            Path of the movie.
+        settings : dict, optional
+            Model and parameters of the run, see ``run_settings``, that the
+            recorded entry must have been processed with.
+        formats : sequence of str
+            Output formats that must have been written.
+        """
+        entry = self.entries.get(str(movie))
+        return (
+            entry is not None
+            and entry["key"] == cache_key(movie)
+            and entry.get("settings") == settings
+            and set(formats) <= set(entry.get("formats", formats))
+            and all(Path(f).exists() for f in entry["outputs"])
+        )
+
+    def record(self, entry):
+        self.entries[entry["movie"]] = entry
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def run_settings(model_class, model, model_folder, parameters):
+    """Model and parameters of a run, as recorded in the manifest."""
+    if model_folder is not None:
+        model_folder = str(Path(model_folder).resolve())
+    settings = dict(
+        model_class=model_class,
+        model=model,
+        model_folder=model_folder,
+        parameters=parameters,
+    )
+    # as read back from json, tuples become lists
+    return json.loads(json.dumps(settings))
+
+
+def _atomic_write(path, write):
+    fd, tmp = tempfile.mkstemp(dir=Path(path).parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return str(path)
+
+
+def write_csv(path, detections, ndim):
+    """Write detections of one event as a oneat csv file."""
+    columns = ["T"] + ["Z", "Y", "X"][-(ndim - 1) :]
+    columns += ["Score", "Size", "Confidence"]
+    index = [DETECTION_COLUMNS.index(c) for c in columns]
+    fmt = ["%d"] + ["%.6g"] * (len(columns) - 1)
+
+    def _write(f):
+        np.savetxt(
+            f,
+            detections[:, index],
+            delimiter=",",
+            header=",".join(columns),
+            comments="",
+            fmt=fmt,
+        )
+
+    return _atomic_write(path, _write)
+
+
+def write_outputs(detections, movie, output_dir, catagories, ndim, formats):
+    """Write the detections of ``movie`` and return the written files."""
+    stem = Path(movie).stem
+    output_dir = Path(output_dir)
+    written = []
+    if "csv" in formats:
+        label = detections[:, DETECTION_COLUMNS.index("Class")]
+        for event_name, event_label in catagories.items():
+            if event_label == 0:
+                continue
+            path = output_dir / f"oneat_{event_name}_locations_{stem}.csv"
+            written.append(
+                write_csv(path, detections[label == event_label], ndim)
+            )
+    if "npy" in formats:
+        columns = ["T"] + [
+            DETECTION_COLUMNS[c] for c in spatial_columns(ndim - 1)
+        ]
+        columns += ["Score", "Size", "Confidence", "Class"]
+        written.append(
+            save_columns(
+                output_dir / f"oneat_detections_{stem}.npy",
+                {
+                    c: detections[:, DETECTION_COLUMNS.index(c)].astype(
+                        np.int32 if c == "T" else np.float32
+                    )
+                    for c in columns
+                },
+            )
+        )
+    return written
+
+
+def _init_worker(model_class, model, folder):
+    global _model, _model_class
+    _model = build(load_model(model_class, model, folder))
+    _model_class = model_class
+
+
+def process_movie(movie, output_dir, formats, threads, parameters):
+    """Predict, threshold and suppress the events of one movie.
+
+    Runs in a pool process whose model was loaded by ``_init_worker``.
+    Returns the manifest entry of the movie.
+    """
+    start = time.time()
+    key = cache_key(movie)
+    # every pool process holds only the windows and tiles it predicts
+    image = lazy_imread(movie)
+    if image.ndim not in (3, 4):
+        raise ValueError(
+            f"expected a TYX or TZYX movie, got shape {image.shape}"
+        )
+    # as in the widget, 2D+t models see the middle Z planes of TZYX movies
+    x, z_mid = model_input(
+        image,
+        _model_class,
+        parameters["start_project_mid"],
+        parameters["end_project_mid"],
+    )
+    found = [
+        detections
+        for _, detections in predict_timepoints(
+            _model,
+            x,
+            n_tiles=parameters["n_tiles"],
+            event_threshold=parameters["event_threshold"],
+            event_confidence=parameters["event_confidence"],
+            norm_image=parameters["norm_image"],
+            per_timepoint=parameters["per_timepoint"],
+            max_workers=threads,
+        )
+    ]
+    detections = np.concatenate([empty_detections()] + found)
+    if z_mid is not None:
+        detections[:, DETECTION_COLUMNS.index("Z")] = z_mid
+    detections = detections[
+        nms(
+            detections,
+            nms_space=parameters["nms_space"],
+            nms_time=parameters["nms_time"],
+            nms_function=parameters["nms_function"],
+        )
+    ]
+    outputs = write_outputs(
+        detections,
+        movie,
+        output_dir,
+        _model.key_categories,
+        image.ndim,
+        formats,
+    )
+    return dict(
+        movie=str(movie),
+        key=key,
+        outputs=outputs,
+        detections=int(len(detections)),
+        seconds=round(time.time() - start, 3),
+    )
+
+
+def predict_movies(
+    movies,
+    output_dir,
+    model_class,
+    model=None,
+    model_folder=None,
+    jobs=1,
+    threads=None,
+    formats=("csv",),
+    resume=True,
+    **parameters,
+):
+    """Run a oneat model over many movies.
+
+    Parameters
+    ----------
+    movies : list of str
+        Tiff files, folders or glob patterns, see ``find_movies``.
+    output_dir : str
+        Folder for the detection files and the manifest.
+    model_class : str
+        Name of the oneat model class, e.g. ``"NEATVollNet"``.
+    model : str, optional
+        Key or alias of a pretrained model.
+    model_folder : str, optional
+        Folder of a custom model, used instead of ``model``.
+    jobs : int
+        Number of movies processed in parallel, each in its own process
+        with its own copy of the model.
+    threads : int, optional
+        Tiles predicted concurrently per movie, defaults to the cpus
+        divided by ``jobs``.
+    formats : sequence of str
+        Any of ``OUTPUT_FORMATS``.
+    resume : bool
+        Skip movies already recorded in the manifest.
+    **parameters
+        Prediction and NMS parameters, see ``DEFAULT_PARAMETERS``.
+
+    Returns
+    -------
+    entries : list of dict
+        Manifest entries of the movies processed in this run.
+    failed : list of (str, Exception)
+        Movies that could not be processed.
+    """
+    unknown = set(parameters) - set(DEFAULT_PARAMETERS)
+    if unknown:
+        raise TypeError(f"unknown parameters {sorted(unknown)}")
+    parameters = {**DEFAULT_PARAMETERS, **parameters}
+    if model_class not in MODEL_MODULES:
+        raise ValueError(
+            f"model_class must be one of {tuple(MODEL_MODULES)}, "
+            f"got {model_class!r}"
+        )
+    if (model is None) == (model_folder is None):
+        raise ValueError("give either a pretrained model or a model folder")
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest = Manifest(output_dir / MANIFEST)
+    movies = find_movies(movies)
+    settings = run_settings(model_class, model, model_folder, parameters)
+    if resume:
+        movies = [m for m in movies if not manifest.done(m, settings, formats)]
+    jobs = max(1, min(jobs, len(movies)))
+    threads = threads or max(1, default_workers() // jobs)
+    args = (output_dir, tuple(formats), threads, parameters)
+    initargs = (model_class, model, model_folder)
+
+    entries, failed = [], []
+
+    def _done(movie, result):
+        try:
+            entry = dict(result(), formats=list(formats), settings=settings)
+        except Exception as e:
+            failed.append((movie, e))
+            print(f"failed {movie}: {e}", file=sys.stderr)
+            return
+        manifest.record(entry)
+        entries.append(entry)
+        print(
+            f"{entry['movie']}: {entry['detections']} events "
+            f"in {entry['seconds']:.1f} s"
+        )
+
+    if len(movies) == 0:
+        return entries, failed
+    if jobs == 1:
+        _init_worker(*initargs)
+        for movie in movies:
+            _done(movie, lambda: process_movie(movie, *args))
+        return entries, failed
+
+    # tensorflow does not survive a fork, every worker starts afresh
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        jobs, mp_context=context, initializer=_init_worker, initargs=initargs
+    ) as executor:
+        futures = {
+            executor.submit(process_movie, movie, *args): movie
+            for movie in movies
+        }
+        for future in as_completed(futures):
+            _done(futures[future], future.result)
+    return entries, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="caped-ai-oneat-predict",
+        description="Run oneat event detection over many movies.",
+    )
+    parser.add_argument(
+        "movies", nargs="+", help="tiff files, folders or glob patterns"
+    )
+    parser.add_argument("-o", "--output", required=True, help="output folder")
+    parser.add_argument(
+        "--model-class", default="NEATVollNet", choices=list(MODEL_MODULES)
+    )
+    model = parser.add_mutually_exclusive_group(required=True)
+    model.add_argument("--pretrained", help="key or alias of a model")
+    model.add_argument("--model-folder", help="folder of a custom model")
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument(
+        "--format",
+        nargs="+",
+        default=["csv"],
+        choices=OUTPUT_FORMATS,
+        dest="formats",
+    )
+    parser.add_argument(
+        "--no-resume",
+        action="store_false",
+        dest="resume",
+        help="process movies again even if they are in the manifest",
+    )
+    parser.add_argument(
+        "--n-tiles",
+        type=int,
+        nargs="+",
+        default=list(DEFAULT_PARAMETERS["n_tiles"]),
+    )
+    for name in ("event_threshold", "event_confidence", "nms_space"):
+        parser.add_argument(
+            "--" + name.replace("_", "-"),
+            type=float,
+            default=DEFAULT_PARAMETERS[name],
+        )
+    parser.add_argument(
+        "--nms-time", type=int, default=DEFAULT_PARAMETERS["nms_time"]
+    )
+    parser.add_argument(
+        "--nms-function",
+        choices=NMS_FUNCTIONS,
+        default=DEFAULT_PARAMETERS["nms_function"],
+    )
+    for name in ("start_project_mid", "end_project_mid"):
+        parser.add_argument(
+            "--" + name.replace("_", "-"),
+            type=int,
+            default=DEFAULT_PARAMETERS[name],
+            help="Z planes below or above the middle one that 2D+t models "
+            "see of TZYX movies",
+        )
+    parser.add_argument("--no-norm", action="store_false", dest="norm_image")
+    parser.add_argument(
+        "--per-timepoint",
+        action="store_true",
+        help="normalize every timepoint with its own percentiles",
+    )
+    parser.add_argument(
+        "--trace",
+        help="write a Chrome trace of the run, complete with --jobs 1 only",
+    )
+    args = parser.parse_args(argv)
+
+    _, failed = predict_movies(
+        args.movies,
+        args.output,
+        args.model_class,
+        model=args.pretrained,
+        model_folder=args.model_folder,
+        jobs=args.jobs,
+        threads=args.threads,
+        formats=args.formats,
+        resume=args.resume,
+        n_tiles=tuple(args.n_tiles),
+        event_threshold=args.event_threshold,
+        event_confidence=args.event_confidence,
+        norm_image=args.norm_image,
+        per_timepoint=args.per_timepoint,
+        nms_space=args.nms_space,
+        nms_time=args.nms_time,
+        nms_function=args.nms_function,
+        start_project_mid=args.start_project_mid,
+        end_project_mid=args.end_project_mid,
+    )
+    if args.trace:
+        METRICS.dump(args.trace, chrome_trace=True)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
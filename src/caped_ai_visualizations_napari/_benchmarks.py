@@ -0,0 +1,366 @@
+"""
+Benchmarks of the reading, normalization, thresholding, NMS and layer
+building hot paths.
+
+Every case runs on synthetic TZYX movies and detection tables whose size is
+configurable, and reports the best wall time of a few repeats and the peak
+memory traced by ``tracemalloc`` during one extra run. Results can be saved
+as json and compared against a baseline recorded on the same machine::
+
+    python -m caped_ai_visualizations_napari._benchmarks --save base.json
+    python -m caped_ai_visualizations_napari._benchmarks --baseline base.json
+
+The second command exits with an error if a case got slower or needs more
+memory than the baseline allows. The same cases run under pytest-benchmark
+in ``_tests/test_benchmarks.py`` when that plugin is installed.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+from ._prediction import DETECTION_COLUMNS
+
+# default sizes, small enough to run in seconds
+MOVIE_SHAPE = (10, 8, 256, 256)
+N_DETECTIONS = 20_000
+
+# a case is slower than its baseline beyond these factors
+TIME_TOLERANCE = 1.5
+MEMORY_TOLERANCE = 1.25
+
+
+def synthetic_movie(shape=MOVIE_SHAPE, dtype=np.uint16, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 1000, shape).astype(dtype)
+
+
+def synthetic_detections(n=N_DETECTIONS, shape=MOVIE_SHAPE, seed=0):
+    """Detection array with uniformly distributed events and scores."""
+    rng = np.random.default_rng(seed)
+    detections = np.empty((n, len(DETECTION_COLUMNS)), dtype=np.float32)
+    detections[:, 0] = rng.integers(0, shape[0], n)
+    for i, size in enumerate(shape[1:], start=1):
+        detections[:, i] = rng.uniform(0, size, n)
+    detections[:, 4] = rng.uniform(0.5, 1.0, n)
+    detections[:, 5] = rng.uniform(5, 15, n)
+    detections[:, 6] = rng.uniform(0.5, 1.0, n)
+    detections[:, 7] = rng.integers(1, 3, n)
+    return detections
+
+
+def write_movie(path, movie):
+    from tifffile import imwrite
+
+    imwrite(str(path), movie, photometric="minisblack")
+    return str(path)
+
+
+def write_detections_csv(path, detections):
+    columns = ["T", "Z", "Y", "X", "Score", "Size", "Confidence"]
+    np.savetxt(
+        path,
+        detections[:, : len(columns)],
+        delimiter=",",
+        header=",".join(columns),
+        comments="",
+        fmt=["%d"] + ["%.6g"] * (len(columns) - 1),
+    )
+    return str(path)
+
+
+# every case prepares its input in ``workdir`` and returns the function
+# that is timed
+
+
+def case_read_movie(workdir, shape, n):
+    from ._reader import image_reader_function
+
+    path = write_movie(Path(workdir) / "movie.tif", synthetic_movie(shape))
+    return lambda: image_reader_function(path, lazy=False)
+
+
+def case_read_movie_lazy(workdir, shape, n):
+    from ._reader import image_reader_function
+
+    path = write_movie(Path(workdir) / "movie.tif", synthetic_movie(shape))
+
+    def _read():
+        data, _, _ = image_reader_function(path, lazy=True)[0]
+        data = data[0] if isinstance(data, list) else data
+        return np.asarray(data[shape[0] // 2])
+
+    return _read
+
+
+def case_read_csv(workdir, shape, n):
+    from ._reader import read_detections
+
+    path = Path(workdir) / "oneat_Division_locations_movie.csv"
+    write_detections_csv(path, synthetic_detections(n, shape))
+    return lambda: read_detections(str(path))
+
+
+def case_read_csv_cached(workdir, shape, n):
+    from ._reader import load_detections
+
+    path = Path(workdir) / "oneat_Division_locations_movie.csv"
+    write_detections_csv(path, synthetic_detections(n, shape))
+    load_detections(str(path))
+    return lambda: load_detections(str(path))
+
+
+def case_threshold(workdir, shape, n):
+    from ._detections import DetectionTable
+
+    table = DetectionTable(synthetic_detections(n, shape))
+    scores = np.linspace(0.5, 1.0, 20)
+    return lambda: [table.to_array(score, 0.9) for score in scores]
+
+
+def case_stream_detections(workdir, shape, n):
+    from ._detections import DetectionTable
+
+    detections = synthetic_detections(n, shape)
+    detections = detections[np.argsort(detections[:, 0], kind="stable")]
+    # one chunk per timepoint, as predicted
+    starts = np.flatnonzero(np.diff(detections[:, 0])) + 1
+    chunks = np.split(detections, starts)
+
+    def _stream():
+        table = DetectionTable()
+        for chunk in chunks:
+            table.append(chunk)
+            table.at(int(chunk[0, 0]))
+        return table
+
+    return _stream
+
+
+def case_normalize(workdir, shape, n):
+    from ._normalization import PercentileStats, normalize
+
+    movie = synthetic_movie(shape)
+
+    def _normalize():
+        stats = PercentileStats.from_image(movie)
+        return normalize(movie, stats=stats)[shape[0] // 2]
+
+    return _normalize
+
+
+def case_nms(workdir, shape, n):
+    from ._nms import nms
+
+    detections = synthetic_detections(n, shape)
+    return lambda: nms(detections, nms_space=10, nms_time=2)
+
+
+def case_points_layer(workdir, shape, n):
+    from napari.layers import Points
+
+    from ._reader import detections_to_points
+
+    detections = synthetic_detections(n, shape)
+    columns = {
+        name: detections[:, i] for i, name in enumerate(DETECTION_COLUMNS)
+    }
+
+    def _build():
+        data, add_kwargs, _ = detections_to_points(columns, "detections")
+        return Points(data, **add_kwargs)
+
+    return _build
+
+
+def case_boxes(workdir, shape, n):
+    from ._boxes import TimepointBoxes
+
+    detections = synthetic_detections(n, shape)
+
+    def _build():
+        boxes = TimepointBoxes(detections, len(shape))
+        return [boxes.at(t) for t in range(shape[0])]
+
+    return _build
+
+
+def case_view_queries(workdir, shape, n):
+    from ._spatial import SpatialIndex
+
+    detections = synthetic_detections(n, shape)
+    index = SpatialIndex(detections, len(shape))
+    rng = np.random.default_rng(0)
+    # a quarter of the plane around random centres, and picks
+    half = np.array(shape[-2:]) / 4
+    centres = rng.uniform(0, 1, (100, 2)) * shape[-2:]
+
+    def _query():
+        for i, centre in enumerate(centres):
+            t = i % shape[0]
+            index.in_view(t, centre - half, centre + half)
+            index.nearest(t, np.r_[[shape[1] / 2] * (len(shape) - 3), centre])
+
+    return _query
+
+
+def case_link_tracks(workdir, shape, n):
+    from ._tracks import link_tracks
+
+    detections = synthetic_detections(n, shape)
+    return lambda: link_tracks(detections, len(shape), max_distance=5)
+
+
+CASES = {
+    "read_movie": case_read_movie,
+    "read_movie_lazy": case_read_movie_lazy,
+    "read_csv": case_read_csv,
+    "read_csv_cached": case_read_csv_cached,
+    "threshold": case_threshold,
+    "stream_detections": case_stream_detections,
+    "normalize": case_normalize,
+    "nms": case_nms,
+    "points_layer": case_points_layer,
+    "boxes": case_boxes,
+    "view_queries": case_view_queries,
+    "link_tracks": case_link_tracks,
+}
+
+
+def measure(function, repeat=3):
+    """Best wall time of ``repeat`` calls and peak traced memory of one."""
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return dict(seconds=min(seconds), peak_bytes=int(peak))
+
+
+def run_benchmarks(
+    cases=None, shape=MOVIE_SHAPE, n=N_DETECTIONS, repeat=3, cache_dir=None
+):
+    """Run benchmark cases on synthetic data.
+
+    Parameters
+    ----------
+    cases : list of str, optional
+        Names of ``CASES`` to run, all by default.
+    shape : tuple of int
+        Shape of the synthetic TZYX movie.
+    n : int
+        Number of synthetic detections.
+    repeat : int
+        Timed calls per case, the best is reported.
+    cache_dir : str, optional
+        Plugin cache directory, a temporary one by default so that cached
+        cases do not depend on earlier runs.
+
+    Returns
+    -------
+    results : dict
+        Case name to ``seconds`` and ``peak_bytes``.
+    """
+    from ._cache import CACHE_ENV
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        previous = os.environ.get(CACHE_ENV)
+        os.environ[CACHE_ENV] = cache_dir or str(Path(workdir) / "cache")
+        try:
+            for name in cases or CASES:
+                with tempfile.TemporaryDirectory(dir=workdir) as casedir:
+                    function = CASES[name](casedir, tuple(shape), n)
+                    results[name] = measure(function, repeat)
+        finally:
+            if previous is None:
+                del os.environ[CACHE_ENV]
+            else:
+                os.environ[CACHE_ENV] = previous
+    return results
+
+
+def compare(
+    results,
+    baseline,
+    time_tolerance=TIME_TOLERANCE,
+    memory_tolerance=MEMORY_TOLERANCE,
+):
+    """Regressions of ``results`` with respect to ``baseline``.
+
+    Returns a list of human readable messages, empty if every case that is
+    in both stays within the tolerances.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        if result["seconds"] > base["seconds"] * time_tolerance:
+            regressions.append(
+                f"{name}: {result['seconds']:.4f} s, baseline "
+                f"{base['seconds']:.4f} s"
+            )
+        if result["peak_bytes"] > base["peak_bytes"] * memory_tolerance:
+            regressions.append(
+                f"{name}: peak {result['peak_bytes'] / 2**20:.1f} MiB, "
+                f"baseline {base['peak_bytes'] / 2**20:.1f} MiB"
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the hot paths of the plugin."
+    )
+    parser.add_argument("--cases", nargs="+", choices=list(CASES))
+    parser.add_argument(
+        "--shape", type=int, nargs=4, default=list(MOVIE_SHAPE)
+    )
+    parser.add_argument("--detections", type=int, default=N_DETECTIONS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save", help="write the results to this json file")
+    parser.add_argument("--baseline", help="json file to compare against")
+    parser.add_argument("--time-tolerance", type=float, default=TIME_TOLERANCE)
+    parser.add_argument(
+        "--memory-tolerance", type=float, default=MEMORY_TOLERANCE
+    )
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(
+        args.cases, args.shape, args.detections, args.repeat
+    )
+    for name, result in results.items():
+        print(
+            f"{name:<20} {result['seconds'] * 1000:10.1f} ms "
+            f"{result['peak_bytes'] / 2**20:10.1f} MiB"
+        )
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(
+            results, baseline, args.time_tolerance, args.memory_tolerance
+        )
+        for regression in regressions:
+            print(f"regression {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
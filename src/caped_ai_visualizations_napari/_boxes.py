@@ -0,0 +1,146 @@
+"""
+Bounding boxes of oneat detections.
+
+The corners of all boxes are computed at once from the detection array,
+with the box colour looked up by event class. Boxes are sorted by timepoint
+so that the boxes of one timepoint are a contiguous slice found by binary
+search, and only that slice is handed to the napari Shapes layer, which
+creates Python objects per shape and becomes slow for tens of thousands of
+boxes. When the field of view is known, the slice is further cut down to
+the boxes inside it with a ``SpatialIndex``.
+"""
+import numpy as np
+
+from ._prediction import DETECTION_COLUMNS, spatial_columns
+from ._spatial import SpatialIndex
+
+_T = DETECTION_COLUMNS.index("T")
+_SIZE = DETECTION_COLUMNS.index("Size")
+_CLASS = DETECTION_COLUMNS.index("Class")
+
+# colours of the event classes in the order of their labels, the background
+# label 0 never has a box
+BOX_COLORS = (
+    "#1f77b4",
+    "#ff7f0e",
+    "#2ca02c",
+    "#d62728",
+    "#9467bd",
+    "#8c564b",
+    "#e377c2",
+    "#7f7f7f",
+    "#bcbd22",
+    "#17becf",
+)
+
+# corners of a rectangle in the YX plane, in the order napari expects
+_CORNERS = np.array([[-1, -1], [-1, 1], [1, 1], [1, -1]], dtype=np.float32)
+
+
+def hex_to_rgba(colors):
+    """(N, 4) float32 RGBA array of ``#rrggbb`` strings."""
+    rgb = [[int(c[i : i + 2], 16) / 255 for i in (1, 3, 5)] for c in colors]
+    rgba = np.ones((len(colors), 4), dtype=np.float32)
+    rgba[:, :3] = rgb
+    return rgba
+
+
+def class_colors(labels, catagories=None):
+    """RGBA edge colour of each detection, by event class.
+
+    Parameters
+    ----------
+    labels : np.ndarray
+        Event labels, the ``Class`` column of the detections.
+    catagories : dict, optional
+        Event name to label mapping of ``catagories.json``. The event
+        classes are coloured in the order of their labels, so the colours
+        do not depend on which classes were actually detected.
+
+    Returns
+    -------
+    colors : np.ndarray
+        Array of shape (N, 4).
+    """
+    labels = np.asarray(labels).astype(np.intp)
+    if catagories:
+        events = np.sort([v for v in catagories.values() if v > 0])
+        # rank of each label among the event labels
+        labels = np.searchsorted(events, labels)
+    else:
+        labels = labels - 1
+    lut = hex_to_rgba(BOX_COLORS)
+    return lut[np.maximum(labels, 0) % len(lut)]
+
+
+def box_vertices(detections, ndim, default_size=10.0):
+    """Corners of the box around each detection.
+
+    Boxes are rectangles of side ``Size`` in the YX plane of the detection
+    centre, or ``default_size`` for detections without a size.
+
+    Parameters
+    ----------
+    detections : np.ndarray
+        Array of shape (N, len(DETECTION_COLUMNS)).
+    ndim : int
+        4 for TZYX movies, 3 for TYX movies.
+
+    Returns
+    -------
+    vertices : np.ndarray
+        Array of shape (N, 4, ndim), in the axis order of the movie.
+    """
+    detections = np.asarray(detections, dtype=np.float32)
+    columns = [_T] + spatial_columns(ndim - 1)
+    centres = detections[:, columns]
+    size = detections[:, _SIZE]
+    half = np.where(size > 0, size, default_size) / 2
+    vertices = np.repeat(centres[:, np.newaxis, :], 4, axis=1)
+    vertices[:, :, -2:] += _CORNERS[np.newaxis] * half[:, None, None]
+    return vertices
+
+
+class TimepointBoxes:
+    """Boxes of all detections, sliced by timepoint.
+
+    Parameters
+    ----------
+    detections : np.ndarray
+        Array of shape (N, len(DETECTION_COLUMNS)).
+    ndim : int
+        4 for TZYX movies, 3 for TYX movies.
+    catagories : dict, optional
+        Event name to label mapping used to colour the boxes.
+    """
+
+    def __init__(self, detections, ndim, catagories=None, default_size=10.0):
+        detections = np.asarray(detections, dtype=np.float32)
+        self.index = SpatialIndex(detections, ndim)
+        detections = detections[self.index.order]
+        self.t = detections[:, _T]
+        self.vertices = box_vertices(detections, ndim, default_size)
+        self.colors = class_colors(detections[:, _CLASS], catagories)
+        # largest distance between a box corner and its centre
+        size = detections[:, _SIZE]
+        self.margin = float(
+            np.max(np.where(size > 0, size, default_size), initial=0) / 2
+        )
+
+    def __len__(self):
+        return len(self.t)
+
+    def at(self, t, view=None):
+        """Vertices and colours of the boxes at timepoint ``t``.
+
+        Views of the table, or, if ``view`` gives the (lo, hi) YX corners
+        of the field of view, the boxes that overlap it.
+        """
+        if view is None:
+            rows = self.index.at(t)
+        else:
+            lo, hi = view
+            rows = self.index.in_view(
+                t, np.asarray(lo) - self.margin, np.asarray(hi) + self.margin
+            )
+        return self.vertices[rows], self.colors[rows]
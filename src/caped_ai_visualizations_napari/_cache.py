@@ -0,0 +1,219 @@
+"""
+Caches of the plugin.
+
+Parsing the detection csv files is by far the slowest part of reopening a
+result folder. The first time a file is read its columns are stored as a
+structured ``.npy`` array in the user cache directory, keyed by the source
+path, modification time and size, and later reads memory-map that file
+instead of parsing text again. Sidecars of edited or deleted files are
+evicted, least recently used first, once a kind of sidecars exceeds
+``SIDECAR_CACHE_BYTES``.
+
+Results that are expensive to recompute but only needed during a session,
+such as loaded models or activation maps, are kept in memory in least
+recently used caches bounded by their size in bytes.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+CACHE_ENV = "CAPED_AI_VISUALIZATIONS_CACHE"
+# budget of each kind of sidecars on disk
+SIDECAR_CACHE_BYTES = 2**30
+
+
+def cache_dir():
+    """Root of the on-disk cache.
+
+    ``$CAPED_AI_VISUALIZATIONS_CACHE`` if set, otherwise a folder in the
+    user cache directory.
+    """
+    root = os.environ.get(CACHE_ENV)
+    if root is None:
+        root = os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")
+        root = Path(root) / "caped-ai-visualizations-napari"
+    return Path(root)
+
+
+def cache_key(path):
+    """Key that changes whenever the file at ``path`` is modified."""
+    path = Path(path).resolve()
+    stat = path.stat()
+    key = f"{path}:{stat.st_mtime_ns}:{stat.st_size}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def sidecar_path(path, kind="detections"):
+    return cache_dir() / kind / f"{cache_key(path)}.npy"
+
+
+def columns_to_records(columns):
+    """Pack a dict of equally long arrays into a structured array."""
+    dtype = [(name, np.asarray(c).dtype) for name, c in columns.items()]
+    n = len(next(iter(columns.values()))) if len(columns) > 0 else 0
+    records = np.empty(n, dtype=dtype)
+    for name, c in columns.items():
+        records[name] = c
+    return records
+
+
+def records_to_columns(records):
+    """Dict of column views into a structured array."""
+    return {name: records[name] for name in records.dtype.names}
+
+
+def save_columns(path, columns):
+    """Write columns as a structured ``.npy`` file, atomically."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".npy.tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, columns_to_records(columns))
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return str(path)
+
+
+def load_columns(path, mmap_mode="r"):
+    """Memory-map the columns of a structured ``.npy`` file."""
+    records = np.load(path, mmap_mode=mmap_mode, allow_pickle=False)
+    if records.dtype.names is None:
+        raise ValueError(f"{path} does not contain a structured array")
+    return records_to_columns(records)
+
+
+def cached_columns(
+    path, read, kind="detections", max_bytes=SIDECAR_CACHE_BYTES
+):
+    """Columns of ``path``, from the sidecar cache if it is up to date.
+
+    ``read(path)`` parses the source file and is only called on a cache
+    miss, after which its result is written to the cache and the sidecars
+    of the same ``kind`` are pruned to ``max_bytes``. Failing to write the
+    cache, e.g. on a read-only file system, is not an error.
+    """
+    try:
+        sidecar = sidecar_path(path, kind)
+    except OSError:
+        return read(path)
+    try:
+        columns = load_columns(sidecar)
+    except (OSError, ValueError):
+        pass
+    else:
+        try:
+            # recently used sidecars are evicted last
+            os.utime(sidecar)
+        except OSError:
+            pass
+        return columns
+
+    columns = read(path)
+    try:
+        save_columns(sidecar, columns)
+        prune_cache(sidecar.parent, max_bytes, keep=sidecar)
+    except OSError:
+        return columns
+    return load_columns(sidecar)
+
+
+def disk_usage(path):
+    """Size in bytes of a file, or of all files below a folder."""
+    path = Path(path)
+    if path.is_file():
+        return path.stat().st_size
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def prune_cache(folder, max_bytes, keep=None):
+    """Remove the least recently used entries of a cache folder.
+
+    Entries, files or folders directly in ``folder``, are removed by
+    increasing modification time until the rest fits into ``max_bytes``.
+    ``keep`` is never removed, even if it alone is larger.
+    """
+    folder = Path(folder)
+    if not folder.is_dir():
+        return
+    entries = []
+    for entry in folder.iterdir():
+        try:
+            entries.append((entry.stat().st_mtime, entry, disk_usage(entry)))
+        except OSError:
+            # removed by another process meanwhile
+            continue
+    total = sum(size for _, _, size in entries)
+    for _, entry, size in sorted(entries, key=lambda e: e[0]):
+        if total <= max_bytes:
+            break
+        if keep is not None and entry == Path(keep):
+            continue
+        if entry.is_dir():
+            shutil.rmtree(entry, ignore_errors=True)
+        else:
+            entry.unlink(missing_ok=True)
+        total -= size
+
+
+class LRUCache:
+    """Thread safe least recently used cache bounded by memory.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Budget for the size of all cached values. The most recently used
+        value is never evicted, even if it alone exceeds the budget.
+    nbytes : callable
+        Size of a value in bytes, evaluated whenever entries are evicted so
+        that values may grow while they are cached.
+    """
+
+    def __init__(self, max_bytes, nbytes=lambda value: value.nbytes):
+        self.max_bytes = max_bytes
+        self._nbytes = nbytes
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def nbytes(self):
+        with self._lock:
+            return sum(self._nbytes(v) for v in self._values.values())
+
+    def get(self, key, load):
+        """Cached value of ``key``, calling ``load()`` on a miss."""
+        with self._lock:
+            if key in self._values:
+                self._values.move_to_end(key)
+                return self._values[key]
+        # compute outside of the lock, values can take seconds to load
+        value = load()
+        with self._lock:
+            value = self._values.setdefault(key, value)
+            self._values.move_to_end(key)
+            self._evict()
+        return value
+
+    def _evict(self):
+        sizes = {k: self._nbytes(v) for k, v in self._values.items()}
+        total = sum(sizes.values())
+        while len(self._values) > 1 and total > self.max_bytes:
+            key, _ = self._values.popitem(last=False)
+            total -= sizes[key]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
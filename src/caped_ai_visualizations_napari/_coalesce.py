@@ -0,0 +1,74 @@
+"""
+Coalescing of widget changes into one recomputation per frame.
+
+Dragging a slider or scrolling a spinbox emits a change for every
+intermediate value, and each change used to redraw the detections right
+away. A ``Pipeline`` instead splits the recomputation into ordered stages,
+e.g. thresholding, NMS and the layer updates, each caching its result. A
+change only marks the first stage it affects as stale and arms a single
+shot timer, and when the timer fires every stale stage runs once, starting
+from the cached result of the stage before it. Any number of changes within
+a frame thus cost a single update, and an NMS parameter change does not
+threshold the detections again.
+"""
+from qtpy.QtCore import QTimer
+
+# milliseconds between two updates of a pipeline
+FRAME_INTERVAL = 16
+
+
+class Pipeline:
+    """Ordered stages recomputed at most once per ``interval``.
+
+    Parameters
+    ----------
+    stages : sequence of (str, callable)
+        Stage names and functions. The first function is called without
+        arguments, every later one with the result of the stage before it.
+        A stage returning None stops the run, e.g. when there is nothing to
+        show yet.
+    interval : int
+        Milliseconds between a change and the update.
+    """
+
+    def __init__(self, stages, interval=FRAME_INTERVAL):
+        self.names = [name for name, _ in stages]
+        self.functions = [function for _, function in stages]
+        self.results = [None] * len(self.functions)
+        # index of the first stage to run at the next update
+        self.stale = None
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.flush)
+
+    def invalidate(self, stage=None):
+        """Recompute ``stage``, by default the first, and all later ones.
+
+        The update runs when the timer fires. Changes before that are
+        merged into the same update instead of postponing it.
+        """
+        i = 0 if stage is None else self.names.index(stage)
+        self.stale = i if self.stale is None else min(self.stale, i)
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def flush(self):
+        """Run the stale stages now."""
+        self.timer.stop()
+        if self.stale is None:
+            return
+        start, self.stale = self.stale, None
+        # start earlier if a previous run stopped before this stage
+        while start > 0 and self.results[start - 1] is None:
+            start -= 1
+        for i in range(start, len(self.functions)):
+            if i == 0:
+                result = self.functions[i]()
+            else:
+                result = self.functions[i](self.results[i - 1])
+            self.results[i] = result
+            if result is None:
+                for j in range(i + 1, len(self.results)):
+                    self.results[j] = None
+                break
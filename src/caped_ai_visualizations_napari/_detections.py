@@ -0,0 +1,231 @@
+"""
+In-memory store of oneat detections for streaming and thresholding.
+
+Detections are kept as rows of a NumPy structured array, with float32
+coordinates and scores, a uint32 timepoint and a uint16 event class, 32
+bytes per detection once aligned. The rows live at the start of a buffer
+that grows geometrically, so that appending the detections of every
+timepoint while the model runs costs amortized time proportional to the
+new rows, and are kept sorted by timepoint. The detections of a range of
+timepoints are then a contiguous run of rows, found with a binary search
+and returned as a view.
+
+Next to the rows, the table keeps their positions sorted by score. All
+detections above a score threshold are a tail of this permutation, found
+with a binary search, so moving the score slider only gathers the rows
+that pass it. They are gathered column by column into a column-major
+array, whose columns are the contiguous views handed to napari. Rows
+appended since the last threshold are merged into the permutation when the
+next one is asked for, which copies it, so streaming costs a merge per
+update of the layers rather than one per timepoint.
+"""
+import numpy as np
+
+from ._prediction import DETECTION_COLUMNS, empty_detections
+
+DETECTION_DTYPE = np.dtype(
+    [
+        ("T", np.uint32),
+        ("Z", np.float32),
+        ("Y", np.float32),
+        ("X", np.float32),
+        ("Score", np.float32),
+        ("Size", np.float32),
+        ("Confidence", np.float32),
+        ("Class", np.uint16),
+    ],
+    # unaligned fields fall back to slow copy loops
+    align=True,
+)
+# rows allocated when the first detections are appended
+MIN_CAPACITY = 1024
+
+
+def to_rows(detections):
+    """Structured rows of detections.
+
+    Parameters
+    ----------
+    detections : np.ndarray
+        Array of shape (N, len(DETECTION_COLUMNS)), or structured array with
+        the fields of ``DETECTION_DTYPE``.
+    """
+    detections = np.asarray(detections)
+    if detections.dtype.names is not None:
+        return detections.astype(DETECTION_DTYPE, copy=False)
+    rows = np.empty(len(detections), dtype=DETECTION_DTYPE)
+    for i, name in enumerate(DETECTION_COLUMNS):
+        column = detections[:, i]
+        if name in ("T", "Class"):
+            column = np.rint(column)
+        rows[name] = column
+    return rows
+
+
+def to_array(rows, positions=None):
+    """Detections of structured ``rows`` as an (N, 8) float32 array.
+
+    With ``positions``, only those rows are gathered, column by column
+    without an intermediate structured copy. The array is column-major, so
+    that every column is a contiguous view.
+    """
+    n = len(rows) if positions is None else len(positions)
+    if n == 0:
+        return empty_detections()
+    columns = np.empty((len(DETECTION_COLUMNS), n), np.float32)
+    for i, name in enumerate(DETECTION_COLUMNS):
+        column = rows[name]
+        columns[i] = column if positions is None else column[positions]
+    return columns.T
+
+
+class DetectionTable:
+    """Append-only detections sorted by timepoint, indexed by score.
+
+    Parameters
+    ----------
+    detections : np.ndarray, optional
+        Initial detections, see ``append``.
+
+    Attributes
+    ----------
+    order : np.ndarray
+        Positions of the rows sorted by increasing score, rows of equal
+        score in the order they were appended.
+
+    Notes
+    -----
+    Views returned by the table remain valid after later appends, but do
+    not see rows added once the buffer had to grow.
+    """
+
+    def __init__(self, detections=None):
+        self._buffer = np.zeros(0, dtype=DETECTION_DTYPE)
+        self._size = 0
+        self._order = np.zeros(0, dtype=np.uint32)
+        # scores in ``order``, searched for thresholds
+        self._scores = np.zeros(0, dtype=np.float32)
+        # rows in ``order``, later ones are merged on the next threshold
+        self._ordered = 0
+        if detections is not None:
+            self.append(detections)
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, name):
+        """View of the column ``name`` of all rows."""
+        return self.rows[name]
+
+    @property
+    def rows(self):
+        """View of all rows, sorted by timepoint."""
+        return self._buffer[: self._size]
+
+    @property
+    def nbytes(self):
+        return self.rows.nbytes
+
+    @property
+    def order(self):
+        self._sort_scores()
+        return self._order
+
+    def _reserve(self, n):
+        if n <= len(self._buffer):
+            return
+        capacity = max(n, 2 * len(self._buffer), MIN_CAPACITY)
+        buffer = np.zeros(capacity, dtype=DETECTION_DTYPE)
+        buffer[: self._size] = self.rows
+        self._buffer = buffer
+
+    def append(self, detections):
+        """Add detections, keeping the rows sorted by timepoint.
+
+        Detections of timepoints at or after the last one, as streamed by
+        ``predict_timepoints``, are written after the existing rows. Earlier
+        timepoints are merged into place, which copies the table. The score
+        order is updated on the next threshold.
+
+        Parameters
+        ----------
+        detections : np.ndarray
+            Array of shape (N, len(DETECTION_COLUMNS)), or structured array
+            with the fields of ``DETECTION_DTYPE``.
+        """
+        rows = to_rows(detections)
+        if len(rows) == 0:
+            return
+        rows = rows[np.argsort(rows["T"], kind="stable")]
+        start = self._size
+        merge = start > 0 and rows["T"][0] < self._buffer["T"][start - 1]
+        if merge:
+            # new rows go after existing rows of the same timepoint
+            position = np.searchsorted(self["T"], rows["T"], side="right")
+            rows = np.insert(self.rows, position, rows)
+            start = 0
+        self._reserve(start + len(rows))
+        self._buffer[start : start + len(rows)] = rows
+        self._size = start + len(rows)
+        if merge:
+            # existing rows moved, the permutation is rebuilt
+            self._ordered = 0
+            self._order = self._order[:0]
+            self._scores = self._scores[:0]
+
+    def _sort_scores(self):
+        """Merge the rows appended since the last threshold into ``order``."""
+        start = self._ordered
+        if start == self._size:
+            return
+        scores = self["Score"][start:]
+        new = np.argsort(scores, kind="stable").astype(np.uint32)
+        scores = scores[new]
+        # new rows go after existing rows of equal score
+        position = np.searchsorted(self._scores, scores, side="right")
+        self._order = np.insert(self._order, position, start + new)
+        self._scores = np.insert(self._scores, position, scores)
+        self._ordered = self._size
+
+    def between(self, start, stop):
+        """View of the rows with ``start <= T < stop``."""
+        t = self["T"]
+        lo = np.searchsorted(t, max(start, 0), side="left")
+        hi = np.searchsorted(t, max(stop, 0), side="left")
+        return self.rows[lo:hi]
+
+    def at(self, t):
+        """View of the rows of timepoint ``t``."""
+        return self.between(t, t + 1)
+
+    def cutoff(self, score):
+        """Index in ``order`` of the first row with at least ``score``."""
+        self._sort_scores()
+        return int(np.searchsorted(self._scores, score, side="left"))
+
+    def above(self, score=0.0, confidence=None):
+        """Positions of the rows with at least ``score`` and ``confidence``.
+
+        Parameters
+        ----------
+        score : float
+            Minimum score, resolved by binary search.
+        confidence : float, optional
+            Minimum confidence, applied as a mask to the remaining rows.
+
+        Returns
+        -------
+        positions : np.ndarray
+            Positions in ``rows`` by increasing score, a view of the tail of
+            ``order`` unless a confidence filter had to be applied.
+        """
+        positions = self.order[self.cutoff(score) :]
+        if confidence is not None:
+            keep = self["Confidence"][positions] >= confidence
+            if not np.all(keep):
+                positions = positions[keep]
+        return positions
+
+    def to_array(self, score=0.0, confidence=None):
+        """Detections above the thresholds as an (N, 8) array."""
+        return to_array(self.rows, self.above(score, confidence))
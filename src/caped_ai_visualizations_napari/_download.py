@@ -0,0 +1,286 @@
+"""
+Downloads of pretrained oneat models.
+
+A pretrained model is a weight file and three json configs. They are
+fetched concurrently, in chunks, into ``.part`` files that an interrupted
+download resumes with an HTTP range request, and are only moved into place
+once their checksum matches the one of the oneat registry. Progress is
+reported in bytes over all files of a model, from the download threads.
+
+Models are stored as ``<model class>/<model key>/`` in the ``models``
+folder of the plugin cache, with the configs named as ``read_configs``
+expects. A mirror with the same layout, a local folder or an http url set
+in ``$CAPED_AI_VISUALIZATIONS_MIRROR``, is used instead of the registry
+urls, so that machines without internet access can be seeded once with::
+
+    caped-ai-oneat-download --output /shared/oneat-models
+
+and then find every model in ``/shared/oneat-models``.
+"""
+import argparse
+import hashlib
+import http.client
+import os
+import shutil
+import sys
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from ._cache import cache_dir
+from ._profiling import timed
+
+MIRROR_ENV = "CAPED_AI_VISUALIZATIONS_MIRROR"
+CHUNK_SIZE = 2**20
+TIMEOUT = 30
+# attempts per file, each resuming where the last one stopped
+RETRIES = 3
+
+
+class RemoteFile(NamedTuple):
+    """A file to download, ``path`` relative to the download root."""
+
+    url: str
+    path: str
+    file_hash: Optional[str] = None
+
+
+def file_hash(path, algorithm="sha256", chunk_size=CHUNK_SIZE):
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_matches(path, expected):
+    """Whether ``path`` has the sha256 or, for 32 digits, md5 ``expected``.
+
+    Files without an expected hash always match, as in keras ``get_file``.
+    """
+    if not expected:
+        return True
+    algorithm = "md5" if len(expected) == 32 else "sha256"
+    return file_hash(path, algorithm) == expected.lower()
+
+
+def default_mirror():
+    """Mirror folder or url of ``$CAPED_AI_VISUALIZATIONS_MIRROR``, or None."""
+    return os.environ.get(MIRROR_ENV) or None
+
+
+class DownloadManager:
+    """Concurrent, resumable and verified downloads into a folder.
+
+    Parameters
+    ----------
+    root : str, optional
+        Download folder, defaults to ``models`` in the plugin cache.
+    mirror : str, optional
+        Folder or http url with the layout of ``root`` that files are taken
+        from instead of their url, defaults to ``default_mirror()``.
+    max_workers : int
+        Files downloaded at the same time.
+    """
+
+    def __init__(self, root=None, mirror=None, max_workers=4):
+        self.root = Path(root or cache_dir() / "models")
+        self.mirror = default_mirror() if mirror is None else mirror
+        self.max_workers = max_workers
+
+    def source(self, remote):
+        """Where ``remote`` is read from, a url or a local path."""
+        if self.mirror is None:
+            return remote.url
+        if "://" in self.mirror:
+            return self.mirror.rstrip("/") + "/" + remote.path
+        return str(Path(self.mirror) / remote.path)
+
+    def fetch(self, remote, progress=None):
+        """Download one file unless a verified copy exists.
+
+        ``progress`` is called with the bytes received so far and the size
+        of the file, None until it is known. Returns the local path.
+        """
+        target = self.root / remote.path
+        if target.is_file() and hash_matches(target, remote.file_hash):
+            size = target.stat().st_size
+            if progress is not None:
+                progress(size, size)
+            return target
+        target.parent.mkdir(parents=True, exist_ok=True)
+        part = target.with_name(target.name + ".part")
+        source = self.source(remote)
+        for attempt in range(RETRIES):
+            try:
+                if "://" in source:
+                    self._download(source, part, progress)
+                else:
+                    self._copy(source, part, progress)
+                break
+            except urllib.error.HTTPError:
+                # the server refused, asking again will not help
+                raise
+            except (OSError, http.client.HTTPException):
+                if attempt == RETRIES - 1:
+                    raise
+        if not hash_matches(part, remote.file_hash):
+            part.unlink()
+            raise ValueError(
+                f"checksum of {source} does not match {remote.file_hash}"
+            )
+        os.replace(part, target)
+        return target
+
+    def _copy(self, source, part, progress):
+        size = Path(source).stat().st_size
+        shutil.copyfile(source, part)
+        if progress is not None:
+            progress(size, size)
+
+    def _download(self, url, part, progress):
+        offset = part.stat().st_size if part.is_file() else 0
+        request = urllib.request.Request(url)
+        if offset > 0:
+            request.add_header("Range", f"bytes={offset}-")
+        try:
+            response = urllib.request.urlopen(request, timeout=TIMEOUT)
+        except urllib.error.HTTPError as e:
+            if e.code != 416:
+                raise
+            # the part file is complete, or larger than the file
+            part.unlink()
+            return self._download(url, part, progress)
+        with response:
+            resumed = offset > 0 and response.status == 206
+            if not resumed:
+                offset = 0
+            length = response.headers.get("Content-Length")
+            size = offset + int(length) if length is not None else None
+            received = offset
+            with open(part, "ab" if resumed else "wb") as f:
+                for chunk in iter(lambda: response.read(CHUNK_SIZE), b""):
+                    f.write(chunk)
+                    received += len(chunk)
+                    if progress is not None:
+                        progress(received, size)
+        if size is not None and received < size:
+            raise urllib.error.URLError(f"connection closed early: {url}")
+
+    @timed("model download")
+    def fetch_all(self, remotes, progress=None):
+        """Download files concurrently.
+
+        ``progress`` is called from the download threads with the bytes
+        received and the total size of all files whose size is known.
+        Returns the local paths in the order of ``remotes``.
+        """
+        lock = threading.Lock()
+        received, sizes = {}, {}
+
+        def _progress(remote):
+            def _update(n, size):
+                with lock:
+                    received[remote.path] = n
+                    sizes[remote.path] = size or 0
+                    done, total = sum(received.values()), sum(sizes.values())
+                progress(done, total)
+
+            return _update if progress is not None else None
+
+        with ThreadPoolExecutor(self.max_workers) as pool:
+            futures = [
+                pool.submit(self.fetch, remote, _progress(remote))
+                for remote in remotes
+            ]
+            return [future.result() for future in futures]
+
+
+def pretrained_files(name, model):
+    """Files of a pretrained model of the oneat registry.
+
+    Parameters
+    ----------
+    name : str
+        Name of the oneat model class, see ``MODEL_MODULES``.
+    model : str
+        Key or alias of the model.
+    """
+    from oneat.pretrained import get_model_details
+
+    from ._registry import load_model_class
+
+    key, _, details = get_model_details(load_model_class(name), model)
+    folder = f"{name}/{key}"
+    return [
+        RemoteFile(details["url"], f"{folder}/{key}.h5", details["hash"]),
+        RemoteFile(
+            details["paramurl"],
+            f"{folder}/parameters.json",
+            details["paramhash"],
+        ),
+        RemoteFile(
+            details["caturl"], f"{folder}/catagories.json", details["cathash"]
+        ),
+        RemoteFile(
+            details["cordurl"], f"{folder}/cord.json", details["cordhash"]
+        ),
+    ]
+
+
+def download_model(name, model, progress=None, manager=None):
+    """Folder of a pretrained model, downloaded unless it is complete."""
+    manager = manager or DownloadManager()
+    paths = manager.fetch_all(pretrained_files(name, model), progress)
+    return paths[0].parent
+
+
+def main(argv=None):
+    from ._registry import MODEL_MODULES, registered_models
+
+    parser = argparse.ArgumentParser(
+        prog="caped-ai-oneat-download",
+        description="Download pretrained oneat models, e.g. into a mirror.",
+    )
+    parser.add_argument(
+        "-o", "--output", help="download folder, the plugin cache by default"
+    )
+    parser.add_argument(
+        "--model-class",
+        nargs="+",
+        choices=list(MODEL_MODULES),
+        default=list(MODEL_MODULES),
+    )
+    parser.add_argument(
+        "--pretrained", nargs="+", help="keys or aliases, all by default"
+    )
+    parser.add_argument("--mirror", help="folder or url to download from")
+    parser.add_argument("--jobs", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    manager = DownloadManager(args.output, args.mirror, args.jobs)
+    failed = 0
+    for name in args.model_class:
+        try:
+            models = args.pretrained or [m for _, m in registered_models(name)]
+        except ImportError as e:
+            # the installed oneat does not provide this class
+            failed += 1
+            print(f"{name}: {e}", file=sys.stderr)
+            continue
+        for model in models:
+            try:
+                folder = download_model(name, model, manager=manager)
+            except (ImportError, ValueError, OSError) as e:
+                failed += 1
+                print(f"{name} {model}: {e}", file=sys.stderr)
+            else:
+                print(f"{name} {model}: {folder}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
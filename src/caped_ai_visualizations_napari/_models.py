@@ -0,0 +1,184 @@
+"""
+Model manager for the oneat networks.
+
+Loaded models are kept in a least recently used cache that is bounded by
+their estimated memory, so switching between the NEAT classes reuses the
+networks that are already in memory without keeping every model alive.
+Resolved pretrained model folders and their json configs are recorded in a
+persistent index in the plugin cache directory, so a model that was
+downloaded once is found again in later sessions without asking the model
+registry, and the model used last can be warmed up when the widget starts.
+"""
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+from ._cache import LRUCache, cache_dir
+from ._profiling import span, timed
+
+# budget of the in-memory model cache, the most recent model is always kept
+MODEL_CACHE_BYTES = 2**31
+
+CONFIG_FILES = ("parameters", "catagories", "cord")
+
+
+def model_nbytes(model):
+    """Estimated memory of a model instance in bytes.
+
+    Counts the float32 weights of the keras network if it was built,
+    otherwise the size of the weight files in the model directory.
+    """
+    network = getattr(model, "model", None)
+    if network is not None and hasattr(network, "count_params"):
+        return 4 * int(network.count_params())
+    model_dir = getattr(model, "model_dir", None)
+    if model_dir is None or not Path(model_dir).is_dir():
+        return 0
+    return sum(f.stat().st_size for f in Path(model_dir).glob("*.h5"))
+
+
+def read_configs(folder):
+    """Parsed ``parameters``, ``catagories`` and ``cord`` json files."""
+    configs = {}
+    for name in CONFIG_FILES:
+        with open(Path(folder) / f"{name}.json") as f:
+            configs[name] = json.load(f)
+    return configs
+
+
+@timed("model load")
+def load_model(model_class, model=None, folder=None, configs=None):
+    """Instance of a pretrained oneat model or of one trained in ``folder``.
+
+    Pretrained models are built like custom ones, from the folder that
+    ``download_model`` verified, so the files that were checked are the
+    ones that run.
+
+    Parameters
+    ----------
+    model_class : str
+        Name of the oneat model class, see ``MODEL_MODULES``.
+    model : str, optional
+        Key or alias of a pretrained model.
+    folder : str, optional
+        Folder of a custom model with its json configs. For a pretrained
+        model, its downloaded folder, resolved with ``download_model`` if
+        not given.
+    configs : dict, optional
+        Configs of the model, read from ``folder`` if not given.
+    """
+    from ._download import download_model
+    from ._registry import load_model_class
+
+    if model is not None:
+        folder = folder or download_model(model_class, model)
+        # the weights of a pretrained model are next to its configs
+        model_dir = Path(folder)
+    else:
+        model_dir = Path(folder).parent
+    configs = read_configs(folder) if configs is None else configs
+    return load_model_class(model_class)(
+        configs["parameters"],
+        str(model_dir),
+        configs["catagories"],
+        configs["cord"],
+    )
+
+
+def build(model):
+    """Build the keras network of ``model`` unless that was done already."""
+    if getattr(model, "model", None) is None:
+        with span("model build"):
+            model.model = model._build()
+    return model
+
+
+class ModelCache(LRUCache):
+    """LRU cache of model instances bounded by their estimated memory.
+
+    The most recently used model is never evicted, see ``LRUCache``.
+    """
+
+    def __init__(self, max_bytes=MODEL_CACHE_BYTES):
+        super().__init__(max_bytes, nbytes=model_nbytes)
+
+
+def index_key(model_type, model):
+    """String key of a model, e.g. ``"NEATVollNet:alias"``."""
+    name = getattr(model_type, "__name__", str(model_type))
+    return f"{name}:{model}"
+
+
+class ModelIndex:
+    """Persistent index of model folders and their json configs.
+
+    Parameters
+    ----------
+    path : str, optional
+        Json file of the index, defaults to ``models/index.json`` in the
+        plugin cache directory.
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path or cache_dir() / "models" / "index.json")
+        self._lock = threading.Lock()
+        self._index = None
+
+    def _read(self):
+        if self._index is None:
+            try:
+                with open(self.path) as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {}
+            self._index.setdefault("models", {})
+        return self._index
+
+    def _write(self):
+        # the index is best effort, a read-only cache only costs lookups
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(self._index, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+    def get(self, model_type, model):
+        """Entry with ``folder`` and configs, if the folder still exists."""
+        with self._lock:
+            entry = self._read()["models"].get(index_key(model_type, model))
+        if entry is None or not Path(entry["folder"]).is_dir():
+            return None
+        return entry
+
+    def put(self, model_type, model, folder, **configs):
+        """Record the ``folder`` of a model and its parsed json ``configs``."""
+        with self._lock:
+            index = self._read()
+            index["models"][index_key(model_type, model)] = dict(
+                folder=str(folder), **configs
+            )
+            self._write()
+
+    def set_last_used(self, model_type, model, **extra):
+        """Remember the model loaded last, for warm-up in the next session."""
+        with self._lock:
+            self._read()["last_used"] = dict(
+                model_type=getattr(model_type, "__name__", str(model_type)),
+                model=str(model),
+                **extra,
+            )
+            self._write()
+
+    def last_used(self):
+        """Dict with the ``model_type`` name and ``model``, or None."""
+        with self._lock:
+            return self._read().get("last_used")
+
+
+# shared by all widgets of a napari session
+MODELS = ModelCache()
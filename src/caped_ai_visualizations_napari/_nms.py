@@ -0,0 +1,144 @@
+"""
+Spatio-temporal non maximal suppression of oneat detections.
+
+Detections are visited in order of decreasing score and suppress every
+lower scoring detection of the same class that is closer than ``nms_space``
+in space and ``nms_time`` in time. Instead of comparing all pairs, candidate
+neighbours are looked up in a KD-tree over (t, z, y, x) with time rescaled
+so that the ``nms_time`` window maps onto the ``nms_space`` radius, which
+keeps the cost close to linear in the number of detections.
+"""
+import numpy as np
+from scipy.spatial import cKDTree
+
+from ._prediction import DETECTION_COLUMNS
+from ._profiling import timed
+
+NMS_FUNCTIONS = ("iou", "distance")
+
+_T, _Z, _Y, _X = (DETECTION_COLUMNS.index(c) for c in "TZYX")
+_SCORE = DETECTION_COLUMNS.index("Score")
+_SIZE = DETECTION_COLUMNS.index("Size")
+_CLASS = DETECTION_COLUMNS.index("Class")
+
+
+def neighbour_pairs(detections, nms_space, nms_time):
+    """Pairs of detections within ``nms_space`` and ``nms_time``.
+
+    Returns two index arrays ``(i, j)`` with ``i < j`` of detections of the
+    same class whose spatial coordinates differ by at most ``nms_space``
+    along every axis and whose timepoints differ by at most ``nms_time``.
+    """
+    nms_space = float(nms_space)
+    time_scale = (
+        nms_space / nms_time if nms_time > 0 else nms_space + 1.0
+    ) or 1.0
+    points = np.column_stack(
+        [
+            detections[:, _T] * time_scale,
+            detections[:, _Z],
+            detections[:, _Y],
+            detections[:, _X],
+        ]
+    ).astype(np.float64)
+    tree = cKDTree(points)
+    pairs = tree.query_pairs(r=nms_space, p=np.inf, output_type="ndarray")
+    if len(pairs) == 0:
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, empty
+    i, j = pairs[:, 0], pairs[:, 1]
+    same = detections[i, _CLASS] == detections[j, _CLASS]
+    # guard against round-off from the time rescaling
+    same &= np.abs(detections[i, _T] - detections[j, _T]) <= nms_time
+    return i[same], j[same]
+
+
+def box_iou(detections, i, j, default_size):
+    """IoU of the axis aligned cubes of side ``Size`` around detections."""
+    size = detections[:, _SIZE]
+    size = np.where(size > 0, size, default_size)
+    lo = detections[:, [_Z, _Y, _X]] - size[:, None] / 2
+    hi = detections[:, [_Z, _Y, _X]] + size[:, None] / 2
+    overlap = np.clip(
+        np.minimum(hi[i], hi[j]) - np.maximum(lo[i], lo[j]), 0, None
+    )
+    intersection = np.prod(overlap, axis=1)
+    union = size[i] ** 3 + size[j] ** 3 - intersection
+    return intersection / np.maximum(union, 1e-12)
+
+
+def suppression_mask(n, i, j, scores):
+    """Greedy suppression given the neighbour pairs ``(i, j)``.
+
+    Returns the boolean mask of detections that survive.
+    """
+    order = np.argsort(-scores, kind="stable")
+    rank = np.empty(n, dtype=np.intp)
+    rank[order] = np.arange(n)
+
+    # direct every edge from the better to the worse ranked detection and
+    # group edges by their source in a compressed sparse row layout
+    better_first = rank[i] < rank[j]
+    source = np.where(better_first, i, j)
+    target = np.where(better_first, j, i)
+    sort = np.argsort(rank[source], kind="stable")
+    source, target = source[sort], target[sort]
+    starts = np.searchsorted(rank[source], np.arange(n + 1))
+
+    keep = np.ones(n, dtype=bool)
+    for r in np.unique(rank[source]):
+        if keep[order[r]]:
+            keep[target[starts[r] : starts[r + 1]]] = False
+    return keep
+
+
+@timed("nms")
+def nms(
+    detections,
+    nms_space=20,
+    nms_time=2,
+    nms_function="iou",
+    iou_threshold=0.1,
+):
+    """Non maximal suppression of detections in space and time.
+
+    Parameters
+    ----------
+    detections : np.ndarray
+        Array of shape (N, len(DETECTION_COLUMNS)).
+    nms_space : float
+        Spatial veto radius in pixels.
+    nms_time : int
+        Temporal veto radius in timepoints.
+    nms_function : str
+        ``"iou"`` suppresses neighbours whose boxes overlap by more than
+        ``iou_threshold``, ``"distance"`` suppresses every neighbour whose
+        centre is within ``nms_space``.
+    iou_threshold : float
+        Overlap above which a neighbour is suppressed for ``"iou"``.
+
+    Returns
+    -------
+    keep : np.ndarray
+        Boolean mask of the detections that survive, in input order.
+    """
+    detections = np.asarray(detections)
+    n = len(detections)
+    if n == 0:
+        return np.zeros(0, dtype=bool)
+    if nms_function not in NMS_FUNCTIONS:
+        raise ValueError(
+            f"nms_function must be one of {NMS_FUNCTIONS}, "
+            f"got {nms_function!r}"
+        )
+
+    i, j = neighbour_pairs(detections, nms_space, nms_time)
+    if nms_function == "distance":
+        spatial = [_Z, _Y, _X]
+        d = np.linalg.norm(
+            detections[i][:, spatial] - detections[j][:, spatial], axis=1
+        )
+        close = d <= nms_space
+    else:
+        close = box_iou(detections, i, j, nms_space) > iou_threshold
+    return suppression_mask(n, i[close], j[close], detections[:, _SCORE])
@@ -0,0 +1,222 @@
+"""
+Percentile normalization of movies without a normalized copy.
+
+oneat feeds its networks with movies scaled between the 1st and 99.8th
+percentile of their intensities. Sorting a large movie to find those
+percentiles, and keeping a float32 copy of it, takes minutes and twice the
+memory. Here the percentiles are read from histograms instead, built one
+plane at a time and per timepoint, so that they are available both for the
+whole movie (as oneat does) and for every timepoint. Histograms are cached
+per movie for the lifetime of the array, so repeated prediction runs on
+the same image layer skip them. The movie itself is only normalized when
+it is sliced, one tile window at a time, in float32.
+"""
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from ._profiling import span
+from ._tiling import default_workers
+
+PMIN = 1
+PMAX = 99.8
+EPS = 1e-20
+# float intensities are binned, integer ones too when their range is wider
+N_BINS = 4096
+
+# histograms of the movies of a session, dropped with their array
+_STATS = {}
+
+
+def _planes(image, t):
+    """2D planes of timepoint ``t``, loaded one at a time."""
+    frame = image[t]
+    for index in np.ndindex(*frame.shape[:-2]):
+        yield np.asarray(frame[index])
+
+
+def _min_max(image, t):
+    lo, hi = np.inf, -np.inf
+    for plane in _planes(image, t):
+        lo, hi = min(lo, plane.min()), max(hi, plane.max())
+    return lo, hi
+
+
+class PercentileStats:
+    """Intensity histograms of every timepoint of a movie.
+
+    Parameters
+    ----------
+    edges : np.ndarray
+        ``n_bins + 1`` bin edges shared by all timepoints.
+    histograms : np.ndarray
+        Counts of shape (T, n_bins).
+    exact : bool
+        Bins hold a single integer value each, percentiles are exact.
+    """
+
+    def __init__(self, edges, histograms, exact=False):
+        self.edges = edges
+        self.histograms = histograms
+        self.exact = exact
+
+    @classmethod
+    def from_image(cls, image, n_bins=N_BINS, max_workers=None):
+        """Histograms of a TZYX or TYX movie, numpy or dask.
+
+        The movie is read twice, plane by plane, for its range and then for
+        the counts. Timepoints are processed on ``max_workers`` threads.
+        """
+        n_timepoints = image.shape[0]
+        with ThreadPoolExecutor(max_workers or default_workers()) as pool:
+            ranges = np.array(
+                list(
+                    pool.map(lambda t: _min_max(image, t), range(n_timepoints))
+                )
+            )
+            lo, hi = float(ranges[:, 0].min()), float(ranges[:, 1].max())
+            exact = (
+                np.issubdtype(image.dtype, np.integer)
+                and hi - lo + 1 <= n_bins
+            )
+            if exact:
+                n_bins = int(hi - lo) + 1
+                edges = lo - 0.5 + np.arange(n_bins + 1, dtype=np.float64)
+            else:
+                edges = np.linspace(lo, hi if hi > lo else lo + 1, n_bins + 1)
+            scale = n_bins / (edges[-1] - edges[0])
+
+            def _histogram(t):
+                counts = np.zeros(n_bins, dtype=np.int64)
+                for plane in _planes(image, t):
+                    index = (plane.ravel() - edges[0]) * scale
+                    index = np.clip(index.astype(np.intp), 0, n_bins - 1)
+                    counts += np.bincount(index, minlength=n_bins)
+                return counts
+
+            histograms = np.stack(
+                list(pool.map(_histogram, range(n_timepoints)))
+            )
+        return cls(edges, histograms, exact)
+
+    @property
+    def nbytes(self):
+        return self.edges.nbytes + self.histograms.nbytes
+
+    def _order_statistic(self, counts, cumulative, i):
+        # value of the i-th smallest intensity, spread evenly within its bin
+        b = int(np.searchsorted(cumulative, i, side="right"))
+        if self.exact:
+            return (self.edges[b] + self.edges[b + 1]) / 2
+        before = cumulative[b - 1] if b > 0 else 0
+        within = (i - before + 0.5) / counts[b]
+        return self.edges[b] + within * (self.edges[b + 1] - self.edges[b])
+
+    def percentile(self, q, t=None):
+        """Percentile ``q`` of the movie, or of timepoint ``t``.
+
+        Interpolates linearly between order statistics like
+        ``np.percentile``, exactly for integer movies with at most
+        ``N_BINS`` distinct levels, otherwise to within a bin.
+        """
+        counts = (
+            self.histograms.sum(axis=0) if t is None else self.histograms[t]
+        )
+        cumulative = np.cumsum(counts)
+        n = int(cumulative[-1])
+        if n == 0:
+            return float("nan")
+        rank = q / 100 * (n - 1)
+        below, above = int(np.floor(rank)), int(np.ceil(rank))
+        lo = self._order_statistic(counts, cumulative, below)
+        hi = self._order_statistic(counts, cumulative, above)
+        return float(lo + (rank - below) * (hi - lo))
+
+
+def percentile_stats(image, n_bins=N_BINS, max_workers=None, source=None):
+    """``PercentileStats`` of ``image``, cached while the array is alive.
+
+    ``source`` is the array the cache entry belongs to if ``image`` is a
+    temporary copy of it, e.g. the data of an image layer that was loaded
+    into memory.
+    """
+    source = image if source is None else source
+    key = (id(source), image.shape, str(image.dtype), n_bins)
+    stats = _STATS.get(key)
+    if stats is None:
+        with span("percentile statistics"):
+            stats = PercentileStats.from_image(image, n_bins, max_workers)
+        try:
+            weakref.finalize(source, _STATS.pop, key, None)
+        except TypeError:
+            # not weakly referenceable, the id could be reused
+            return stats
+        _STATS[key] = stats
+    return stats
+
+
+class NormalizedImage:
+    """Movie that is percentile normalized when sliced.
+
+    Slicing returns float32 arrays ``(x - lo) / (hi - lo + EPS)``, with
+    ``lo`` and ``hi`` the ``pmin`` and ``pmax`` percentiles of the whole
+    movie, or of each timepoint if ``per_timepoint``. Without ``stats``
+    slices are only converted to float32.
+
+    Parameters
+    ----------
+    image : array-like
+        TZYX or TYX movie, numpy or dask.
+    stats : PercentileStats, optional
+        Histograms of ``image``.
+    """
+
+    def __init__(
+        self, image, stats=None, pmin=PMIN, pmax=PMAX, per_timepoint=False
+    ):
+        self.image = image
+        self.shape = tuple(image.shape)
+        self.ndim = len(self.shape)
+        self.dtype = np.dtype(np.float32)
+        self.lo = self.hi = None
+        if stats is not None:
+            timepoints = range(self.shape[0]) if per_timepoint else [None]
+            lo = [stats.percentile(pmin, t) for t in timepoints]
+            hi = [stats.percentile(pmax, t) for t in timepoints]
+            self.lo = np.broadcast_to(np.float32(lo), self.shape[:1])
+            self.hi = np.broadcast_to(np.float32(hi), self.shape[:1])
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        x = np.array(self.image[index], dtype=np.float32)
+        if self.lo is None:
+            return x
+        index = index if isinstance(index, tuple) else (index,)
+        t = index[0] if len(index) > 0 else slice(None)
+        lo, hi = self.lo[t], self.hi[t]
+        if np.ndim(lo) > 0:
+            # one value per sliced timepoint, along the first axis
+            lo = lo.reshape((-1,) + (1,) * (x.ndim - 1))
+            hi = hi.reshape((-1,) + (1,) * (x.ndim - 1))
+        x -= lo
+        x /= hi - lo + np.float32(EPS)
+        return x
+
+    def __array__(self, dtype=None, copy=None):
+        x = self[:]
+        return x if dtype is None else x.astype(dtype)
+
+
+def normalize(image, norm_image=True, stats=None, per_timepoint=False):
+    """Movie as a float32, percentile normalized ``NormalizedImage``.
+
+    ``stats`` are computed, or taken from the cache, when not given.
+    """
+    if not norm_image:
+        return NormalizedImage(image)
+    if stats is None:
+        stats = percentile_stats(image)
+    return NormalizedImage(image, stats, per_timepoint=per_timepoint)
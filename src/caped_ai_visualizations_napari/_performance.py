@@ -0,0 +1,129 @@
+"""
+Collapsible panel showing the timing spans of the session.
+
+The table lists every span of ``METRICS`` with its count and total, mean
+and max duration, slowest in total first, and is refreshed once a second
+while the panel is expanded. The summary can be saved as json and the
+recent spans as a Chrome trace.
+"""
+from qtpy.QtCore import Qt, QTimer
+from qtpy.QtWidgets import (
+    QFileDialog,
+    QHBoxLayout,
+    QPushButton,
+    QTableWidget,
+    QTableWidgetItem,
+    QToolButton,
+    QVBoxLayout,
+    QWidget,
+)
+
+from ._profiling import METRICS
+
+COLUMNS = ("Span", "Count", "Total (s)", "Mean (ms)", "Max (ms)")
+REFRESH_INTERVAL = 1000
+
+
+def summary_rows(metrics):
+    """Text of the table cells, spans first and then counters."""
+    rows = [
+        (
+            row["name"],
+            str(row["count"]),
+            f"{row['total']:.3f}",
+            f"{row['mean'] * 1e3:.1f}",
+            f"{row['max'] * 1e3:.1f}",
+        )
+        for row in metrics.summary()
+    ]
+    counters = metrics.to_dict()["counters"]
+    rows += [
+        (name, str(n), "", "", "") for name, n in sorted(counters.items())
+    ]
+    return rows
+
+
+class PerformancePanel(QWidget):
+    """Timing spans of ``metrics``, hidden until the header is clicked.
+
+    Parameters
+    ----------
+    metrics : Metrics, optional
+        Defaults to the registry shared by the session.
+    """
+
+    def __init__(self, metrics=None, parent=None):
+        super().__init__(parent)
+        self.metrics = METRICS if metrics is None else metrics
+
+        self.header = QToolButton()
+        self.header.setText("Performance")
+        self.header.setCheckable(True)
+        self.header.setToolButtonStyle(Qt.ToolButtonTextBesideIcon)
+        self.header.setArrowType(Qt.RightArrow)
+        self.header.toggled.connect(self.expand)
+
+        self.table = QTableWidget(0, len(COLUMNS))
+        self.table.setHorizontalHeaderLabels(COLUMNS)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+
+        reset = QPushButton("Reset")
+        reset.clicked.connect(self.reset)
+        save = QPushButton("Save json")
+        save.clicked.connect(lambda: self.save(chrome_trace=False))
+        trace = QPushButton("Save trace")
+        trace.clicked.connect(lambda: self.save(chrome_trace=True))
+        buttons = QHBoxLayout()
+        for button in (reset, save, trace):
+            buttons.addWidget(button)
+
+        self.body = QWidget()
+        body_layout = QVBoxLayout()
+        body_layout.setContentsMargins(0, 0, 0, 0)
+        body_layout.addWidget(self.table)
+        body_layout.addLayout(buttons)
+        self.body.setLayout(body_layout)
+        self.body.setVisible(False)
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.header)
+        layout.addWidget(self.body)
+        self.setLayout(layout)
+
+        # only refresh while the table can be seen
+        self.timer = QTimer(self)
+        self.timer.setInterval(REFRESH_INTERVAL)
+        self.timer.timeout.connect(self.refresh)
+
+    def expand(self, expanded):
+        self.header.setArrowType(Qt.DownArrow if expanded else Qt.RightArrow)
+        self.body.setVisible(expanded)
+        if expanded:
+            self.refresh()
+            self.timer.start()
+        else:
+            self.timer.stop()
+
+    def refresh(self):
+        rows = summary_rows(self.metrics)
+        self.table.setRowCount(len(rows))
+        for i, row in enumerate(rows):
+            for j, text in enumerate(row):
+                item = QTableWidgetItem(text)
+                if j > 0:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.table.setItem(i, j, item)
+
+    def reset(self):
+        self.metrics.reset()
+        self.refresh()
+
+    def save(self, chrome_trace=False):
+        name = "oneat.trace.json" if chrome_trace else "oneat_timings.json"
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Save timings", name, "JSON (*.json)"
+        )
+        if path:
+            self.metrics.dump(path, chrome_trace=chrome_trace)
@@ -0,0 +1,121 @@
+"""
+Plot of the number of detected events per timepoint.
+
+Counts of all classes are computed with a single ``np.bincount`` over the
+detection table. The plot is redrawn with blitting: the axes, ticks and
+legend are rendered once and cached as a background, and a threshold or
+NMS change only restores that background and redraws the count lines. A
+full redraw only happens when the classes, the number of timepoints or
+the scale of the counts change.
+"""
+import numpy as np
+
+from ._prediction import DETECTION_COLUMNS
+
+_T = DETECTION_COLUMNS.index("T")
+_CLASS = DETECTION_COLUMNS.index("Class")
+
+
+def event_counts(detections, n_timepoints, labels):
+    """Number of detections per class and timepoint.
+
+    Parameters
+    ----------
+    detections : np.ndarray
+        Array of shape (N, len(DETECTION_COLUMNS)).
+    n_timepoints : int
+        Number of timepoints of the movie.
+    labels : sequence of int
+        Event labels to count, detections of other classes are ignored.
+
+    Returns
+    -------
+    counts : np.ndarray
+        Array of shape (len(labels), n_timepoints).
+    """
+    labels = np.asarray(labels, dtype=np.intp)
+    detections = np.asarray(detections)
+    t = detections[:, _T].astype(np.intp)
+    label = detections[:, _CLASS].astype(np.intp)
+    # row of each detection in the output, -1 for labels not counted
+    lut = np.full(max(labels.max(initial=0), label.max(initial=0)) + 1, -1)
+    lut[labels] = np.arange(len(labels))
+    row = lut[label]
+    keep = (row >= 0) & (t >= 0) & (t < n_timepoints)
+    counts = np.bincount(
+        row[keep] * n_timepoints + t[keep],
+        minlength=len(labels) * n_timepoints,
+    )
+    return counts.reshape(len(labels), n_timepoints)
+
+
+def y_limit(counts):
+    return max(1.0, float(np.max(counts, initial=0))) * 1.2
+
+
+class EventCountPlot:
+    """Event counts per timepoint drawn into a matplotlib canvas.
+
+    Parameters
+    ----------
+    canvas : FigureCanvas
+        Canvas whose figure has a single axes.
+    """
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.ax = canvas.figure.axes[0]
+        self.lines = []
+        self.names = None
+        self.ymax = None
+        self.background = None
+        canvas.mpl_connect("draw_event", self._on_draw)
+
+    def _on_draw(self, event):
+        # cache everything but the animated lines, e.g. after a resize
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self._draw_lines()
+
+    def _draw_lines(self):
+        for line in self.lines:
+            self.ax.draw_artist(line)
+
+    def _reset(self, counts, names):
+        self.ax.cla()
+        t = np.arange(counts.shape[1])
+        self.lines = [
+            self.ax.plot(t, c, label=name, animated=True)[0]
+            for c, name in zip(counts, names)
+        ]
+        self.names = list(names)
+        self.ymax = y_limit(counts)
+        self.ax.set_xlim(0, max(1, counts.shape[1] - 1))
+        self.ax.set_ylim(0, self.ymax)
+        self.ax.set_xlabel("Time")
+        self.ax.set_ylabel("Events")
+        if len(self.lines) > 0:
+            self.ax.legend(handles=self.lines, loc="upper right")
+        self.canvas.draw()
+
+    def update(self, counts, names):
+        """Show ``counts`` (n_classes, n_timepoints) of the classes ``names``.
+
+        Only the lines are redrawn unless the layout of the plot changes.
+        """
+        counts = np.asarray(counts)
+        if (
+            self.background is None
+            or list(names) != self.names
+            or len(self.lines) == 0
+            or counts.shape[1] != len(self.lines[0].get_xdata())
+            # rescale when the counts leave the axes or shrink a lot
+            or counts.max(initial=0) > self.ymax
+            or 4 * y_limit(counts) < self.ymax
+        ):
+            self._reset(counts, names)
+            return
+        for line, c in zip(self.lines, counts):
+            line.set_ydata(c)
+        self.canvas.restore_region(self.background)
+        self._draw_lines()
+        self.canvas.blit(self.ax.bbox)
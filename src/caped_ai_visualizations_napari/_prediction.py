@@ -0,0 +1,259 @@
+"""
+Timepoint-wise prediction with oneat models.
+
+The oneat models only expose a monolithic ``predict`` that writes csv files
+once the whole movie has been processed. Here the network is driven one
+timepoint at a time, so that the plugin can stream detections to napari
+while the model is still running and stop the run between timepoints.
+
+Tiles are predicted by a pool of threads, but a Keras model is not safe to
+call from several threads at once. Calls into the network are serialized
+by a lock per model, while reading, normalizing and decoding the tiles of
+other threads overlap with them.
+"""
+import threading
+
+import numpy as np
+
+from ._normalization import normalize
+from ._profiling import span
+from ._tiling import halo_from_parameters, in_core, schedule, tile_grid
+
+# Same column order as the csv files written by oneat, with the event label
+# appended so that all event classes can live in a single array.
+DETECTION_COLUMNS = (
+    "T",
+    "Z",
+    "Y",
+    "X",
+    "Score",
+    "Size",
+    "Confidence",
+    "Class",
+)
+
+# guards the creation of the per model locks
+_MODEL_LOCKS_LOCK = threading.Lock()
+
+
+def model_lock(model):
+    """Lock to hold while calling the network of ``model``."""
+    with _MODEL_LOCKS_LOCK:
+        lock = getattr(model, "_inference_lock", None)
+        if lock is None:
+            lock = threading.Lock()
+            model._inference_lock = lock
+    return lock
+
+
+def empty_detections():
+    return np.zeros((0, len(DETECTION_COLUMNS)), dtype=np.float32)
+
+
+def boxes_to_detections(
+    boxes, key_categories, event_threshold=0.5, event_confidence=0.5
+):
+    """Convert oneat box dictionaries into a detection array.
+
+    Parameters
+    ----------
+    boxes : list of dict
+        Boxes as returned by ``volumeyoloprediction`` or ``yoloprediction``.
+    key_categories : dict
+        Mapping of event name to event label, label 0 is the background.
+    event_threshold : float
+        Minimum class score for a box to be kept.
+    event_confidence : float
+        Minimum box confidence for a box to be kept.
+
+    Returns
+    -------
+    detections : np.ndarray
+        Array of shape (N, len(DETECTION_COLUMNS)).
+    """
+    if len(boxes) == 0:
+        return empty_detections()
+
+    def column(key, default=0.0):
+        return np.fromiter(
+            (box.get(key, default) for box in boxes),
+            dtype=np.float32,
+            count=len(boxes),
+        )
+
+    t = column("real_time_event")
+    z = column("zcenter")
+    y = column("ycenter")
+    x = column("xcenter")
+    confidence = column("confidence")
+    size = (
+        np.sqrt(
+            column("height") ** 2 + column("width") ** 2 + column("depth") ** 2
+        )
+        // 3
+    )
+
+    detections = []
+    for event_name, event_label in key_categories.items():
+        if event_label == 0:
+            continue
+        score = column(event_name)
+        keep = (score >= event_threshold) & (confidence >= event_confidence)
+        if not np.any(keep):
+            continue
+        label = np.full(np.count_nonzero(keep), event_label, np.float32)
+        detections.append(
+            np.stack(
+                [
+                    t[keep],
+                    z[keep],
+                    y[keep],
+                    x[keep],
+                    score[keep],
+                    size[keep],
+                    confidence[keep],
+                    label,
+                ],
+                axis=1,
+            )
+        )
+    if len(detections) == 0:
+        return empty_detections()
+    return np.concatenate(detections)
+
+
+def prediction_timepoints(model, n_timepoints):
+    """Timepoints for which the temporal window of the model fits."""
+    size_tminus = int(getattr(model, "size_tminus", 0))
+    size_tplus = int(getattr(model, "size_tplus", 0))
+    return range(size_tminus, n_timepoints - size_tplus)
+
+
+def spatial_columns(ndim):
+    """Columns of DETECTION_COLUMNS holding the ZYX or YX coordinates."""
+    return [3 - i for i in reversed(range(ndim))]
+
+
+def time_window(model, x, t, read):
+    """Input of the network for timepoint ``t`` and spatial region ``read``.
+
+    Returns the window and the oneat event type, ``"dynamic"`` for models
+    that see the timepoints around ``t`` and ``"static"`` otherwise.
+    """
+    size_tminus = int(getattr(model, "size_tminus", 0))
+    size_tplus = int(getattr(model, "size_tplus", 0))
+    if size_tminus + size_tplus > 0:
+        window = x[(slice(t - size_tminus, t + size_tplus + 1),) + read]
+        return window, "dynamic"
+    return x[(t,) + read], "static"
+
+
+def predict_tile(model, x, t, tile, event_threshold, event_confidence):
+    """Run the network on one spatial tile of the window centred at ``t``.
+
+    ``x`` is the TZYX or TYX movie, usually a ``NormalizedImage``. Returns
+    the detections in global coordinates that fall inside the core region of
+    the tile.
+    """
+    from oneat.NEATUtils.utils import volumeyoloprediction, yoloprediction
+
+    with span("tile read", t=t):
+        window, event_type = time_window(model, x, t, tile.read)
+        window = np.asarray(window)
+    offsets = [region.start for region in tile.read]
+
+    with model_lock(model), span("tile inference", t=t):
+        prediction = model.make_patches(window)
+    with span("tile decoding", t=t):
+        boxes = []
+        for i in range(prediction.shape[0]):
+            if x.ndim == 4:
+                found = volumeyoloprediction(
+                    *offsets,
+                    prediction[i],
+                    model.stride,
+                    t,
+                    model.config,
+                    model.key_categories,
+                    model.key_cord,
+                    model.nboxes,
+                    "detection",
+                    event_type,
+                )
+            else:
+                found = yoloprediction(
+                    *offsets,
+                    prediction[i],
+                    model.stride,
+                    t,
+                    model.config,
+                    model.key_categories,
+                    model.key_cord,
+                    model.nboxes,
+                    "detection",
+                    event_type,
+                )
+            boxes += found or []
+
+        detections = boxes_to_detections(
+            boxes, model.key_categories, event_threshold, event_confidence
+        )
+    coordinates = detections[:, spatial_columns(len(tile.core))]
+    return detections[in_core(coordinates, tile.core)]
+
+
+def predict_timepoints(
+    model,
+    image,
+    n_tiles=(1, 1, 1),
+    event_threshold=0.9,
+    event_confidence=0.9,
+    norm_image=True,
+    max_workers=None,
+    stats=None,
+    per_timepoint=False,
+):
+    """Generator running ``model`` over ``image`` one timepoint at a time.
+
+    Parameters
+    ----------
+    model : NEATVollNet, NEATLRNet, NEATTResNet or NEATResNet
+        A oneat model instance.
+    image : np.ndarray
+        TZYX movie for volumetric models, TYX movie otherwise.
+    n_tiles : tuple of int
+        Number of spatial tiles per axis, see ``tile_grid``.
+    norm_image : bool
+        Percentile normalize the tiles as oneat does, see ``normalize``.
+    max_workers : int, optional
+        Number of tiles predicted concurrently, see ``schedule``.
+    stats : PercentileStats, optional
+        Intensity histograms of ``image``, computed if not given.
+    per_timepoint : bool
+        Normalize every timepoint with its own percentiles, for movies
+        whose intensity drifts, see ``NormalizedImage``.
+
+    Yields
+    ------
+    (t, detections) : tuple
+        The timepoint that was just processed and the array of detections
+        found there (see ``DETECTION_COLUMNS``). The caller may stop the
+        generator between two timepoints to abort the run.
+    """
+    x = normalize(image, norm_image, stats, per_timepoint)
+
+    if getattr(model, "model", None) is None:
+        with span("model build"):
+            model.model = model._build()
+
+    halo = halo_from_parameters(model.config, x.ndim - 1)
+    tiles = tile_grid(x.shape[1:], n_tiles, halo)
+
+    def _predict_tile(t, tile):
+        return predict_tile(
+            model, x, t, tile, event_threshold, event_confidence
+        )
+
+    timepoints = prediction_timepoints(model, x.shape[0])
+    for t, found in schedule(_predict_tile, timepoints, tiles, max_workers):
+        yield t, np.concatenate([empty_detections()] + found)
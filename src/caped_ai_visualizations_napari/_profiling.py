@@ -0,0 +1,155 @@
+"""
+Timing spans and counters of the hot paths of the plugin.
+
+Model loading, tile inference, NMS, reading and layer updates are wrapped in
+named spans. Every span is aggregated in an in-memory registry (count, total,
+mean, min and max duration per name) and the most recent ones are kept as
+events, so that a slow session can be broken down into I/O, TensorFlow and
+napari time. The registry is shown in the Performance panel of the widget
+and can be written as json or as a Chrome trace, which opens in
+``chrome://tracing`` or https://ui.perfetto.dev.
+
+Spans are cheap, two ``perf_counter`` calls and a lock, and always on.
+"""
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# number of spans kept for the trace, older ones only count in the totals
+MAX_EVENTS = 10_000
+
+
+class Metrics:
+    """Thread-safe registry of timing spans and counters.
+
+    Parameters
+    ----------
+    max_events : int
+        Number of most recent spans kept as individual events.
+    """
+
+    def __init__(self, max_events=MAX_EVENTS):
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self.stats = {}
+        self.counters = {}
+        self.events = deque(maxlen=max_events)
+
+    def record(self, name, start, seconds, **args):
+        """Add a span that started at ``start`` and took ``seconds``."""
+        with self._lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = dict(
+                    count=0, total=0.0, min=seconds, max=seconds
+                )
+            stats["count"] += 1
+            stats["total"] += seconds
+            stats["min"] = min(stats["min"], seconds)
+            stats["max"] = max(stats["max"], seconds)
+            self.events.append(
+                (name, start, seconds, threading.get_ident(), args)
+            )
+
+    @contextmanager
+    def span(self, name, **args):
+        """Time the body of a ``with`` block as span ``name``.
+
+        Keyword arguments are stored with the event, e.g. the timepoint of
+        a tile, and show up in the trace.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter() - start, **args)
+
+    def timed(self, name):
+        """Decorator timing every call of a function as span ``name``."""
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self):
+        with self._lock:
+            self.stats.clear()
+            self.counters.clear()
+            self.events.clear()
+
+    def summary(self):
+        """Aggregated spans, slowest in total first.
+
+        Returns
+        -------
+        rows : list of dict
+            ``name``, ``count`` and ``total``, ``mean``, ``min`` and ``max``
+            durations in seconds.
+        """
+        with self._lock:
+            rows = [
+                dict(name=name, mean=s["total"] / s["count"], **s)
+                for name, s in self.stats.items()
+            ]
+        return sorted(rows, key=lambda row: row["total"], reverse=True)
+
+    def to_dict(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return dict(spans=self.summary(), counters=counters)
+
+    def chrome_trace(self):
+        """Recent spans in the Chrome trace event format."""
+        pid = os.getpid()
+        with self._lock:
+            events = list(self.events)
+        return dict(
+            traceEvents=[
+                dict(
+                    name=name,
+                    ph="X",
+                    ts=(start - self._origin) * 1e6,
+                    dur=seconds * 1e6,
+                    pid=pid,
+                    tid=tid,
+                    args=args,
+                )
+                for name, start, seconds, tid, args in events
+            ],
+            displayTimeUnit="ms",
+        )
+
+    def dump(self, path, chrome_trace=None):
+        """Write the summary, or the Chrome trace, as a json file.
+
+        The trace is written if ``chrome_trace`` is true or, by default, if
+        ``path`` ends with ``.trace.json``.
+        """
+        path = str(path)
+        if chrome_trace is None:
+            chrome_trace = path.endswith(".trace.json")
+        data = self.chrome_trace() if chrome_trace else self.to_dict()
+        with open(path, "w") as f:
+            json.dump(data, f, indent=None if chrome_trace else 2, default=str)
+        return path
+
+
+# shared by the readers, the prediction and all widgets of a session
+METRICS = Metrics()
+span = METRICS.span
+timed = METRICS.timed
+count = METRICS.count
@@ -0,0 +1,179 @@
+"""
+Projection of the middle Z slices of TZYX movies.
+
+The 2D+t oneat models (NEATLRNet, NEATTResNet) see volumetric movies as the
+sum of the slices from ``start_project_mid`` below to ``end_project_mid``
+above the middle of the stack. The projection here is lazy: it is a dask
+stack over time whose frames are computed, one Z plane at a time, only when
+they are sliced, by the threads of the dask scheduler when many frames are
+needed at once. Frames are cached in a bounded LRU cache by source movie,
+Z window and method, so previews and prediction runs on the same layer
+share them.
+"""
+import itertools
+import weakref
+
+import numpy as np
+
+from ._cache import LRUCache
+from ._profiling import span
+
+PROJECTION_CACHE_BYTES = 2**30
+PROJECTION_METHODS = ("max", "mean", "sum")
+# 2D+t model classes, which see volumetric movies through a projection of
+# their middle Z planes
+PROJECTED_MODEL_CLASSES = ("NEATLRNet", "NEATTResNet", "NEATResNet")
+# planes below and above the middle plane that oneat projects by default
+START_PROJECT_MID = 4
+END_PROJECT_MID = 1
+
+# shared by all widgets of a session
+PROJECTIONS = LRUCache(PROJECTION_CACHE_BYTES)
+
+# token and lazy projections of every source movie, while it is alive
+_sources = {}
+_tokens = itertools.count()
+
+
+def mid_slices(n_z, start_project_mid, end_project_mid):
+    """Z planes projected by oneat, as a slice clipped to the stack."""
+    mid = n_z // 2
+    return slice(
+        max(0, mid - start_project_mid), min(n_z, mid + end_project_mid)
+    )
+
+
+def project_frame(image, t, z, method="max"):
+    """Projection of timepoint ``t`` over the planes ``z``.
+
+    Planes are read one at a time, sums are accumulated in float32.
+    """
+    projection = None
+    for i in range(z.start, z.stop):
+        plane = np.asarray(image[t, i])
+        if projection is None:
+            dtype = plane.dtype if method == "max" else np.float32
+            projection = plane.astype(dtype, copy=True)
+        elif method == "max":
+            np.maximum(projection, plane, out=projection)
+        else:
+            projection += plane
+    if method == "mean":
+        projection /= z.stop - z.start
+    return projection
+
+
+def _source(image):
+    # ids are only reused once the movie is gone, and its entry with it
+    entry = _sources.get(id(image))
+    if entry is None:
+        # stacks hold the movie, they must not keep it alive from here
+        entry = dict(token=next(_tokens), stacks=weakref.WeakValueDictionary())
+        try:
+            weakref.finalize(image, _sources.pop, id(image), None)
+        except TypeError:
+            return entry
+        _sources[id(image)] = entry
+    return entry
+
+
+def project_mid(
+    image, start_project_mid, end_project_mid, method="sum", cache=None
+):
+    """Lazy projection of the middle Z slices of a TZYX movie.
+
+    Parameters
+    ----------
+    image : array-like
+        TZYX movie, numpy, memory-mapped or dask.
+    start_project_mid, end_project_mid : int
+        Number of planes below and above the middle plane, see
+        ``mid_slices``.
+    method : str
+        One of ``PROJECTION_METHODS``. oneat trains its 2D+t models on the
+        sum, ``max`` is easier to look at.
+    cache : LRUCache, optional
+        Cache of the projected frames, defaults to the one of the session.
+
+    Returns
+    -------
+    projection : dask.array.Array
+        TYX stack, the same object for repeated calls with the same movie
+        and arguments while it is in use.
+    """
+    import dask.array as da
+    from dask import delayed
+
+    if method not in PROJECTION_METHODS:
+        raise ValueError(
+            f"method must be one of {PROJECTION_METHODS}, got {method!r}"
+        )
+    if len(image.shape) != 4:
+        raise ValueError(f"expected a TZYX movie, got shape {image.shape}")
+    z = mid_slices(image.shape[1], start_project_mid, end_project_mid)
+    if z.stop <= z.start:
+        raise ValueError(
+            f"no planes to project between {z.start} and {z.stop}"
+        )
+    cache = PROJECTIONS if cache is None else cache
+    source = _source(image)
+    key = (source["token"], z.start, z.stop, method, id(cache))
+    stack = source["stacks"].get(key)
+    if stack is not None:
+        return stack
+
+    def _frame(t):
+        def _project():
+            with span("project frame", t=t):
+                return project_frame(image, t, z, method)
+
+        return cache.get(key[:-1] + (t,), _project)
+
+    dtype = image.dtype if method == "max" else np.dtype(np.float32)
+    stack = da.stack(
+        [
+            da.from_delayed(
+                delayed(_frame)(t), shape=image.shape[2:], dtype=dtype
+            )
+            for t in range(image.shape[0])
+        ]
+    )
+    source["stacks"][key] = stack
+    return stack
+
+
+def model_input(
+    image,
+    model_class,
+    start_project_mid=START_PROJECT_MID,
+    end_project_mid=END_PROJECT_MID,
+    method="sum",
+    cache=None,
+):
+    """Movie that a model of ``model_class`` predicts on.
+
+    The widget and the batch command both go through here, so that a model
+    sees the same input in either.
+
+    Parameters
+    ----------
+    image : array-like
+        TZYX or TYX movie.
+    model_class : str
+        Name of the oneat model class.
+    start_project_mid, end_project_mid, method, cache
+        See ``project_mid``.
+
+    Returns
+    -------
+    x : array-like
+        The lazy projection of the middle Z planes of a TZYX movie for the
+        ``PROJECTED_MODEL_CLASSES``, otherwise ``image`` itself.
+    z : int or None
+        Middle plane of ``image``, on which the detections of a projection
+        are placed, None if ``x`` is ``image``.
+    """
+    if len(image.shape) != 4 or model_class not in PROJECTED_MODEL_CLASSES:
+        return image, None
+    x = project_mid(image, start_project_mid, end_project_mid, method, cache)
+    return x, image.shape[1] // 2
@@ -0,0 +1,216 @@
+"""
+Multiscale pyramids for large TZYX movies.
+
+Every level halves the Y and X axes of the previous one, T and Z are kept so
+that each timepoint and slice is still available at every level. The
+downsampled levels of files on disk are cached as OME-Zarr in the plugin
+cache directory when ``zarr`` is installed, otherwise they are built lazily
+with dask each time. The full resolution level is always the source image
+itself, so the cache holds about a third of its size, and the least
+recently used pyramids are removed once the cache outgrows
+``PYRAMID_CACHE_BYTES``.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import warnings
+from pathlib import Path
+
+import numpy as np
+
+from ._cache import cache_dir, cache_key, prune_cache
+
+# images whose planes are larger than this get a pyramid
+PYRAMID_MIN_SIZE = 1024
+PYRAMID_CACHE_BYTES = 16 * 2**30
+
+
+def n_levels(shape, min_size=PYRAMID_MIN_SIZE // 2):
+    """Number of levels until the YX plane fits into ``min_size``."""
+    levels = 1
+    size = max(shape[-2:])
+    while size > min_size:
+        size = (size + 1) // 2
+        levels += 1
+    return levels
+
+
+def downsample(data):
+    """Halve the last two axes with 2x2 mean pooling, lazily."""
+    import dask.array as da
+
+    data = da.asarray(data)
+    pad = [(0, 0)] * (data.ndim - 2) + [(0, s % 2) for s in data.shape[-2:]]
+    if any(p for _, p in pad):
+        data = da.pad(data, pad, mode="edge")
+    axes = {data.ndim - 2: 2, data.ndim - 1: 2}
+    coarse = da.coarsen(np.mean, data, axes, trim_excess=True)
+    return coarse.astype(data.dtype)
+
+
+def build_pyramid(data, levels=None):
+    """List of dask arrays from full resolution to the coarsest level."""
+    import dask.array as da
+
+    levels = n_levels(data.shape) if levels is None else levels
+    pyramid = [da.asarray(data)]
+    for _ in range(levels - 1):
+        pyramid.append(downsample(pyramid[-1]))
+    return pyramid
+
+
+def multiscales_metadata(pyramid, axes="TZYX", first_level=0):
+    """OME-NGFF ``multiscales`` attribute of a pyramid.
+
+    ``pyramid`` holds the levels from ``first_level`` on.
+    """
+    axes = axes[-pyramid[0].ndim :]
+    return [
+        {
+            "version": "0.4",
+            "axes": [
+                {"name": a.lower(), "type": "time" if a == "T" else "space"}
+                for a in axes
+            ],
+            "datasets": [
+                {
+                    "path": str(level),
+                    "coordinateTransformations": [
+                        {
+                            "type": "scale",
+                            "scale": [1.0] * (len(axes) - 2)
+                            + [float(2**level)] * 2,
+                        }
+                    ],
+                }
+                for level in range(first_level, first_level + len(pyramid))
+            ],
+        }
+    ]
+
+
+def write_pyramid(store, pyramid, first_level=0):
+    """Write a pyramid as an OME-Zarr group at ``store``.
+
+    ``pyramid`` holds the levels from ``first_level`` on, the arrays are
+    named after their level.
+    """
+    import dask.array as da
+    import zarr
+
+    # builds of the same pyramid in other viewers or processes write into
+    # their own temporary stores
+    store.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(dir=store.parent, suffix=".tmp"))
+    try:
+        group = zarr.open_group(str(tmp), mode="w")
+        for level, array in enumerate(pyramid, start=first_level):
+            chunks = (1,) * (array.ndim - 2) + tuple(
+                min(s, PYRAMID_MIN_SIZE) for s in array.shape[-2:]
+            )
+            da.to_zarr(array.rechunk(chunks), str(tmp / str(level)))
+        group.attrs["multiscales"] = multiscales_metadata(
+            pyramid, first_level=first_level
+        )
+        try:
+            tmp.rename(store)
+        except OSError:
+            # another build finished first
+            if not store.exists():
+                raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _fill_cache(store, pyramid, max_bytes=PYRAMID_CACHE_BYTES):
+    # the cache is best effort, a failed write only costs a rebuild later
+    try:
+        write_pyramid(store, pyramid[1:], first_level=1)
+    except Exception as e:
+        warnings.warn(f"could not cache pyramid in {store}: {e}")
+    prune_cache(store.parent, max_bytes, keep=store)
+
+
+def _cached_levels(store):
+    """Levels from 1 on stored in ``store``, None for another layout."""
+    import dask.array as da
+    import zarr
+
+    try:
+        group = zarr.open_group(str(store), mode="r")
+        paths = [d["path"] for d in group.attrs["multiscales"][0]["datasets"]]
+        if paths != [str(level) for level in range(1, len(paths) + 1)]:
+            return None
+        return [da.from_zarr(group[path]) for path in paths]
+    except (KeyError, IndexError, TypeError, ValueError, OSError):
+        return None
+
+
+def cached_pyramid(
+    paths, data, levels=None, background=True, max_bytes=PYRAMID_CACHE_BYTES
+):
+    """Pyramid of the image stored in ``paths``, its downsampled levels
+    cached as OME-Zarr.
+
+    Parameters
+    ----------
+    paths : list of str
+        Source files, used to key the cache.
+    data : array-like
+        Full resolution image, possibly a dask array, used as the first
+        level of the pyramid.
+    levels : int, optional
+        Number of levels, see ``n_levels``.
+    background : bool
+        On a cache miss, return the lazily computed pyramid right away and
+        fill the cache in a background thread instead of waiting for it.
+    max_bytes : int
+        Size of the pyramid cache above which the least recently used
+        pyramids are removed.
+
+    Returns
+    -------
+    pyramid : list of dask arrays
+    """
+    try:
+        import zarr  # noqa: F401
+    except ImportError:
+        return build_pyramid(data, levels)
+    import dask.array as da
+
+    key = hashlib.sha1(
+        ":".join(cache_key(path) for path in paths).encode()
+    ).hexdigest()
+    store = cache_dir() / "pyramids" / f"{key}.ome.zarr"
+    if store.exists():
+        cached = _cached_levels(store)
+        if cached is not None:
+            # the modification time orders the pyramids by their last use
+            os.utime(store)
+            return [da.asarray(data)] + cached
+        # a store with another layout is built again
+        shutil.rmtree(store, ignore_errors=True)
+
+    pyramid = build_pyramid(data, levels)
+    if len(pyramid) == 1:
+        return pyramid
+    if background:
+        threading.Thread(
+            target=_fill_cache, args=(store, pyramid, max_bytes), daemon=True
+        ).start()
+        return pyramid
+    _fill_cache(store, pyramid, max_bytes)
+    return cached_pyramid(paths, data, levels)
+
+
+def select_level(pyramid, max_size):
+    """Finest level whose YX plane fits into ``max_size`` pixels per axis.
+
+    Falls back to the coarsest level if none fits.
+    """
+    for level, data in enumerate(pyramid):
+        if max(data.shape[-2:]) <= max_size:
+            return level
+    return len(pyramid) - 1
@@ -5,10 +5,32 @@ It implements the Reader specification, but your plugin may choose to
 implement multiple readers or even other plugin contributions. see:
 https://napari.org/stable/plugins/guides.html?#readers
 """
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
 import numpy as np
-import pandas as pd
-from oneat.NEATUtils.utils import load_json
-from tifffile import imread
+from tifffile import TiffFile, imread, memmap
+
+from ._cache import cached_columns, load_columns
+from ._profiling import timed
+from ._pyramid import PYRAMID_MIN_SIZE, cached_pyramid
+
+# columns of the detection csv files written by oneat
+DETECTION_DTYPES = {
+    "T": np.int32,
+    "Z": np.float32,
+    "Y": np.float32,
+    "X": np.float32,
+    "Score": np.float32,
+    "Size": np.float32,
+    "Confidence": np.float32,
+}
+CSV_CHUNKSIZE = 1_000_000
+# image files larger than this are opened as lazy dask arrays
+LAZY_BYTES = 2**30
+IMAGE_SUFFIXES = (".tif", ".tiff", ".TIF", ".TIFF")
 
 
 def napari_get_reader(path):
@@ -32,35 +54,271 @@ def napari_get_reader(path):
         path = path[0]
 
     # if we know we cannot read the file, we immediately return None.
-    if isinstance(path, str) and path.endswith(
-        [".tif", ".tiff", ".TIF", ".TIFF"]
-    ):
+    if isinstance(path, str) and os.path.isdir(path):
+        return directory_reader_function
+    if isinstance(path, str) and path.endswith(IMAGE_SUFFIXES):
         return image_reader_function
-    if isinstance(path, str) and path.endswith([".json"]):
-        return json_reader_function
-    if isinstance(path, str) and path.endswith([".csv"]):
+    if isinstance(path, str) and path.endswith(".csv"):
         return csv_reader_function
+    if isinstance(path, str) and path.endswith(".npy"):
+        # only structured arrays hold detections, other numpy files are
+        # left to the readers that claim them
+        return npy_reader_function if is_detection_npy(path) else None
 
     else:
         # otherwise we return none.
         return None
 
 
-def json_reader_function(path):
+def is_detection_npy(path):
+    """Whether ``path`` holds a structured array, read from its header."""
+    try:
+        return np.load(path, mmap_mode="r").dtype.names is not None
+    except (OSError, ValueError):
+        return False
+
+
+def discover_results(folder):
+    """Group the files of a oneat result folder.
+
+    Detection csv files are written by oneat as
+    ``oneat_<event>_locations_<image stem>.csv`` and are matched to the
+    image with the longest stem they end with.
+
+    Returns
+    -------
+    groups : dict
+        Image stem to ``dict(image=path or None, csv=[paths])``, csv files
+        without a matching image are grouped under the stem ``None``.
+    configs : list of Path
+        The json files of the folder.
+    """
+    files = sorted(f for f in Path(folder).iterdir() if f.is_file())
+    groups = {
+        f.stem: dict(image=f, csv=[])
+        for f in files
+        if f.name.endswith(IMAGE_SUFFIXES)
+    }
+    stems = sorted(groups, key=len, reverse=True)
+    for f in files:
+        if f.suffix != ".csv":
+            continue
+        stem = next((s for s in stems if f.stem.endswith(s)), None)
+        groups.setdefault(stem, dict(image=None, csv=[]))["csv"].append(f)
+    configs = [f for f in files if f.suffix == ".json"]
+    return groups, configs
 
-    data = load_json(path)
 
-    return [(data)]
+def directory_reader_function(path, max_workers=None):
+    """Read a whole oneat result folder.
 
+    Images, detection csv files and json configs are loaded concurrently in
+    a thread pool. Every image is followed by the points layers of its
+    detections, which carry the json configs of the folder and the name of
+    their image in the layer metadata.
 
-def csv_reader_function(path):
+    Parameters
+    ----------
+    path : str
+        Path to the folder.
+    max_workers : int, optional
+        Number of files read at the same time.
 
-    data = pd.read_csv(path, delimiter=",")
+    Returns
+    -------
+    layer_data : list of tuples
+    """
+    groups, configs = discover_results(path)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        configs = {f.stem: executor.submit(load_json, str(f)) for f in configs}
+        futures = []
+        for stem, group in groups.items():
+            image = None
+            if group["image"] is not None:
+                image = executor.submit(
+                    image_reader_function, str(group["image"])
+                )
+            detections = [
+                executor.submit(csv_reader_function, str(f))
+                for f in group["csv"]
+            ]
+            futures.append((stem, image, detections))
+        configs = {stem: future.result() for stem, future in configs.items()}
 
-    return [(data)]
+        layer_data = []
+        for stem, image, detections in futures:
+            if image is not None:
+                for data, add_kwargs, layer_type in image.result():
+                    add_kwargs.setdefault("name", stem)
+                    layer_data.append((data, add_kwargs, layer_type))
+            for future in detections:
+                for data, add_kwargs, layer_type in future.result():
+                    # a config named image.json must not hide the image
+                    add_kwargs["metadata"] = {**configs, "image": stem}
+                    layer_data.append((data, add_kwargs, layer_type))
+    return layer_data
 
 
-def image_reader_function(path):
+def load_json(path):
+    # same as the oneat helper, without importing oneat and tensorflow
+    with open(path) as f:
+        return json.load(f)
+
+
+@timed("read csv")
+def read_detections(path, score_threshold=None, chunksize=CSV_CHUNKSIZE):
+    """Read a oneat detection csv file chunk by chunk.
+
+    Parameters
+    ----------
+    path : str
+        Path to a csv file with the columns written by oneat, ``Z`` is
+        absent for 2D+t models.
+    score_threshold : float, optional
+        Rows with a lower ``Score`` are dropped while reading.
+    chunksize : int
+        Number of rows parsed at a time.
+
+    Returns
+    -------
+    columns : dict
+        Column name to array, typed as in ``DETECTION_DTYPES``.
+    """
+    import pandas as pd
+
+    header = pd.read_csv(path, delimiter=",", nrows=0).columns
+    dtypes = {k: v for k, v in DETECTION_DTYPES.items() if k in header}
+    chunks = {name: [] for name in dtypes}
+    reader = pd.read_csv(
+        path,
+        delimiter=",",
+        usecols=list(dtypes),
+        dtype=dtypes,
+        chunksize=chunksize,
+    )
+    with reader:
+        for chunk in reader:
+            if score_threshold is not None:
+                chunk = chunk[chunk["Score"].to_numpy() >= score_threshold]
+            for name in dtypes:
+                chunks[name].append(chunk[name].to_numpy())
+    return {
+        name: np.concatenate([np.zeros(0, dtype=dtypes[name])] + chunks[name])
+        for name in dtypes
+    }
+
+
+@timed("load detections")
+def load_detections(path, score_threshold=None):
+    """Detection columns of a csv file, through the binary sidecar cache.
+
+    The first load parses the csv file with ``read_detections`` and stores
+    it in the cache, later loads memory-map the cached columns.
+    """
+    columns = cached_columns(path, read_detections)
+    if score_threshold is not None:
+        keep = columns["Score"] >= score_threshold
+        columns = {name: c[keep] for name, c in columns.items()}
+    return columns
+
+
+def detections_to_points(columns, name):
+    """Points layer data tuple of detection columns."""
+    axes = [a for a in ("C", "T", "Z", "Y", "X") if a in columns]
+    coords = np.empty((len(columns[axes[0]]), len(axes)), dtype=np.float32)
+    for i, axis in enumerate(axes):
+        coords[:, i] = columns[axis]
+    # every other column, e.g. exported layer features, is a feature
+    features = {k: v for k, v in columns.items() if k not in axes}
+    add_kwargs = dict(
+        name=name,
+        features=features,
+        face_color="red",
+        opacity=0.5,
+    )
+    return (coords, add_kwargs, "points")
+
+
+def csv_reader_function(path, score_threshold=None):
+    """Read oneat detection csv files as points layers.
+
+    Parameters
+    ----------
+    path : str or list of str
+        Path to file, or list of paths.
+    score_threshold : float, optional
+        Detections with a lower score are skipped while reading.
+
+    Returns
+    -------
+    layer_data : list of tuples
+        One points layer data tuple per file, with the ``Score``, ``Size``
+        and ``Confidence`` columns as per point features.
+    """
+    paths = [path] if isinstance(path, str) else path
+    return [
+        detections_to_points(
+            load_detections(_path, score_threshold=score_threshold),
+            name=Path(_path).stem,
+        )
+        for _path in paths
+    ]
+
+
+def npy_reader_function(path):
+    """Read detections exported by ``write_multiple`` as points layers."""
+    paths = [path] if isinstance(path, str) else path
+    return [
+        detections_to_points(load_columns(_path), name=Path(_path).stem)
+        for _path in paths
+    ]
+
+
+def read_stack(paths):
+    """Read tiff files into a single preallocated array."""
+    first = imread(paths[0])
+    if len(paths) == 1:
+        return first
+    data = np.empty((len(paths),) + first.shape, dtype=first.dtype)
+    data[0] = first
+    for i, _path in enumerate(paths[1:], start=1):
+        imread(_path, out=data[i])
+    return data
+
+
+def lazy_imread(path):
+    """Dask array of a tiff file that reads one plane at a time.
+
+    Uncompressed, contiguous files are memory-mapped, for all others every
+    page becomes a delayed read, so that only the planes napari displays
+    are ever loaded.
+    """
+    import dask.array as da
+    from dask import delayed
+
+    try:
+        data = memmap(path, mode="r")
+    except ValueError:
+        pass
+    else:
+        planes = (1,) * (data.ndim - 2) + data.shape[-2:]
+        return da.from_array(data, chunks=planes)
+
+    with TiffFile(path) as tif:
+        series = tif.series[0]
+        shape, dtype, n_pages = series.shape, series.dtype, len(series.pages)
+        page_shape = series.keyframe.shape
+    if n_pages * int(np.prod(page_shape)) != int(np.prod(shape)):
+        return da.from_delayed(delayed(imread)(path), shape, dtype)
+    pages = [
+        da.from_delayed(delayed(imread)(path, key=i), page_shape, dtype)
+        for i in range(n_pages)
+    ]
+    return da.stack(pages).reshape(shape)
+
+
+@timed("read image")
+def image_reader_function(path, lazy=None):
     """Take a path or list of paths and return a list of LayerData tuples.
 
     Readers are expected to return data as a list of tuples, where each tuple
@@ -71,6 +329,11 @@ def image_reader_function(path):
     ----------
     path : str or list of str
         Path to file, or list of paths.
+    lazy : bool, optional
+        Return a dask array that only reads the planes being displayed.
+        By default files larger than ``LAZY_BYTES`` in total are read
+        lazily. Lazy images with planes larger than ``PYRAMID_MIN_SIZE``
+        are returned as a multiscale pyramid.
 
     Returns
     -------
@@ -84,13 +347,24 @@ def image_reader_function(path):
     """
     # handle both a string and a list of strings
     paths = [path] if isinstance(path, str) else path
-    # load all files into array
-    arrays = [imread(_path) for _path in paths]
-    # stack arrays into single array
-    data = np.squeeze(np.stack(arrays))
+    if lazy is None:
+        lazy = sum(os.path.getsize(_path) for _path in paths) > LAZY_BYTES
+    if lazy:
+        import dask.array as da
+
+        # stack per file dask arrays, nothing is read until displayed
+        arrays = [lazy_imread(_path) for _path in paths]
+        data = arrays[0] if len(arrays) == 1 else da.stack(arrays)
+    else:
+        # load all files into a single array
+        data = read_stack(paths)
+    data = data.squeeze()
 
     # optional kwargs for the corresponding viewer.add_* method
     add_kwargs = {}
+    if lazy and data.ndim >= 2 and max(data.shape[-2:]) > PYRAMID_MIN_SIZE:
+        data = cached_pyramid(paths, data)
+        add_kwargs["multiscale"] = True
 
     layer_type = "image"  # optional, default is "image"
     return [(data, add_kwargs, layer_type)]
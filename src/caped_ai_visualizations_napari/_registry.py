@@ -0,0 +1,66 @@
+"""
+Lazy access to the oneat model classes and their pretrained registries.
+
+Importing a oneat model module imports tensorflow, which takes seconds. The
+widget therefore only refers to the model classes by name and resolves them
+here on first use, typically from a background thread started when the
+widget is created, so that the dock widget appears right away.
+"""
+import functools
+import importlib
+import warnings
+
+# name of each oneat model class and the module that defines it, not every
+# oneat release ships all of them
+MODEL_MODULES = {
+    "NEATVollNet": "oneat.NEATModels.neat_vollnet",
+    "NEATLRNet": "oneat.NEATModels.neat_lstm",
+    "NEATTResNet": "oneat.NEATModels.neat_dynamic_resnet",
+    "NEATResNet": "oneat.NEATModels.neat_static_resnet",
+}
+
+
+def load_model_class(name):
+    """The oneat model class called ``name``, importing it if needed."""
+    return getattr(importlib.import_module(MODEL_MODULES[name]), name)
+
+
+@functools.lru_cache(maxsize=None)
+def _registered_models(name):
+    from oneat.pretrained import get_registered_models
+
+    models, aliases = get_registered_models(load_model_class(name))
+    return tuple(
+        ((aliases[m][0] if len(aliases[m]) > 0 else m), m) for m in models
+    )
+
+
+def registered_models(name):
+    """Pretrained models of a class as ``(alias, key)`` combo box choices."""
+    return list(_registered_models(name))
+
+
+def load_registries():
+    """Choices of every model class, importing oneat on the first call.
+
+    Classes that the installed oneat does not provide are left out with a
+    warning, so that the others can still be chosen.
+    """
+    registries = {}
+    for name in MODEL_MODULES:
+        try:
+            registries[name] = registered_models(name)
+        except (ImportError, AttributeError) as e:
+            warnings.warn(f"oneat model class {name} is not available: {e}")
+    return registries
+
+
+def get_model_folder(name, model, progress=None):
+    """Resolve, and download if needed, the folder of a pretrained model.
+
+    ``progress`` receives the bytes downloaded and the total, see
+    ``DownloadManager.fetch_all``.
+    """
+    from ._download import download_model
+
+    return download_model(name, model, progress)
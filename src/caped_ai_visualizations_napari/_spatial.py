@@ -0,0 +1,220 @@
+"""
+Spatial index of detections for viewport and pick queries.
+
+Masking every detection of a movie to find those in the field of view, or
+the one under the mouse, costs a pass over the whole table for each camera
+move. Here the detections are instead sorted once by timepoint and then by
+the cell of a regular YX grid they fall into, so that every row of grid
+cells of one timepoint is a contiguous run of the sorted table. A box query
+binary searches one run per row of cells it overlaps, a pick only the
+cells within its radius, and only the candidates found are tested exactly.
+"""
+import numpy as np
+
+from ._prediction import DETECTION_COLUMNS, spatial_columns
+
+_T = DETECTION_COLUMNS.index("T")
+
+# side of the grid cells in pixels, about the size of a cell nucleus
+CELL_SIZE = 32.0
+
+
+def _runs(starts, stops):
+    """Concatenated ``range(start, stop)`` of every run, as one array."""
+    lengths = stops - starts
+    n = int(lengths.sum())
+    if n == 0:
+        return np.zeros(0, dtype=np.intp)
+    # every position is its run start plus its offset within the run
+    offsets = np.arange(n) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(starts, lengths) + offsets
+
+
+class SpatialIndex:
+    """Detections sorted by timepoint and YX grid cell.
+
+    Parameters
+    ----------
+    detections : np.ndarray
+        Array of shape (N, len(DETECTION_COLUMNS)).
+    ndim : int
+        4 for TZYX movies, 3 for TYX movies.
+    cell_size : float
+        Side of the grid cells.
+
+    Attributes
+    ----------
+    order : np.ndarray
+        Rows of ``detections`` in index order, query results are positions
+        in this order.
+    t : np.ndarray
+        Timepoint of each detection, in index order.
+    coordinates : np.ndarray
+        ZYX or YX coordinates of each detection, in index order.
+    """
+
+    def __init__(self, detections, ndim, cell_size=CELL_SIZE):
+        detections = np.asarray(detections, dtype=np.float32)
+        self.cell_size = float(cell_size)
+        t = np.rint(detections[:, _T]).astype(np.int64)
+        coordinates = detections[:, spatial_columns(ndim - 1)]
+        cells = np.floor(coordinates[:, -2:] / self.cell_size)
+        cells = cells.astype(np.int64)
+        self.t_min = int(t.min()) if len(t) else 0
+        self.cell_min = cells.min(axis=0) if len(t) else np.zeros(2, int)
+        self.n_cells = (
+            cells.max(axis=0) - self.cell_min + 1
+            if len(t)
+            else np.ones(2, int)
+        )
+        keys = self._keys(t, cells[:, 0], cells[:, 1])
+        self.order = np.argsort(keys, kind="stable")
+        self.keys = keys[self.order]
+        self.t = t[self.order]
+        self.coordinates = coordinates[self.order]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _keys(self, t, cy, cx):
+        # cells outside the grid are clipped to its border, which only adds
+        # candidates that the exact test removes
+        ny, nx = (int(n) for n in self.n_cells)
+        cy = np.clip(cy - self.cell_min[0], 0, ny - 1)
+        cx = np.clip(cx - self.cell_min[1], 0, nx - 1)
+        return ((np.asarray(t, np.int64) - self.t_min) * ny + cy) * nx + cx
+
+    def _cells(self, t, lo, hi):
+        """Positions of the detections at ``t`` in the cells over a box."""
+        c_lo = np.floor(np.asarray(lo, float) / self.cell_size).astype(int)
+        c_hi = np.floor(np.asarray(hi, float) / self.cell_size).astype(int)
+        c_lo = np.maximum(c_lo, self.cell_min)
+        c_hi = np.minimum(c_hi, self.cell_min + self.n_cells - 1)
+        if np.any(c_hi < c_lo):
+            return np.zeros(0, dtype=np.intp)
+        rows = np.arange(c_lo[0], c_hi[0] + 1)
+        starts = np.searchsorted(
+            self.keys, self._keys(t, rows, c_lo[1]), side="left"
+        )
+        stops = np.searchsorted(
+            self.keys, self._keys(t, rows, c_hi[1]), side="right"
+        )
+        return _runs(starts, stops)
+
+    def pairs(self, t, points, radius):
+        """Query points and the detections at ``t`` within ``radius``.
+
+        Every point is looked up in the cells of the grid rows around it,
+        all points at once.
+
+        Parameters
+        ----------
+        t : int
+            Timepoint of the detections.
+        points : np.ndarray
+            Array of shape (M, ndim - 1), ZYX or YX coordinates.
+        radius : float
+            Largest distance, measured over all coordinates.
+
+        Returns
+        -------
+        query, positions, distances : np.ndarray
+            Row of the point, position of the detection in index order and
+            their distance, for every pair.
+        """
+        points = np.asarray(points, dtype=float).reshape(len(points), -1)
+        empty = np.zeros(0, dtype=np.intp)
+        if len(self) == 0 or not self.t_min <= t <= self.t[-1]:
+            return empty, empty, np.zeros(0)
+        k = int(np.ceil(radius / self.cell_size))
+        cells = np.floor(points[:, -2:] / self.cell_size).astype(np.int64)
+        rows = (cells[:, :1] + np.arange(-k, k + 1)).ravel()
+        query = np.repeat(np.arange(len(points)), 2 * k + 1)
+        c_lo = np.repeat(cells[:, 1] - k, 2 * k + 1)
+        c_hi = np.repeat(cells[:, 1] + k, 2 * k + 1)
+        # rows clipped to the grid would repeat its border rows
+        valid = (rows >= self.cell_min[0]) & (
+            rows < self.cell_min[0] + self.n_cells[0]
+        )
+        rows, query, c_lo, c_hi = (a[valid] for a in (rows, query, c_lo, c_hi))
+        starts = np.searchsorted(
+            self.keys, self._keys(t, rows, c_lo), side="left"
+        )
+        stops = np.searchsorted(
+            self.keys, self._keys(t, rows, c_hi), side="right"
+        )
+        stops = np.maximum(starts, stops)
+        positions = _runs(starts, stops)
+        query = np.repeat(query, stops - starts)
+        distances = np.linalg.norm(
+            self.coordinates[positions] - points[query], axis=1
+        )
+        close = distances <= radius
+        return query[close], positions[close], distances[close]
+
+    def at(self, t):
+        """Slice of the positions of the detections at timepoint ``t``."""
+        start = np.searchsorted(self.t, t, side="left")
+        stop = np.searchsorted(self.t, t, side="right")
+        return slice(int(start), int(stop))
+
+    def in_view(self, t, lo, hi):
+        """Positions of the detections at ``t`` inside a YX box.
+
+        Parameters
+        ----------
+        t : int
+            Timepoint.
+        lo, hi : sequence of float
+            Corners of the box, (y, x) inclusive.
+
+        Returns
+        -------
+        positions : np.ndarray
+            Sorted positions in index order, see ``order``.
+        """
+        if len(self) == 0 or not self.t_min <= t <= self.t[-1]:
+            return np.zeros(0, dtype=np.intp)
+        positions = self._cells(t, lo, hi)
+        yx = self.coordinates[positions, -2:]
+        inside = np.all((yx >= lo) & (yx <= hi), axis=1)
+        return positions[inside]
+
+    def nearest(self, t, point, radius=CELL_SIZE):
+        """Position of the detection at ``t`` closest to ``point``.
+
+        ``point`` holds the ZYX or YX coordinates of the detections, the
+        distance is measured over all of them. Returns None if there is no
+        detection within ``radius``.
+        """
+        point = np.asarray(point, dtype=float)
+        candidates = self.in_view(t, point[-2:] - radius, point[-2:] + radius)
+        if len(candidates) == 0:
+            return None
+        distances = np.linalg.norm(
+            self.coordinates[candidates] - point, axis=1
+        )
+        best = int(np.argmin(distances))
+        if distances[best] > radius:
+            return None
+        return int(candidates[best])
+
+
+def viewer_camera(viewer):
+    """Camera of a napari viewer, which moved to its scene in napari 0.9."""
+    scene = getattr(viewer, "scene", None)
+    return viewer.camera if scene is None else scene.camera
+
+
+def view_box(viewer):
+    """YX corners of the field of view of a 2D napari viewer, in world
+    coordinates, or None if the canvas shows a 3D view.
+    """
+    if viewer.dims.ndisplay != 2:
+        return None
+    canvas = getattr(viewer, "canvas", None)
+    size = canvas.size if canvas is not None else viewer._canvas_size
+    camera = viewer_camera(viewer)
+    centre = np.asarray(camera.center[-2:], dtype=float)
+    half = np.asarray(size, dtype=float) / camera.zoom / 2
+    return centre - half, centre + half
@@ -0,0 +1,11 @@
+import pytest
+
+from caped_ai_visualizations_napari._cache import CACHE_ENV
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Keep the on-disk caches of the plugin out of the user directory."""
+    path = tmp_path / "cache"
+    monkeypatch.setenv(CACHE_ENV, str(path))
+    return path
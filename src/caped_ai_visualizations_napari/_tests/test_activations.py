@@ -0,0 +1,79 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from caped_ai_visualizations_napari._activations import (
+    ActivationExtractor,
+    network_input,
+)
+from caped_ai_visualizations_napari._cache import LRUCache
+
+
+def test_network_input_matches_make_patches_layout():
+    window = np.arange(3 * 4 * 5).reshape(3, 4, 5)
+    batch = network_input(window, "dynamic")
+    assert batch.shape == (1, 4, 5, 3)
+    # a reshape as in oneat, not a transpose
+    np.testing.assert_array_equal(batch.ravel(), window.ravel())
+    assert network_input(window[0], "static").shape == (1, 4, 5, 1)
+
+
+def make_model(size_tminus=1, size_tplus=1):
+    keras = pytest.importorskip("tensorflow").keras
+    network = keras.Sequential(
+        [
+            keras.Input((None, None, size_tminus + size_tplus + 1)),
+            keras.layers.Conv2D(4, 3, padding="same", name="conv"),
+            keras.layers.MaxPooling2D(2, name="pool"),
+        ]
+    )
+    return SimpleNamespace(
+        model=network,
+        config={"imagey": 8, "imagex": 8},
+        size_tminus=size_tminus,
+        size_tplus=size_tplus,
+    )
+
+
+def test_tiled_activations_match_whole_image():
+    # dynamic windows are scrambled by the reshape, so tiles only agree
+    # with the whole image for static models
+    model = make_model(0, 0)
+    x = np.random.default_rng(0).random((5, 32, 48)).astype(np.float32)
+    whole = ActivationExtractor(model, x, "whole", norm_image=False)
+    tiled = ActivationExtractor(
+        model, x, "tiled", n_tiles=(2, 3), norm_image=False
+    )
+    assert len(tiled.tiles) == 6
+    assert whole.layer_names() == ["conv", "pool"]
+
+    maps, scale = whole.activations(0, 2)
+    assert maps.shape == (4, 32, 48) and scale == (1.0, 1.0)
+    np.testing.assert_allclose(tiled.activations(0, 2)[0], maps, atol=1e-5)
+
+    maps, scale = tiled.activations(1, 2)
+    assert maps.shape == (4, 16, 24) and scale == (2.0, 2.0)
+    np.testing.assert_allclose(maps, whole.activations(1, 2)[0], atol=1e-5)
+
+
+def test_activation_stack_is_lazy_and_cached():
+    model = make_model()
+    x = np.random.default_rng(0).random((5, 16, 16)).astype(np.float32)
+    cache = LRUCache(2**20)
+    extractor = ActivationExtractor(
+        model, x, "movie", norm_image=False, cache=cache
+    )
+    stack, scale = extractor.stack(1, 2)
+    assert stack.shape == (4, 5, 8, 8)
+    assert scale == (1.0, 1.0, 2.0, 2.0)
+    assert len(cache) == 1
+
+    np.testing.assert_array_equal(
+        stack[:, 2].compute(), extractor.activations(1, 2)[0]
+    )
+    assert len(cache) == 1
+    # no temporal window at the first timepoint
+    assert not stack[:, 0].compute().any()
+    assert stack[:, 3].compute().any()
+    assert len(cache) == 2
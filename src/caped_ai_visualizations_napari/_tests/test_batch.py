@@ -0,0 +1,172 @@
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from tifffile import imwrite
+
+from caped_ai_visualizations_napari import _batch, _prediction
+from caped_ai_visualizations_napari._projection import model_input
+from caped_ai_visualizations_napari._reader import (
+    csv_reader_function,
+    npy_reader_function,
+)
+
+key_categories = {"Normal": 0, "Division": 1, "Apoptosis": 2}
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    model = SimpleNamespace(
+        model=object(),
+        config={"imagez": 4, "imagey": 8, "imagex": 8},
+        size_tminus=1,
+        size_tplus=1,
+        key_categories=key_categories,
+    )
+    loads = []
+
+    def load_model(model_class, model_name=None, folder=None):
+        loads.append((model_class, model_name, folder))
+        return model
+
+    def predict_tile(model, x, t, tile, event_threshold, event_confidence):
+        # one division per timepoint, far enough apart to survive NMS
+        detections = np.zeros((1, len(_prediction.DETECTION_COLUMNS)))
+        detections[0, :4] = [t, 1, 4 * t, 3]
+        detections[0, 4:] = [0.95, 3, 1, 1]
+        return detections.astype(np.float32)
+
+    monkeypatch.setattr(_batch, "load_model", load_model)
+    monkeypatch.setattr(_prediction, "predict_tile", predict_tile)
+    return loads
+
+
+def test_predict_movies_resumes(tmp_path, fake_model):
+    movies = tmp_path / "movies"
+    movies.mkdir()
+    for name in ("a", "b"):
+        imwrite(str(movies / f"{name}.tif"), np.zeros((6, 2, 32, 32)))
+    output = tmp_path / "results"
+
+    entries, failed = _batch.predict_movies(
+        [str(movies / "*.tif")],
+        output,
+        "NEATVollNet",
+        model="m1",
+        formats=("csv", "npy"),
+        norm_image=False,
+        nms_time=0,
+    )
+    assert failed == []
+    assert [e["detections"] for e in entries] == [4, 4]
+    assert fake_model == [("NEATVollNet", "m1", None)]
+
+    division = output / "oneat_Division_locations_a.csv"
+    assert (output / "oneat_Apoptosis_locations_a.csv").exists()
+    data, add_kwargs, _ = csv_reader_function(str(division))[0]
+    np.testing.assert_array_equal(data[:, 0], [1, 2, 3, 4])
+    np.testing.assert_allclose(add_kwargs["features"]["Score"], 0.95)
+    data, _, _ = npy_reader_function(str(output / "oneat_detections_b.npy"))[0]
+    assert data.shape == (4, 4)
+
+    # finished movies are skipped, changed or new ones processed
+    def rerun(**kwargs):
+        kwargs = {
+            **dict(model="m1", norm_image=False, nms_time=0),
+            **kwargs,
+        }
+        entries, _ = _batch.predict_movies(
+            [str(movies)], output, "NEATVollNet", **kwargs
+        )
+        return {Path(e["movie"]).stem: e["detections"] for e in entries}
+
+    assert rerun() == {}
+    imwrite(str(movies / "b.tif"), np.zeros((8, 2, 32, 32)))
+    assert rerun() == {"b": 6}
+
+    # as are movies processed with another model or other parameters
+    assert set(rerun(nms_time=2)) == {"a", "b"}
+    assert set(rerun(nms_time=2, model="m2")) == {"a", "b"}
+    # or without the requested outputs
+    assert set(rerun(nms_time=2, model="m2", formats=("npy",))) == {"a", "b"}
+    assert rerun(nms_time=2, model="m2", formats=("npy",)) == {}
+    # the normalization is part of the settings
+    per_timepoint = rerun(
+        nms_time=2, model="m2", formats=("npy",), per_timepoint=True
+    )
+    assert set(per_timepoint) == {"a", "b"}
+
+
+def test_main_reports_failures(tmp_path, fake_model):
+    imwrite(str(tmp_path / "flat.tif"), np.zeros((32, 32)))
+    argv = [str(tmp_path / "flat.tif"), "-o", str(tmp_path / "out")]
+    assert _batch.main(argv + ["--pretrained", "m1", "--no-norm"]) == 1
+    with pytest.raises(SystemExit):
+        _batch.main(argv)
+
+
+def test_2d_models_see_the_widget_projection(
+    tmp_path, fake_model, monkeypatch
+):
+    movie = np.broadcast_to(
+        np.arange(6, dtype=np.uint16)[None, :, None, None], (5, 6, 32, 32)
+    )
+    imwrite(str(tmp_path / "a.tif"), np.ascontiguousarray(movie))
+    seen = []
+    predict_tile = _prediction.predict_tile
+
+    def record_tile(model, x, t, tile, event_threshold, event_confidence):
+        seen.append((len(x.shape), float(np.asarray(x[t]).max())))
+        return predict_tile(
+            model, x, t, tile, event_threshold, event_confidence
+        )
+
+    monkeypatch.setattr(_prediction, "predict_tile", record_tile)
+    entries, failed = _batch.predict_movies(
+        [str(tmp_path / "a.tif")],
+        tmp_path / "out",
+        "NEATLRNet",
+        model="m1",
+        formats=("npy",),
+        norm_image=False,
+        nms_time=0,
+        start_project_mid=2,
+        end_project_mid=1,
+    )
+    assert failed == []
+    # the sum of the planes 1 to 3, as the widget projects them
+    x, z_mid = model_input(movie, "NEATLRNet", 2, 1)
+    assert z_mid == 3
+    assert set(seen) == {(3, float(np.asarray(x[0]).max()))}
+    assert seen[0][1] == 1 + 2 + 3
+
+    data, _, _ = npy_reader_function(entries[0]["outputs"][0])[0]
+    assert data.shape[1] == 4
+    np.testing.assert_array_equal(data[:, 1], z_mid)
+
+
+def test_movies_are_read_lazily(tmp_path, fake_model, monkeypatch):
+    import dask.array as da
+
+    imwrite(str(tmp_path / "a.tif"), np.zeros((4, 6, 16, 16), np.uint16))
+    seen = []
+    predict_tile = _prediction.predict_tile
+
+    def record_tile(model, x, t, tile, event_threshold, event_confidence):
+        seen.append(type(getattr(x, "image", x)))
+        return predict_tile(
+            model, x, t, tile, event_threshold, event_confidence
+        )
+
+    monkeypatch.setattr(_prediction, "predict_tile", record_tile)
+    _, failed = _batch.predict_movies(
+        [str(tmp_path / "a.tif")],
+        tmp_path / "out",
+        "NEATVollNet",
+        model="m1",
+        formats=("npy",),
+    )
+    assert failed == []
+    assert len(seen) > 0
+    assert all(issubclass(kind, da.Array) for kind in seen)
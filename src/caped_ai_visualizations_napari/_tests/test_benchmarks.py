@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from caped_ai_visualizations_napari import _benchmarks
+from caped_ai_visualizations_napari._benchmarks import (
+    CASES,
+    compare,
+    run_benchmarks,
+)
+
+SHAPE = (3, 2, 32, 32)
+N = 500
+
+
+def test_run_benchmarks_on_small_data():
+    results = run_benchmarks(shape=SHAPE, n=N, repeat=1)
+    assert set(results) == set(CASES)
+    for result in results.values():
+        assert result["seconds"] > 0
+        assert result["peak_bytes"] >= 0
+
+
+def test_compare_flags_slower_and_larger_cases():
+    baseline = {
+        "nms": dict(seconds=1.0, peak_bytes=1000),
+        "boxes": dict(seconds=1.0, peak_bytes=1000),
+    }
+    results = {
+        "nms": dict(seconds=1.4, peak_bytes=1200),
+        "boxes": dict(seconds=2.0, peak_bytes=2000),
+        "threshold": dict(seconds=9.0, peak_bytes=9000),
+    }
+    regressions = compare(results, baseline)
+    assert len(regressions) == 2
+    assert all(r.startswith("boxes") for r in regressions)
+    assert (
+        compare(results, baseline, time_tolerance=3, memory_tolerance=3) == []
+    )
+
+
+def test_main_fails_on_regression(tmp_path, capsys):
+    args = ["--cases", "threshold", "--shape", *map(str, SHAPE)]
+    args += ["--detections", str(N), "--repeat", "1"]
+    saved = tmp_path / "baseline.json"
+    assert _benchmarks.main(args + ["--save", str(saved)]) == 0
+    baseline = json.loads(saved.read_text())
+    baseline["threshold"]["seconds"] /= 100
+    saved.write_text(json.dumps(baseline))
+    assert _benchmarks.main(args + ["--baseline", str(saved)]) == 1
+    assert "regression threshold" in capsys.readouterr().err
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_benchmark(name, tmp_path, request):
+    # timed by pytest-benchmark when it is installed, e.g.
+    # pytest --benchmark-only --benchmark-compare
+    try:
+        benchmark = request.getfixturevalue("benchmark")
+    except pytest.FixtureLookupError:
+        pytest.skip("pytest-benchmark is not installed")
+    benchmark(CASES[name](tmp_path, SHAPE, N))
@@ -0,0 +1,82 @@
+import numpy as np
+
+from caped_ai_visualizations_napari._boxes import (
+    BOX_COLORS,
+    TimepointBoxes,
+    box_vertices,
+    class_colors,
+    hex_to_rgba,
+)
+from caped_ai_visualizations_napari._prediction import DETECTION_COLUMNS
+
+
+def make_detections(rows):
+    detections = np.zeros((len(rows), len(DETECTION_COLUMNS)), np.float32)
+    for i, row in enumerate(rows):
+        for name, value in row.items():
+            detections[i, DETECTION_COLUMNS.index(name)] = value
+    return detections
+
+
+def test_box_vertices():
+    detections = make_detections(
+        [
+            dict(T=1, Z=2, Y=10, X=20, Size=4),
+            dict(T=3, Z=5, Y=30, X=40, Size=0),
+        ]
+    )
+    vertices = box_vertices(detections, 4, default_size=10)
+    assert vertices.shape == (2, 4, 4)
+    np.testing.assert_array_equal(
+        vertices[0],
+        [[1, 2, 8, 18], [1, 2, 8, 22], [1, 2, 12, 22], [1, 2, 12, 18]],
+    )
+    np.testing.assert_array_equal(vertices[1, :, -2:].min(axis=0), [25, 35])
+
+    vertices = box_vertices(detections, 3)
+    assert vertices.shape == (2, 4, 3)
+    np.testing.assert_array_equal(vertices[0, 0], [1, 8, 18])
+
+
+def test_class_colors():
+    lut = hex_to_rgba(BOX_COLORS)
+    np.testing.assert_array_equal(class_colors([1, 2, 1]), lut[[0, 1, 0]])
+    # colours follow the labels of catagories.json
+    catagories = {"Normal": 0, "Apoptosis": 5, "Division": 3}
+    np.testing.assert_array_equal(
+        class_colors([5, 3], catagories), lut[[1, 0]]
+    )
+
+
+def test_timepoint_boxes():
+    rng = np.random.default_rng(0)
+    detections = make_detections(
+        [
+            dict(T=t, Y=10, X=10, Size=2, Class=1)
+            for t in rng.integers(0, 5, 50)
+        ]
+    )
+    boxes = TimepointBoxes(detections, 3)
+    assert len(boxes) == 50
+    for t in range(6):
+        vertices, colors = boxes.at(t)
+        expected = np.count_nonzero(detections[:, 0] == t)
+        assert len(vertices) == len(colors) == expected
+        assert np.all(vertices[:, :, 0] == t)
+
+
+def test_timepoint_boxes_in_view():
+    detections = make_detections(
+        [
+            dict(T=1, Y=10, X=10, Size=4),
+            dict(T=1, Y=100, X=100, Size=4),
+            dict(T=2, Y=10, X=10, Size=4),
+        ]
+    )
+    boxes = TimepointBoxes(detections, 3)
+    # boxes partly inside the view are kept
+    vertices, colors = boxes.at(1, view=([0, 0], [50, 11]))
+    assert len(vertices) == len(colors) == 1
+    np.testing.assert_array_equal(vertices[0, 0], [1, 8, 8])
+    assert len(boxes.at(1, view=([13, 13], [50, 50]))[0]) == 0
+    assert len(boxes.at(3, view=([0, 0], [200, 200]))[0]) == 0
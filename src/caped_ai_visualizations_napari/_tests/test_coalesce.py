@@ -0,0 +1,58 @@
+from caped_ai_visualizations_napari._coalesce import Pipeline
+
+
+def make_pipeline(calls, source):
+    def _filter():
+        calls.append("filter")
+        return source["value"]
+
+    def _nms(value):
+        calls.append("nms")
+        return value * 10
+
+    def _show(value):
+        calls.append("show")
+        source["shown"] = value
+        return value
+
+    return Pipeline([("filter", _filter), ("nms", _nms), ("show", _show)])
+
+
+def test_changes_within_a_frame_are_merged(qtbot):
+    calls, source = [], dict(value=1)
+    pipeline = make_pipeline(calls, source)
+    for value in range(2, 6):
+        source["value"] = value
+        pipeline.invalidate("filter")
+    pipeline.invalidate("nms")
+    qtbot.waitUntil(lambda: "shown" in source, timeout=1000)
+    assert calls == ["filter", "nms", "show"]
+    assert source["shown"] == 50
+
+
+def test_only_stale_stages_run(qtbot):
+    calls, source = [], dict(value=1)
+    pipeline = make_pipeline(calls, source)
+    pipeline.invalidate()
+    pipeline.flush()
+    calls.clear()
+    pipeline.invalidate("nms")
+    pipeline.flush()
+    assert calls == ["nms", "show"]
+    # nothing stale, nothing runs
+    pipeline.flush()
+    assert calls == ["nms", "show"]
+
+
+def test_none_stops_the_run(qtbot):
+    calls, source = [], dict(value=None)
+    pipeline = make_pipeline(calls, source)
+    pipeline.invalidate()
+    pipeline.flush()
+    assert calls == ["filter"]
+    # later stages need the first one to have produced something
+    source["value"] = 2
+    pipeline.invalidate("show")
+    pipeline.flush()
+    assert calls == ["filter", "filter", "nms", "show"]
+    assert source["shown"] == 20
@@ -0,0 +1,128 @@
+import numpy as np
+
+from caped_ai_visualizations_napari._detections import (
+    DETECTION_DTYPE,
+    DetectionTable,
+    to_array,
+    to_rows,
+)
+from caped_ai_visualizations_napari._prediction import DETECTION_COLUMNS
+
+T = DETECTION_COLUMNS.index("T")
+SCORE = DETECTION_COLUMNS.index("Score")
+CONFIDENCE = DETECTION_COLUMNS.index("Confidence")
+
+
+def random_detections(n, n_timepoints=10, seed=0):
+    rng = np.random.default_rng(seed)
+    detections = rng.uniform(0, 1, (n, len(DETECTION_COLUMNS)))
+    detections[:, T] = rng.integers(0, n_timepoints, n)
+    detections[:, -1] = rng.integers(1, 4, n)
+    return detections.astype(np.float32)
+
+
+def sort_rows(detections):
+    return detections[np.lexsort(detections.T[::-1])]
+
+
+def test_streamed_detections_stay_sorted_by_time():
+    table = DetectionTable()
+    # in time order, then a chunk of earlier timepoints
+    chunks = [random_detections(50, seed=t) for t in range(4)] + [
+        random_detections(30, n_timepoints=3, seed=5)
+    ]
+    for t, chunk in enumerate(chunks[:4]):
+        chunk[:, T] = 3 * t
+    for chunk in chunks:
+        table.append(chunk)
+    assert len(table) == 230
+    assert np.all(np.diff(table["T"].astype(np.int64)) >= 0)
+
+    everything = np.concatenate(chunks)
+    np.testing.assert_array_equal(
+        sort_rows(table.to_array()), sort_rows(everything)
+    )
+
+
+def test_rows_are_compact():
+    detections = random_detections(100)
+    assert DETECTION_DTYPE.itemsize == 32
+    np.testing.assert_array_equal(to_array(to_rows(detections)), detections)
+    assert to_rows(to_rows(detections)).dtype == DETECTION_DTYPE
+
+
+def test_threshold_matches_mask():
+    detections = random_detections(500)
+    table = DetectionTable(detections)
+    for score, confidence in [(0.0, None), (0.5, None), (0.7, 0.3), (1, 0)]:
+        expected = detections[detections[:, SCORE] >= score]
+        if confidence is not None:
+            expected = expected[expected[:, CONFIDENCE] >= confidence]
+        found = table.to_array(score, confidence)
+        np.testing.assert_array_equal(sort_rows(found), sort_rows(expected))
+
+
+def test_time_slices_are_views():
+    detections = random_detections(1000)
+    table = DetectionTable(detections)
+    for start, stop in [(0, 1), (3, 7), (-2, 2), (9, 20), (5, 5)]:
+        rows = table.between(start, stop)
+        t = detections[:, T]
+        assert len(rows) == np.count_nonzero((t >= start) & (t < stop))
+        assert np.all((rows["T"] >= start) & (rows["T"] < stop))
+        if len(rows) > 0:
+            assert np.shares_memory(rows, table.rows)
+    assert np.shares_memory(table["Score"], table.rows)
+
+
+def test_threshold_returns_views():
+    table = DetectionTable(random_detections(100))
+    assert np.all(np.diff(table["Score"][table.order]) >= 0)
+    positions = table.above(0.5)
+    assert np.shares_memory(positions, table.order)
+    assert np.all(table["Score"][positions] >= 0.5)
+    assert len(positions) == np.count_nonzero(table["Score"] >= 0.5)
+    # columns of the gathered detections are handed to napari as is
+    detections = table.to_array(0.5)
+    assert all(
+        detections[:, i].flags.c_contiguous
+        for i in range(len(DETECTION_COLUMNS))
+    )
+
+
+def test_score_order_survives_merges():
+    table = DetectionTable()
+    for seed, t in [(0, 5), (1, 8), (2, 2), (3, 9)]:
+        chunk = random_detections(40, seed=seed)
+        chunk[:, T] = t
+        table.append(chunk)
+    scores = table["Score"][table.order]
+    assert np.all(np.diff(scores) >= 0)
+    np.testing.assert_array_equal(np.sort(table.order), np.arange(160))
+
+
+def test_scores_are_merged_on_the_next_threshold():
+    table = DetectionTable(random_detections(100, seed=0))
+    order = table.order
+    for t in range(10, 15):
+        chunk = random_detections(50, seed=t)
+        chunk[:, T] = t
+        table.append(chunk)
+    # streaming does not copy the score order for every timepoint
+    assert table._order is order
+    positions = table.above(0.5)
+    assert len(positions) == np.count_nonzero(table["Score"] >= 0.5)
+    assert np.all(np.diff(table["Score"][table.order]) >= 0)
+    np.testing.assert_array_equal(np.sort(table.order), np.arange(350))
+
+
+def test_buffer_grows_geometrically():
+    table = DetectionTable()
+    buffers = set()
+    for t in range(200):
+        chunk = random_detections(64, seed=t)
+        chunk[:, T] = t
+        table.append(chunk)
+        buffers.add(id(table._buffer))
+    assert len(table) == 200 * 64
+    assert len(buffers) <= 8
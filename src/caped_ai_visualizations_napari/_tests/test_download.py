@@ -0,0 +1,158 @@
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from caped_ai_visualizations_napari._download import (
+    MIRROR_ENV,
+    DownloadManager,
+    RemoteFile,
+    main,
+)
+
+FILES = {
+    "weights.h5": bytes(range(256)) * 4096,
+    "parameters.json": b'{"imagex": 64}',
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    # bytes sent before the connection is dropped, once per file
+    cut = {}
+    ranges = []
+
+    def do_GET(self):
+        body = FILES.get(self.path.strip("/").split("/")[-1])
+        if body is None:
+            self.send_error(404)
+            return
+        start = 0
+        header = self.headers.get("Range")
+        self.ranges.append(header)
+        if header is not None:
+            start = int(header.split("=")[1].split("-")[0])
+            if start >= len(body):
+                self.send_error(416)
+                return
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body) - start))
+        self.end_headers()
+        cut = self.cut.pop(self.path, None)
+        self.wfile.write(body[start:cut])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.delenv(MIRROR_ENV, raising=False)
+    Handler.cut, Handler.ranges = {}, []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def remotes(url, folder="NEATVollNet/model"):
+    return [
+        RemoteFile(
+            f"{url}/files/{name}",
+            f"{folder}/{name}",
+            hashlib.sha256(body).hexdigest(),
+        )
+        for name, body in FILES.items()
+    ]
+
+
+def test_fetch_all_with_progress(server, tmp_path):
+    manager = DownloadManager(tmp_path / "models")
+    updates = []
+    paths = manager.fetch_all(
+        remotes(server), lambda done, total: updates.append((done, total))
+    )
+    for path, body in zip(paths, FILES.values()):
+        assert path.read_bytes() == body
+    assert updates[-1] == (sum(map(len, FILES.values())),) * 2
+    assert all(b[0] >= a[0] for a, b in zip(updates, updates[1:]))
+
+    # verified files are not downloaded again
+    Handler.ranges.clear()
+    manager.fetch_all(remotes(server))
+    assert Handler.ranges == []
+
+
+def test_interrupted_download_resumes(server, tmp_path):
+    manager = DownloadManager(tmp_path / "models")
+    remote = remotes(server)[0]
+    Handler.cut["/files/weights.h5"] = 1000
+    path = manager.fetch(remote)
+    assert path.read_bytes() == FILES["weights.h5"]
+    assert Handler.ranges == [None, "bytes=1000-"]
+    assert not path.with_name(path.name + ".part").exists()
+
+
+def test_checksum_and_http_errors(server, tmp_path):
+    manager = DownloadManager(tmp_path / "models")
+    remote = remotes(server)[1]._replace(file_hash="0" * 64)
+    with pytest.raises(ValueError):
+        manager.fetch(remote)
+    assert not (tmp_path / "models" / remote.path).exists()
+    with pytest.raises(OSError):
+        manager.fetch(RemoteFile(f"{server}/missing.json", "missing.json"))
+
+
+def test_mirror(server, tmp_path):
+    seeded = DownloadManager(tmp_path / "mirror")
+    seeded.fetch_all(remotes(server))
+    # the registry urls are never used with a mirror
+    offline = [
+        r._replace(url="http://unreachable.invalid/") for r in remotes(server)
+    ]
+    for i, mirror in enumerate((str(tmp_path / "mirror"), f"{server}/m")):
+        paths = DownloadManager(tmp_path / str(i), mirror).fetch_all(offline)
+        assert [p.read_bytes() for p in paths] == list(FILES.values())
+
+
+def test_main_reports_failures(monkeypatch, tmp_path, capsys):
+    from caped_ai_visualizations_napari import _download
+
+    def download_model(name, model, manager):
+        if model == "broken":
+            raise ValueError("checksum")
+        return manager.root / name / model
+
+    monkeypatch.setattr(_download, "download_model", download_model)
+    argv = ["-o", str(tmp_path), "--model-class", "NEATVollNet"]
+    assert main(argv + ["--pretrained", "good"]) == 0
+    assert main(argv + ["--pretrained", "good", "broken"]) == 1
+    assert "broken: checksum" in capsys.readouterr().err
+
+
+def test_main_reports_missing_model_classes(monkeypatch, tmp_path, capsys):
+    from caped_ai_visualizations_napari import _download, _registry
+
+    def registered_models(name):
+        if name == "NEATResNet":
+            raise ModuleNotFoundError("No module named 'neat_static_resnet'")
+        return [("alias", "key")]
+
+    monkeypatch.setattr(_registry, "registered_models", registered_models)
+    monkeypatch.setattr(
+        _download,
+        "download_model",
+        lambda name, model, manager: manager.root / name / model,
+    )
+    assert main(["-o", str(tmp_path)]) == 1
+    out, err = capsys.readouterr()
+    assert "NEATResNet: No module named" in err
+    assert "NEATVollNet key" in out
+
+    with pytest.raises(SystemExit):
+        main(["-o", str(tmp_path), "--model-class", "neat_static_resnet"])
+    assert "invalid choice" in capsys.readouterr().err
@@ -0,0 +1,132 @@
+import json
+
+from caped_ai_visualizations_napari import _download, _registry
+from caped_ai_visualizations_napari._download import (
+    MIRROR_ENV,
+    RemoteFile,
+    file_hash,
+)
+from caped_ai_visualizations_napari._models import (
+    ModelCache,
+    ModelIndex,
+    load_model,
+    read_configs,
+)
+
+
+class FakeNetwork:
+    def __init__(self, n):
+        self.n = n
+
+    def count_params(self):
+        return self.n
+
+
+class FakeModel:
+    def __init__(self, n):
+        self.model = FakeNetwork(n)
+
+
+def test_model_cache_evicts_least_recently_used():
+    cache = ModelCache(max_bytes=4 * 250)
+    loads = []
+
+    def loader(key, n=100):
+        def load():
+            loads.append(key)
+            return FakeModel(n)
+
+        return load
+
+    a = cache.get("a", loader("a"))
+    cache.get("b", loader("b"))
+    assert cache.get("a", loader("a")) is a
+    cache.get("c", loader("c"))
+    # b was used least recently and does not fit next to a and c
+    assert "b" not in cache
+    assert "a" in cache and "c" in cache
+    assert loads == ["a", "b", "c"]
+    assert cache.nbytes() == 4 * 200
+
+    # a single model larger than the budget is still kept
+    cache.get("d", loader("d", 1000))
+    assert len(cache) == 1 and "d" in cache
+
+
+def test_model_index_persists(tmp_path):
+    folder = tmp_path / "model"
+    folder.mkdir()
+    configs = dict(
+        parameters={"imagex": 64}, catagories={"Normal": 0}, cord={"x": 0}
+    )
+    for name, config in configs.items():
+        with open(folder / f"{name}.json", "w") as f:
+            json.dump(config, f)
+    assert read_configs(folder) == configs
+
+    index = ModelIndex()
+    assert index.get("NEATVollNet", "m1") is None
+    assert index.last_used() is None
+    index.put("NEATVollNet", "m1", folder=folder, **configs)
+    index.set_last_used("NEATVollNet", "m1")
+
+    index = ModelIndex()
+    assert index.get("NEATVollNet", "m1") == dict(
+        folder=str(folder), **configs
+    )
+    assert index.last_used() == dict(model_type="NEATVollNet", model="m1")
+
+    # entries of deleted folders are ignored
+    for f in folder.iterdir():
+        f.unlink()
+    folder.rmdir()
+    assert ModelIndex().get("NEATVollNet", "m1") is None
+
+
+class FakeVollNet:
+    def __init__(self, config, model_dir, catconfig, cordconfig):
+        self.config = config
+        self.model_dir = model_dir
+        self.key_categories = catconfig
+        self.key_cord = cordconfig
+
+
+def test_pretrained_models_load_from_their_download(
+    monkeypatch, tmp_path, cache_dir
+):
+    mirror = tmp_path / "mirror"
+    folder = mirror / "NEATVollNet" / "key"
+    folder.mkdir(parents=True)
+    configs = dict(
+        parameters={"imagex": 64}, catagories={"Normal": 0}, cord={"x": 0}
+    )
+    for name, config in configs.items():
+        with open(folder / f"{name}.json", "w") as f:
+            json.dump(config, f)
+    (folder / "key.h5").write_bytes(b"weights")
+
+    def pretrained_files(name, model):
+        assert (name, model) == ("NEATVollNet", "alias")
+        return [
+            RemoteFile(
+                "http://unused.invalid/", path, file_hash(mirror / path)
+            )
+            for path in (
+                "NEATVollNet/key/key.h5",
+                "NEATVollNet/key/parameters.json",
+                "NEATVollNet/key/catagories.json",
+                "NEATVollNet/key/cord.json",
+            )
+        ]
+
+    monkeypatch.setenv(MIRROR_ENV, str(mirror))
+    monkeypatch.setattr(_download, "pretrained_files", pretrained_files)
+    monkeypatch.setattr(_registry, "load_model_class", lambda _: FakeVollNet)
+
+    model = load_model("NEATVollNet", "alias")
+    downloaded = cache_dir / "models" / "NEATVollNet" / "key"
+    assert model.model_dir == str(downloaded)
+    assert (downloaded / "key.h5").read_bytes() == b"weights"
+    assert model.config == configs["parameters"]
+    assert model.key_categories == configs["catagories"]
+    assert model.key_cord == configs["cord"]
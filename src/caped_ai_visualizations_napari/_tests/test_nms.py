@@ -0,0 +1,83 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from caped_ai_visualizations_napari._nms import nms
+from caped_ai_visualizations_napari._prediction import DETECTION_COLUMNS
+
+
+def make_detections(rows):
+    """rows of (t, z, y, x, score, size, label)"""
+    detections = np.zeros((len(rows), len(DETECTION_COLUMNS)), np.float32)
+    for i, (t, z, y, x, score, size, label) in enumerate(rows):
+        detections[i] = (t, z, y, x, score, size, 1.0, label)
+    return detections
+
+
+def brute_force_distance_nms(detections, nms_space, nms_time):
+    order = np.argsort(-detections[:, 4], kind="stable")
+    keep = np.ones(len(detections), dtype=bool)
+    for a, b in itertools.combinations(order, 2):
+        if not keep[a]:
+            continue
+        close = (
+            np.linalg.norm(detections[a, 1:4] - detections[b, 1:4])
+            <= nms_space
+            and abs(detections[a, 0] - detections[b, 0]) <= nms_time
+            and np.all(
+                np.abs(detections[a, 1:4] - detections[b, 1:4]) <= nms_space
+            )
+            and detections[a, 7] == detections[b, 7]
+        )
+        if close:
+            keep[b] = False
+    return keep
+
+
+@pytest.mark.parametrize("nms_function", ["iou", "distance"])
+def test_nms_keeps_best_of_cluster(nms_function):
+    detections = make_detections(
+        [
+            (5, 10, 100, 100, 0.95, 10, 1),
+            (6, 10, 102, 101, 0.99, 10, 1),
+            (5, 10, 101, 99, 0.91, 10, 1),
+            # other class at the same location
+            (5, 10, 100, 100, 0.92, 10, 2),
+            # too far away in time
+            (12, 10, 100, 100, 0.93, 10, 1),
+            # too far away in space
+            (5, 10, 300, 300, 0.9, 10, 1),
+        ]
+    )
+    keep = nms(detections, nms_space=20, nms_time=2, nms_function=nms_function)
+    np.testing.assert_array_equal(keep, [0, 1, 0, 1, 1, 1])
+
+
+def test_distance_nms_matches_brute_force():
+    rng = np.random.default_rng(0)
+    n = 400
+    detections = make_detections(
+        list(
+            zip(
+                rng.integers(0, 20, n),
+                rng.uniform(0, 30, n),
+                rng.uniform(0, 200, n),
+                rng.uniform(0, 200, n),
+                rng.uniform(0.5, 1, n),
+                np.full(n, 8),
+                rng.integers(1, 3, n),
+            )
+        )
+    )
+    keep = nms(detections, 15, 1, "distance")
+    np.testing.assert_array_equal(
+        keep, brute_force_distance_nms(detections, 15, 1)
+    )
+
+
+def test_nms_empty_and_invalid():
+    empty = np.zeros((0, len(DETECTION_COLUMNS)), np.float32)
+    assert nms(empty).shape == (0,)
+    with pytest.raises(ValueError):
+        nms(make_detections([(0, 0, 0, 0, 1, 1, 1)]), nms_function="foo")
@@ -0,0 +1,71 @@
+import gc
+
+import numpy as np
+import pytest
+
+from caped_ai_visualizations_napari import _normalization
+from caped_ai_visualizations_napari._normalization import (
+    NormalizedImage,
+    PercentileStats,
+    normalize,
+    percentile_stats,
+)
+
+
+def test_integer_percentiles_are_exact():
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 3000, (4, 3, 20, 30)).astype(np.uint16)
+    stats = PercentileStats.from_image(image)
+    assert stats.exact
+    for q in (0, 1, 50, 99.8, 100):
+        assert stats.percentile(q) == pytest.approx(np.percentile(image, q))
+        assert stats.percentile(q, t=2) == pytest.approx(
+            np.percentile(image[2], q)
+        )
+
+
+def test_float_percentiles_within_a_bin():
+    rng = np.random.default_rng(1)
+    image = rng.lognormal(0, 1, (3, 64, 64)).astype(np.float32)
+    stats = PercentileStats.from_image(image, n_bins=1024)
+    width = stats.edges[1] - stats.edges[0]
+    for q in (1, 50, 99.8):
+        assert abs(stats.percentile(q) - np.percentile(image, q)) <= width
+
+
+def test_normalized_slices_match_full_normalization():
+    import dask.array as da
+
+    rng = np.random.default_rng(2)
+    image = rng.integers(0, 500, (5, 2, 16, 16)).astype(np.uint16)
+    lo, hi = np.percentile(image, (1, 99.8))
+    expected = (image.astype(np.float32) - lo) / (hi - lo + 1e-20)
+
+    x = normalize(da.from_array(image, chunks=(1, 1, 16, 16)))
+    assert isinstance(x, NormalizedImage) and x.shape == image.shape
+    window = x[1:4, :, 2:10, 3:9]
+    assert window.dtype == np.float32
+    np.testing.assert_allclose(window, expected[1:4, :, 2:10, 3:9], 1e-5)
+    np.testing.assert_allclose(x[3], expected[3], 1e-5)
+
+    x = normalize(image, per_timepoint=True)
+    lo, hi = np.percentile(image, (1, 99.8), axis=(1, 2, 3), keepdims=True)
+    expected = (image - lo) / (hi - lo + 1e-20)
+    np.testing.assert_allclose(x[1:3, 0], expected[1:3, 0], 1e-5)
+    np.testing.assert_allclose(x[4], expected[4], 1e-5)
+
+    raw = normalize(image, norm_image=False)
+    np.testing.assert_array_equal(raw[2], image[2].astype(np.float32))
+
+
+def test_stats_are_cached_per_array():
+    image = np.arange(2 * 8 * 8, dtype=np.uint8).reshape(2, 8, 8)
+    stats = percentile_stats(image)
+    assert percentile_stats(image) is stats
+    copy = image.copy()
+    assert percentile_stats(copy, source=image) is stats
+    assert percentile_stats(copy) is not stats
+    n = len(_normalization._STATS)
+    del image, copy
+    gc.collect()
+    assert len(_normalization._STATS) == n - 2
@@ -0,0 +1,53 @@
+import numpy as np
+
+from caped_ai_visualizations_napari._plots import EventCountPlot, event_counts
+from caped_ai_visualizations_napari._prediction import DETECTION_COLUMNS
+
+
+def make_detections(n, n_timepoints=20, seed=0):
+    rng = np.random.default_rng(seed)
+    detections = np.zeros((n, len(DETECTION_COLUMNS)), np.float32)
+    detections[:, DETECTION_COLUMNS.index("T")] = rng.integers(
+        0, n_timepoints, n
+    )
+    detections[:, DETECTION_COLUMNS.index("Class")] = rng.integers(1, 4, n)
+    return detections
+
+
+def test_event_counts_matches_brute_force():
+    detections = make_detections(500)
+    counts = event_counts(detections, 20, [3, 1])
+    assert counts.shape == (2, 20)
+    t = detections[:, DETECTION_COLUMNS.index("T")]
+    label = detections[:, DETECTION_COLUMNS.index("Class")]
+    for row, event in enumerate([3, 1]):
+        for i in range(20):
+            assert counts[row, i] == np.count_nonzero(
+                (t == i) & (label == event)
+            )
+    assert event_counts(detections[:0], 20, [1]).shape == (1, 20)
+
+
+def test_event_count_plot_blits_unless_layout_changes():
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    canvas = FigureCanvasAgg(Figure())
+    canvas.figure.subplots(1, 1)
+    draws = []
+    draw = canvas.draw
+    canvas.draw = lambda: draws.append(1) or draw()
+    plot = EventCountPlot(canvas)
+
+    counts = event_counts(make_detections(500), 20, [1, 2])
+    plot.update(counts, ["Division", "Apoptosis"])
+    assert len(draws) == 1 and plot.background is not None
+    plot.update(counts // 2, ["Division", "Apoptosis"])
+    assert len(draws) == 1
+    np.testing.assert_array_equal(plot.lines[0].get_ydata(), counts[0] // 2)
+
+    # more classes, more timepoints or larger counts need a full redraw
+    plot.update(counts[:1], ["Division"])
+    plot.update(event_counts(make_detections(500), 30, [1]), ["Division"])
+    plot.update(counts[:1] * 10, ["Division"])
+    assert len(draws) == 4
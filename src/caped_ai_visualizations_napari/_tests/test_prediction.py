@@ -0,0 +1,129 @@
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from caped_ai_visualizations_napari._normalization import normalize
+from caped_ai_visualizations_napari._prediction import (
+    DETECTION_COLUMNS,
+    boxes_to_detections,
+    predict_timepoints,
+    prediction_timepoints,
+)
+
+key_categories = {"Normal": 0, "Division": 1, "Apoptosis": 2}
+
+
+def make_box(t, score_division, score_apoptosis, confidence=1.0):
+    return {
+        "real_time_event": t,
+        "zcenter": 1.0,
+        "ycenter": 2.0,
+        "xcenter": 3.0,
+        "height": 3.0,
+        "width": 3.0,
+        "depth": 3.0,
+        "confidence": confidence,
+        "Normal": 0.0,
+        "Division": score_division,
+        "Apoptosis": score_apoptosis,
+    }
+
+
+def test_boxes_to_detections():
+    boxes = [
+        make_box(1, 0.95, 0.1),
+        make_box(2, 0.2, 0.99),
+        make_box(3, 0.99, 0.99, confidence=0.1),
+    ]
+    detections = boxes_to_detections(boxes, key_categories, 0.9, 0.9)
+    assert detections.shape == (2, len(DETECTION_COLUMNS))
+    t = detections[:, DETECTION_COLUMNS.index("T")]
+    label = detections[:, DETECTION_COLUMNS.index("Class")]
+    np.testing.assert_array_equal(t, [1, 2])
+    np.testing.assert_array_equal(label, [1, 2])
+
+    empty = boxes_to_detections([], key_categories)
+    assert empty.shape == (0, len(DETECTION_COLUMNS))
+
+
+def test_predict_timepoints_streams_every_timepoint():
+    windows = []
+
+    def make_patches(window):
+        windows.append(window.shape)
+        return np.zeros((0, 1, 1, 1, 1))
+
+    model = SimpleNamespace(
+        model=object(),
+        config={"imagez": 4, "imagey": 8, "imagex": 8},
+        size_tminus=1,
+        size_tplus=2,
+        key_categories=key_categories,
+        make_patches=make_patches,
+    )
+    image = np.random.rand(10, 4, 16, 16)
+    assert list(prediction_timepoints(model, len(image))) == list(range(1, 8))
+
+    results = list(
+        predict_timepoints(model, image, n_tiles=(1, 2, 2), norm_image=False)
+    )
+    assert [t for t, _ in results] == list(range(1, 8))
+    assert all(len(detections) == 0 for _, detections in results)
+    # 2 x 2 tiles per timepoint, each read with a halo of 4 pixels
+    assert len(windows) == 4 * 7
+    assert set(windows) == {(4, 4, 12, 12)}
+
+
+def test_network_calls_are_serialized():
+    active = []
+    overlaps = []
+
+    def make_patches(window):
+        active.append(window)
+        overlaps.append(len(active))
+        time.sleep(0.002)
+        active.pop()
+        return np.zeros((0, 1, 1, 1))
+
+    model = SimpleNamespace(
+        model=object(),
+        config={"imagey": 8, "imagex": 8},
+        key_categories=key_categories,
+        make_patches=make_patches,
+    )
+    image = np.random.rand(6, 32, 32)
+    results = list(
+        predict_timepoints(
+            model, image, n_tiles=(2, 2), norm_image=False, max_workers=4
+        )
+    )
+    assert len(results) == 6
+    assert len(overlaps) == 4 * 6
+    assert max(overlaps) == 1
+
+
+def test_timepoints_can_be_normalized_on_their_own():
+    windows = []
+
+    def make_patches(window):
+        windows.append(window)
+        return np.zeros((0, 1, 1, 1))
+
+    model = SimpleNamespace(
+        model=object(),
+        config={"imagey": 8, "imagex": 8},
+        key_categories=key_categories,
+        make_patches=make_patches,
+    )
+    rng = np.random.default_rng(0)
+    # the intensity of the movie drifts over time
+    image = rng.integers(0, 100, (4, 16, 16)) * np.arange(1, 5)[:, None, None]
+    for _ in predict_timepoints(
+        model, image, max_workers=1, per_timepoint=True
+    ):
+        pass
+    expected = normalize(image, per_timepoint=True)
+    for t, window in enumerate(windows):
+        np.testing.assert_allclose(window, expected[t])
+    assert not np.allclose(expected[0], normalize(image)[0])
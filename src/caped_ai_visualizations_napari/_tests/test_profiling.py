@@ -0,0 +1,80 @@
+import json
+import threading
+
+import pytest
+
+from caped_ai_visualizations_napari._profiling import Metrics
+
+
+def test_spans_are_aggregated_by_name():
+    metrics = Metrics()
+    for seconds in (0.1, 0.3, 0.2):
+        metrics.record("nms", 0.0, seconds)
+    metrics.record("read csv", 0.0, 1.0)
+    with pytest.raises(RuntimeError):
+        with metrics.span("tile inference", t=3):
+            raise RuntimeError
+    metrics.count("changed nms_space")
+    metrics.count("changed nms_space")
+
+    rows = {row["name"]: row for row in metrics.summary()}
+    assert metrics.summary()[0]["name"] == "read csv"
+    assert rows["nms"]["count"] == 3
+    assert rows["nms"]["total"] == pytest.approx(0.6)
+    assert rows["nms"]["mean"] == pytest.approx(0.2)
+    assert (rows["nms"]["min"], rows["nms"]["max"]) == (0.1, 0.3)
+    # spans that raise are recorded too
+    assert rows["tile inference"]["count"] == 1
+    assert metrics.to_dict()["counters"] == {"changed nms_space": 2}
+
+    metrics.reset()
+    assert metrics.summary() == [] and len(metrics.events) == 0
+
+
+def test_spans_from_threads():
+    metrics = Metrics(max_events=50)
+    timed = metrics.timed("work")(lambda: None)
+    threads = [
+        threading.Thread(target=lambda: [timed() for _ in range(100)])
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert metrics.summary()[0]["count"] == 400
+    assert len(metrics.events) == 50
+
+
+def test_dump_chrome_trace(tmp_path):
+    metrics = Metrics()
+    with metrics.span("tile inference", t=3):
+        pass
+    path = metrics.dump(tmp_path / "run.trace.json")
+    (event,) = json.loads(open(path).read())["traceEvents"]
+    assert event["name"] == "tile inference"
+    assert event["ph"] == "X" and event["args"] == {"t": 3}
+    assert event["dur"] >= 0 and event["ts"] >= 0
+
+    path = metrics.dump(tmp_path / "timings.json")
+    assert json.loads(open(path).read())["spans"][0]["count"] == 1
+
+
+def test_performance_panel(qtbot):
+    from caped_ai_visualizations_napari._performance import PerformancePanel
+
+    metrics = Metrics()
+    metrics.record("nms", 0.0, 0.5)
+    metrics.count("changed score_slider")
+    panel = PerformancePanel(metrics)
+    qtbot.addWidget(panel)
+    assert panel.body.isHidden()
+    panel.header.setChecked(True)
+    assert not panel.body.isHidden() and panel.timer.isActive()
+    assert panel.table.rowCount() == 2
+    assert panel.table.item(0, 0).text() == "nms"
+    assert panel.table.item(0, 2).text() == "0.500"
+    panel.reset()
+    assert panel.table.rowCount() == 0
+    panel.header.setChecked(False)
+    assert not panel.timer.isActive()
@@ -0,0 +1,62 @@
+import gc
+
+import numpy as np
+import pytest
+
+from caped_ai_visualizations_napari import _projection
+from caped_ai_visualizations_napari._cache import LRUCache
+from caped_ai_visualizations_napari._projection import mid_slices, project_mid
+
+
+def test_mid_slices_match_oneat():
+    # oneat projects range(n_z // 2 - start, n_z // 2 + end)
+    assert mid_slices(10, 4, 1) == slice(1, 6)
+    assert mid_slices(5, 4, 1) == slice(0, 3)
+    assert mid_slices(4, 1, 10) == slice(1, 4)
+
+
+@pytest.mark.parametrize("method", _projection.PROJECTION_METHODS)
+def test_projection_matches_numpy(method):
+    import dask.array as da
+
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 1000, (3, 9, 12, 10)).astype(np.uint16)
+    expected = getattr(image[:, 0:5].astype(np.float64), method)(axis=1)
+    for source in (image, da.from_array(image, chunks=(1, 3, 12, 10))):
+        projection = project_mid(source, 4, 1, method, cache=LRUCache(2**20))
+        assert projection.shape == (3, 12, 10)
+        result = projection.compute()
+        assert result.dtype == (np.uint16 if method == "max" else np.float32)
+        np.testing.assert_allclose(result, expected, rtol=1e-6)
+
+
+def test_frames_are_cached_and_projected_lazily():
+    image = np.arange(4 * 5 * 3 * 3, dtype=np.float32).reshape(4, 5, 3, 3)
+    cache = LRUCache(2**20)
+    projection = project_mid(image, 1, 1, "max", cache=cache)
+    assert project_mid(image, 1, 1, "max", cache=cache) is projection
+    assert len(cache) == 0
+
+    np.asarray(projection[2])
+    assert len(cache) == 1
+    image[2] = 0
+    # frames are computed once, before the movie changed
+    np.testing.assert_array_equal(
+        np.asarray(projection[2]), np.asarray(projection.compute()[2])
+    )
+    assert np.asarray(projection[2]).max() > 0
+
+    source = id(image)
+    del projection, image
+    gc.collect()
+    assert source not in _projection._sources
+
+
+def test_invalid_arguments():
+    image = np.zeros((2, 4, 3, 3))
+    with pytest.raises(ValueError):
+        project_mid(image, 0, 0)
+    with pytest.raises(ValueError):
+        project_mid(image, 1, 1, "median")
+    with pytest.raises(ValueError):
+        project_mid(image[0], 1, 1)
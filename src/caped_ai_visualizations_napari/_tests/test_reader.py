@@ -1,6 +1,25 @@
+import os
+import shutil
+import subprocess
+import sys
+
 import numpy as np
+import pytest
+from tifffile import imwrite
 
 from caped_ai_visualizations_napari import napari_get_reader
+from caped_ai_visualizations_napari._cache import cached_columns, disk_usage
+from caped_ai_visualizations_napari._pyramid import (
+    build_pyramid,
+    cached_pyramid,
+    write_pyramid,
+)
+from caped_ai_visualizations_napari._reader import (
+    csv_reader_function,
+    image_reader_function,
+    load_detections,
+    read_detections,
+)
 
 
 # tmp_path is a pytest fixture
@@ -10,7 +29,7 @@ def test_reader(tmp_path):
     # write some fake data using your supported file format
     my_test_file = str(tmp_path / "myfile.tif")
     original_data = np.random.rand(20, 20)
-    np.save(my_test_file, original_data)
+    imwrite(my_test_file, original_data)
 
     # try to read it back in
     reader = napari_get_reader(my_test_file)
@@ -26,6 +45,252 @@ def test_reader(tmp_path):
     np.testing.assert_allclose(original_data, layer_data_tuple[0])
 
 
-def test_get_reader_pass():
+@pytest.mark.parametrize("compression", [None, "zlib"])
+def test_lazy_image_reader(tmp_path, compression):
+    paths = [str(tmp_path / f"t{t}.tif") for t in range(3)]
+    original_data = np.random.randint(0, 1000, (3, 4, 16, 16), np.uint16)
+    for _path, data in zip(paths, original_data):
+        imwrite(_path, data, compression=compression)
+
+    eager = image_reader_function(paths, lazy=False)[0][0]
+    assert isinstance(eager, np.ndarray)
+    np.testing.assert_array_equal(eager, original_data)
+
+    lazy = image_reader_function(paths, lazy=True)[0][0]
+    assert not isinstance(lazy, np.ndarray)
+    assert lazy.shape == original_data.shape
+    # at most one timepoint is read at a time, one plane if not compressed
+    assert lazy.chunksize[0] == 1
+    assert compression is not None or lazy.chunksize[1] == 1
+    np.testing.assert_array_equal(lazy[1, 2].compute(), original_data[1, 2])
+    np.testing.assert_array_equal(np.asarray(lazy), original_data)
+
+
+def test_get_reader_pass(tmp_path):
     reader = napari_get_reader("fake.file")
     assert reader is None
+
+    # plain numpy files are left to other readers
+    np.save(tmp_path / "plain.npy", np.zeros((3, 4)))
+    assert napari_get_reader(str(tmp_path / "plain.npy")) is None
+    np.save(tmp_path / "objects.npy", np.array([{}, None]))
+    assert napari_get_reader(str(tmp_path / "objects.npy")) is None
+    # json configs are read as the metadata of result folders
+    assert napari_get_reader(str(tmp_path / "catagories.json")) is None
+
+
+def write_detections(path, n, with_z=True, seed=0):
+    rng = np.random.default_rng(seed)
+    columns = ["T", "Z", "Y", "X", "Score", "Size", "Confidence"]
+    if not with_z:
+        columns.remove("Z")
+    data = rng.uniform(0, 1, (n, len(columns)))
+    data[:, 0] = rng.integers(0, 100, n)
+    with open(path, "w") as f:
+        f.write(",".join(columns) + "\n")
+        np.savetxt(f, data, delimiter=",", fmt="%.6f")
+    return data
+
+
+def test_csv_reader(tmp_path):
+    my_test_file = str(tmp_path / "oneat_Division_locations_movie.csv")
+    data = write_detections(my_test_file, 250)
+
+    reader = napari_get_reader(my_test_file)
+    assert callable(reader)
+    coords, add_kwargs, layer_type = reader(my_test_file)[0]
+    assert layer_type == "points"
+    assert add_kwargs["name"] == "oneat_Division_locations_movie"
+    assert coords.dtype == np.float32 and coords.shape == (250, 4)
+    np.testing.assert_allclose(coords, data[:, :4], atol=1e-5)
+    np.testing.assert_allclose(
+        add_kwargs["features"]["Score"], data[:, 4], atol=1e-5
+    )
+
+
+def test_csv_reader_chunks_and_score_filter(tmp_path):
+    my_test_file = str(tmp_path / "detections.csv")
+    data = write_detections(my_test_file, 1000, with_z=False)
+
+    columns = read_detections(my_test_file, score_threshold=0.5, chunksize=64)
+    keep = data[:, 3] >= 0.5
+    assert "Z" not in columns
+    assert columns["T"].dtype == np.int32
+    assert columns["Score"].dtype == np.float32
+    np.testing.assert_allclose(columns["Y"], data[keep, 1], atol=1e-5)
+
+    coords, _, _ = csv_reader_function(my_test_file, score_threshold=0.5)[0]
+    assert coords.shape == (np.count_nonzero(keep), 3)
+
+
+def test_csv_reader_uses_binary_cache(tmp_path, cache_dir):
+    my_test_file = tmp_path / "detections.csv"
+    write_detections(str(my_test_file), 100)
+
+    first = load_detections(str(my_test_file))
+    sidecars = list(cache_dir.rglob("*.npy"))
+    assert len(sidecars) == 1
+
+    second = load_detections(str(my_test_file))
+    assert isinstance(second["X"], np.memmap)
+    for name in first:
+        np.testing.assert_array_equal(first[name], second[name])
+
+    # a modified source file gets a new cache entry
+    write_detections(str(my_test_file), 10, seed=1)
+    os.utime(my_test_file, ns=(0, 12345))
+    assert len(load_detections(str(my_test_file))["T"]) == 10
+    assert len(list(cache_dir.rglob("*.npy"))) == 2
+
+    filtered = load_detections(str(my_test_file), score_threshold=2.0)
+    assert len(filtered["T"]) == 0
+
+
+def test_binary_cache_is_bounded(tmp_path, cache_dir):
+    my_test_file = tmp_path / "detections.csv"
+    write_detections(str(my_test_file), 100)
+    load_detections(str(my_test_file))
+    (sidecar,) = cache_dir.rglob("*.npy")
+    max_bytes = disk_usage(sidecar)
+
+    # every edit leaves the sidecar of the previous version behind
+    for seed in range(1, 4):
+        write_detections(str(my_test_file), 100, seed=seed)
+        os.utime(my_test_file, ns=(0, seed))
+        columns = cached_columns(
+            str(my_test_file), read_detections, max_bytes=max_bytes
+        )
+        assert len(columns["T"]) == 100
+        assert len(list(cache_dir.rglob("*.npy"))) == 1
+
+
+def test_large_lazy_images_are_pyramids(tmp_path, cache_dir):
+    my_test_file = str(tmp_path / "large.tif")
+    original_data = np.random.randint(0, 255, (2, 3, 1500, 1100), np.uint8)
+    imwrite(my_test_file, original_data)
+
+    data, add_kwargs, _ = image_reader_function(my_test_file, lazy=True)[0]
+    assert add_kwargs["multiscale"] is True
+    assert [level.shape[-2:] for level in data] == [
+        (1500, 1100),
+        (750, 550),
+        (375, 275),
+    ]
+    np.testing.assert_array_equal(
+        np.asarray(data[0][1, 2]), original_data[1, 2]
+    )
+
+
+def test_pyramid_cache(tmp_path, cache_dir):
+    my_test_file = str(tmp_path / "large.tif")
+    original_data = np.random.randint(0, 255, (2, 600, 700), np.uint8)
+    imwrite(my_test_file, original_data)
+
+    built = cached_pyramid([my_test_file], original_data, background=False)
+    (store,) = (cache_dir / "pyramids").iterdir()
+    # the full resolution level is the source, only the others are cached
+    assert sorted(p.name for p in store.iterdir() if p.is_dir()) == ["1"]
+    cached = cached_pyramid([my_test_file], original_data)
+    assert len(cached) == len(built) == 2
+    for a, b in zip(built, cached):
+        np.testing.assert_array_equal(np.asarray(a), np.asarray(b))
+    expected = original_data[1, :2, :2].mean().astype(np.uint8)
+    assert np.asarray(cached[1])[1, 0, 0] == expected
+
+    # a store with another layout, here holding level 0, is built again
+    write_pyramid(store.with_name("other"), built)
+    shutil.rmtree(store)
+    store.with_name("other").rename(store)
+    cached = cached_pyramid([my_test_file], original_data, background=False)
+    assert sorted(p.name for p in store.iterdir() if p.is_dir()) == ["1"]
+    np.testing.assert_array_equal(np.asarray(cached[1]), np.asarray(built[1]))
+
+
+def test_concurrent_pyramid_builds(tmp_path):
+    pyramid = build_pyramid(np.zeros((2, 1200, 1200), np.uint8))
+    store = tmp_path / "pyramids" / "movie.ome.zarr"
+    # a build that crashed, or that is still running, in another process
+    (tmp_path / "pyramids" / "movie.ome.tmp").mkdir(parents=True)
+    (tmp_path / "pyramids" / "movie.ome.tmp" / "partial").touch()
+    write_pyramid(store, pyramid[1:], first_level=1)
+    # a build that finishes second keeps the store of the first one
+    write_pyramid(store, pyramid[1:], first_level=1)
+    assert sorted(p.name for p in (tmp_path / "pyramids").iterdir()) == [
+        "movie.ome.tmp",
+        "movie.ome.zarr",
+    ]
+    assert (tmp_path / "pyramids" / "movie.ome.tmp" / "partial").exists()
+    assert sorted(p.name for p in store.iterdir() if p.is_dir()) == ["1", "2"]
+
+
+def test_pyramid_cache_is_bounded(tmp_path, cache_dir):
+    folder = cache_dir / "pyramids"
+    data = np.random.randint(0, 255, (2, 1200, 1200), np.uint8)
+    stores = []
+    for i in range(4):
+        my_test_file = str(tmp_path / f"large_{i}.tif")
+        imwrite(my_test_file, data)
+        before = set(folder.iterdir()) if folder.exists() else set()
+        # room for the three pyramids written last
+        max_bytes = 3 * disk_usage(stores[0]) if stores else 2**30
+        cached_pyramid(
+            [my_test_file], data, background=False, max_bytes=max_bytes
+        )
+        (store,) = set(folder.iterdir()) - before - set(stores)
+        stores.append(store)
+        os.utime(store, (i, i))
+        if i == 2:
+            # using the first pyramid again makes the second the oldest
+            cached_pyramid([str(tmp_path / "large_0.tif")], data)
+    assert set(folder.iterdir()) == {stores[0], stores[2], stores[3]}
+
+
+def test_directory_reader(tmp_path):
+    movies = {}
+    for stem in ("movie", "movie_2"):
+        movies[stem] = np.random.randint(0, 255, (5, 16, 16), np.uint8)
+        imwrite(str(tmp_path / f"{stem}.tif"), movies[stem])
+    write_detections(str(tmp_path / "oneat_Division_locations_movie.csv"), 10)
+    write_detections(
+        str(tmp_path / "oneat_Division_locations_movie_2.csv"), 20, seed=1
+    )
+    write_detections(str(tmp_path / "unrelated.csv"), 5, seed=2)
+    with open(tmp_path / "catagories.json", "w") as f:
+        f.write('{"Normal": 0, "Division": 1}')
+    with open(tmp_path / "image.json", "w") as f:
+        f.write('{"pixel_size": 1}')
+
+    reader = napari_get_reader(str(tmp_path))
+    assert callable(reader)
+    layers = reader(str(tmp_path))
+    names = [add_kwargs["name"] for _, add_kwargs, _ in layers]
+    assert names == [
+        "movie",
+        "oneat_Division_locations_movie",
+        "movie_2",
+        "oneat_Division_locations_movie_2",
+        "unrelated",
+    ]
+    types = [layer_type for _, _, layer_type in layers]
+    assert types == ["image", "points", "image", "points", "points"]
+    np.testing.assert_array_equal(layers[2][0], movies["movie_2"])
+    assert len(layers[3][0]) == 20
+    metadata = layers[1][1]["metadata"]
+    assert metadata["image"] == "movie"
+    assert metadata["catagories"] == {"Normal": 0, "Division": 1}
+
+
+def test_get_reader_imports_nothing_heavy():
+    code = (
+        "import sys\n"
+        "from caped_ai_visualizations_napari import napari_get_reader\n"
+        "napari_get_reader('movie.tif')\n"
+        "napari_get_reader('detections.csv')\n"
+        "heavy = ('oneat', 'tensorflow', 'pandas', 'matplotlib')\n"
+        "print([m for m in heavy if m in sys.modules])\n"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True
+    )
+    assert out.returncode == 0, out.stderr
+    assert out.stdout.strip() == "[]"
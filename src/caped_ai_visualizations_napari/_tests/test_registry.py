@@ -0,0 +1,18 @@
+import pytest
+
+from caped_ai_visualizations_napari import _registry
+
+
+def test_missing_model_classes_are_skipped(monkeypatch):
+    def registered_models(name):
+        if name == "NEATResNet":
+            raise ModuleNotFoundError("No module named 'neat_static_resnet'")
+        return [(f"{name} alias", f"{name} key")]
+
+    monkeypatch.setattr(_registry, "registered_models", registered_models)
+    with pytest.warns(UserWarning, match="NEATResNet"):
+        registries = _registry.load_registries()
+    assert set(registries) == set(_registry.MODEL_MODULES) - {"NEATResNet"}
+    assert registries["NEATVollNet"] == [
+        ("NEATVollNet alias", "NEATVollNet key")
+    ]
@@ -0,0 +1,83 @@
+import numpy as np
+
+from caped_ai_visualizations_napari._prediction import DETECTION_COLUMNS
+from caped_ai_visualizations_napari._spatial import (
+    SpatialIndex,
+    view_box,
+    viewer_camera,
+)
+
+
+def random_detections(n, n_timepoints=5, size=500, seed=0):
+    rng = np.random.default_rng(seed)
+    detections = np.zeros((n, len(DETECTION_COLUMNS)), np.float32)
+    detections[:, 0] = rng.integers(0, n_timepoints, n)
+    detections[:, 1:4] = rng.uniform(-20, size, (n, 3))
+    return detections
+
+
+def test_in_view_matches_mask():
+    detections = random_detections(5000)
+    index = SpatialIndex(detections, 4, cell_size=17)
+    t, y, x = detections[:, 0], detections[:, 2], detections[:, 3]
+    for lo, hi in [
+        ((0, 0), (100, 50)),
+        ((-50, 200), (30, 1000)),
+        ((480, 480), (490, 490)),
+        ((600, 600), (700, 700)),
+    ]:
+        for time in (0, 3, 7):
+            rows = index.order[index.in_view(time, lo, hi)]
+            expected = np.flatnonzero(
+                (t == time)
+                & (y >= lo[0])
+                & (y <= hi[0])
+                & (x >= lo[1])
+                & (x <= hi[1])
+            )
+            np.testing.assert_array_equal(np.sort(rows), expected)
+
+
+def test_nearest():
+    detections = random_detections(2000, seed=1)
+    index = SpatialIndex(detections, 3)
+    point = np.array([250.0, 250.0])
+    at_t = np.flatnonzero(detections[:, 0] == 2)
+    distances = np.linalg.norm(detections[at_t][:, 2:4] - point, axis=1)
+    found = index.nearest(2, point, radius=100)
+    assert index.order[found] == at_t[np.argmin(distances)]
+    assert index.nearest(2, (5000, 5000)) is None
+    assert index.nearest(9, point) is None
+    assert SpatialIndex(detections[:0], 3).nearest(0, point) is None
+
+
+def test_view_box():
+    from napari.components import ViewerModel
+
+    viewer = ViewerModel()
+    viewer_camera(viewer).center = (0, 100, 200)
+    viewer_camera(viewer).zoom = 2
+    lo, hi = view_box(viewer)
+    np.testing.assert_allclose((lo + hi) / 2, [100, 200])
+    assert np.all(hi - lo > 0)
+    viewer.dims.ndisplay = 3
+    assert view_box(viewer) is None
+
+
+def test_pairs_match_brute_force():
+    detections = random_detections(3000, seed=2)
+    index = SpatialIndex(detections, 4, cell_size=10)
+    points = np.random.default_rng(3).uniform(-50, 550, (200, 3))
+    query, positions, distances = index.pairs(1, points, 25)
+    at_t = np.flatnonzero(detections[:, 0] == 1)
+    d = np.linalg.norm(
+        points[:, None] - detections[at_t][None, :, 1:4], axis=2
+    )
+    expected = {
+        (q, r) for q, k in zip(*np.nonzero(d <= 25)) for r in [at_t[k]]
+    }
+    assert set(zip(query, index.order[positions])) == expected
+    np.testing.assert_allclose(
+        distances,
+        np.linalg.norm(points[query] - index.coordinates[positions], axis=1),
+    )
@@ -0,0 +1,53 @@
+import numpy as np
+
+from caped_ai_visualizations_napari._tiling import (
+    halo_from_parameters,
+    in_core,
+    schedule,
+    tile_grid,
+)
+
+
+def test_tile_cores_partition_the_image():
+    shape = (10, 64, 50)
+    tiles = tile_grid(shape, (1, 2, 3), halo=(2, 8, 8))
+    assert len(tiles) == 6
+
+    owner = np.zeros(shape, dtype=int)
+    for tile in tiles:
+        owner[tuple(slice(*core) for core in tile.core)] += 1
+        for read, (start, stop) in zip(tile.read, tile.core):
+            assert read.start <= start and read.stop >= stop
+    np.testing.assert_array_equal(owner, 1)
+
+
+def test_tiles_never_smaller_than_field_of_view():
+    tiles = tile_grid((16, 16), (8, 8), halo=(4, 4))
+    assert len(tiles) == 4
+
+
+def test_halo_from_parameters():
+    parameters = {"imagez": 8, "imagey": 64, "imagex": 32}
+    assert halo_from_parameters(parameters, 3) == (4, 32, 16)
+    assert halo_from_parameters(parameters, 2) == (32, 16)
+
+
+def test_seam_detections_are_kept_once():
+    tiles = tile_grid((20, 20), (2, 2), halo=(3, 3))
+    points = np.array([[9.5, 9.5], [10.0, 10.0], [0, 19.9]])
+    counts = sum(in_core(points, tile.core).astype(int) for tile in tiles)
+    np.testing.assert_array_equal(counts, 1)
+
+
+def test_schedule_yields_in_order():
+    tiles = tile_grid((8, 8), (2, 2))
+
+    def predict_tile(t, tile):
+        return np.array([[t, tile.core[0][0], tile.core[1][0]]])
+
+    results = list(schedule(predict_tile, range(5), tiles, 3, window=2))
+    assert [t for t, _ in results] == list(range(5))
+    for t, found in results:
+        found = np.concatenate(found)
+        np.testing.assert_array_equal(found[:, 0], t)
+        assert len(found) == 4
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from caped_ai_visualizations_napari._prediction import DETECTION_COLUMNS
+from caped_ai_visualizations_napari._tracks import (
+    LINK_METHODS,
+    collapse_tracks,
+    greedy_matching,
+    link_tracks,
+    track_table,
+    tracks_data,
+)
+
+
+def event_detections(events, seed=0):
+    """Detections of events given as (start, stop, y, x, class)."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for start, stop, y, x, label in events:
+        for t in range(start, stop):
+            row = np.zeros(len(DETECTION_COLUMNS), np.float32)
+            row[[0, 2, 3]] = t, y + rng.normal(0, 1), x + rng.normal(0, 1)
+            row[4] = rng.uniform(0.9, 1)
+            row[7] = label
+            rows.append(row)
+    detections = np.array(rows)
+    return detections[rng.permutation(len(detections))]
+
+
+@pytest.mark.parametrize("method", LINK_METHODS)
+def test_link_tracks(method):
+    # two nearby events of different classes and a distant one
+    detections = event_detections(
+        [(0, 5, 10, 10, 1), (2, 6, 11, 11, 2), (1, 4, 80, 80, 1)]
+    )
+    track_ids = link_tracks(detections, 3, max_distance=10, method=method)
+    assert track_ids.max() == 2
+    for label, y in ((1, 10), (2, 11), (1, 80)):
+        event = (detections[:, 7] == label) & (
+            np.abs(detections[:, 2] - y) < 5
+        )
+        assert len(np.unique(track_ids[event])) == 1
+    # numbered by first appearance
+    assert track_ids[np.argmin(detections[:, 0])] == 0
+
+
+def test_link_tracks_gaps():
+    detections = event_detections([(0, 2, 10, 10, 1), (3, 5, 10, 10, 1)])
+    assert len(np.unique(link_tracks(detections, 3, 5, max_gap=1))) == 1
+    assert len(np.unique(link_tracks(detections, 3, 5, max_gap=0))) == 2
+    assert len(link_tracks(detections[:0], 3)) == 0
+
+
+def test_greedy_matching_is_sequential_greedy():
+    rng = np.random.default_rng(1)
+    i = rng.integers(0, 30, 200)
+    j = rng.integers(0, 30, 200)
+    cost = rng.uniform(0, 1, 200)
+    chosen = greedy_matching(i, j, cost)
+    expected, used_i, used_j = [], set(), set()
+    for k in np.argsort(cost):
+        if i[k] not in used_i and j[k] not in used_j:
+            expected.append(k)
+            used_i.add(i[k])
+            used_j.add(j[k])
+    np.testing.assert_array_equal(np.sort(chosen), np.sort(expected))
+
+
+def test_track_table_and_layer_data():
+    detections = event_detections([(0, 5, 10, 10, 1), (3, 5, 50, 50, 2)])
+    track_ids = link_tracks(detections, 3, max_distance=10)
+    table = track_table(detections, track_ids)
+    np.testing.assert_array_equal(table["duration"], [5, 2])
+    np.testing.assert_array_equal(table["detections"], [5, 2])
+    np.testing.assert_array_equal(table["Class"], [1, 2])
+    best = collapse_tracks(detections, track_ids)
+    assert len(best) == 2
+    assert best[0, 4] == detections[track_ids == 0, 4].max()
+
+    data = tracks_data(detections, track_ids, 3)
+    assert data.shape == (7, 4)
+    np.testing.assert_array_equal(data[:, 0], [0] * 5 + [1] * 2)
+    np.testing.assert_array_equal(data[:5, 1], np.arange(5))
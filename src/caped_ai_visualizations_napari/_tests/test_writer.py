@@ -1,3 +1,8 @@
+import numpy as np
+import pytest
+
+from caped_ai_visualizations_napari import napari_get_reader, write_multiple
+
 # from caped_ai_visualizations_napari import write_single_image, write_multiple
 
 # add your tests here...
@@ -5,3 +10,147 @@
 
 def test_something():
     pass
+
+
+def test_write_detections_roundtrip(tmp_path):
+    rng = np.random.default_rng(0)
+    coords = rng.uniform(0, 100, (50, 4)).astype(np.float32)
+    coords[:, 0] = np.round(coords[:, 0])
+    features = {"Score": rng.uniform(0, 1, 50).astype(np.float32)}
+    meta = dict(name="divisions", features=features)
+
+    written = write_multiple(
+        str(tmp_path / "export"), [(coords, meta, "points")]
+    )
+    assert written == [str(tmp_path / "export" / "divisions.npy")]
+
+    reader = napari_get_reader(written[0])
+    data, add_kwargs, layer_type = reader(written[0])[0]
+    assert layer_type == "points"
+    np.testing.assert_allclose(data, coords)
+    np.testing.assert_array_equal(
+        add_kwargs["features"]["Score"], features["Score"]
+    )
+
+
+def test_write_single_image_ome_tiff(tmp_path):
+    import dask.array as da
+    from tifffile import TiffFile
+
+    from caped_ai_visualizations_napari import write_single_image
+
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 1000, (3, 2, 300, 270)).astype(np.uint16)
+    path = str(tmp_path / "movie.ome.tif")
+    meta = dict(scale=(1, 2.0, 0.5, 0.5))
+    data = da.from_array(image, chunks=(1, 1, 300, 270))
+    assert write_single_image(path, data, meta) == [path]
+    with TiffFile(path) as tif:
+        assert tif.is_ome
+        assert tif.series[0].axes == "TZYX"
+        assert tif.pages[0].is_tiled
+        assert tif.pages[0].compression != 1
+        np.testing.assert_array_equal(tif.asarray(), image)
+    assert list(tmp_path.iterdir()) == [tmp_path / "movie.ome.tif"]
+
+    small = image[:, :, :100, :100]
+    write_single_image(path, small, {})
+    reader = napari_get_reader(path)
+    np.testing.assert_array_equal(np.asarray(reader(path)[0][0]), small)
+
+
+def test_write_single_image_ome_zarr(tmp_path):
+    zarr = pytest.importorskip("zarr")
+
+    from caped_ai_visualizations_napari import write_single_image
+
+    image = np.arange(2 * 64 * 48, dtype=np.float32).reshape(2, 64, 48)
+    levels = [image, image[:, ::2, ::2]]
+    path = str(tmp_path / "movie.zarr")
+    write_single_image(path, levels, dict(multiscale=True))
+    group = zarr.open_group(path, mode="r")
+    np.testing.assert_array_equal(group["0"][:], image)
+    np.testing.assert_array_equal(group["1"][:], levels[1])
+    attrs = dict(group.attrs)
+    multiscales = attrs.get("ome", attrs)["multiscales"][0]
+    assert [a["name"] for a in multiscales["axes"]] == ["t", "y", "x"]
+    transforms = multiscales["datasets"][1]["coordinateTransformations"]
+    assert transforms[0]["scale"] == [1.0, 2.0, 2.0]
+
+
+def test_write_points_csv_roundtrip(tmp_path):
+    from caped_ai_visualizations_napari import write_points
+
+    rng = np.random.default_rng(0)
+    coords = rng.uniform(0, 100, (20, 3)).astype(np.float32)
+    coords[:, 0] = np.round(coords[:, 0])
+    features = {
+        "Score": rng.uniform(0, 1, 20).astype(np.float32),
+        "Class": np.array(["division"] * 20),
+    }
+    path = str(tmp_path / "divisions.csv")
+    assert write_points(path, coords, dict(features=features)) == [path]
+
+    data, add_kwargs, _ = napari_get_reader(path)(path)[0]
+    np.testing.assert_allclose(data, coords, rtol=1e-5)
+    np.testing.assert_allclose(
+        add_kwargs["features"]["Score"], features["Score"], rtol=1e-5
+    )
+
+
+def test_write_shapes_as_detections(tmp_path):
+    from caped_ai_visualizations_napari import write_shapes
+    from caped_ai_visualizations_napari._boxes import box_vertices
+    from caped_ai_visualizations_napari._prediction import DETECTION_COLUMNS
+
+    detections = np.zeros((5, len(DETECTION_COLUMNS)), np.float32)
+    detections[:, :4] = np.arange(20).reshape(5, 4)
+    detections[:, DETECTION_COLUMNS.index("Size")] = 8
+    vertices = list(box_vertices(detections, 4))
+    path = str(tmp_path / "boxes.npy")
+    write_shapes(path, vertices, {})
+
+    data, add_kwargs, _ = napari_get_reader(path)(path)[0]
+    np.testing.assert_allclose(data, detections[:, :4])
+    np.testing.assert_allclose(add_kwargs["features"]["Size"], 8)
+
+
+def test_write_multiple_images_and_shapes(tmp_path):
+    image = np.zeros((2, 32, 32), np.uint8)
+    box = np.array([[0, 0, 0], [0, 0, 4], [0, 4, 4], [0, 4, 0]], float)
+    written = write_multiple(
+        str(tmp_path / "export"),
+        [
+            (image, dict(name="movie"), "image"),
+            ([box], dict(name="boxes"), "shapes"),
+        ],
+    )
+    assert [p.split("/")[-1] for p in written] == [
+        "movie.ome.tif",
+        "boxes.npy",
+    ]
+
+
+def test_write_2d_points_with_string_features(tmp_path):
+    import pandas as pd
+
+    rng = np.random.default_rng(0)
+    coords = rng.uniform(0, 100, (10, 2)).astype(np.float32)
+    features = pd.DataFrame(
+        {
+            "Score": rng.uniform(0, 1, 10).astype(np.float32),
+            "label": pd.Categorical(["division", "apoptosis"] * 5),
+            "note": np.array(["a", None] * 5, dtype=object),
+        }
+    )
+    meta = dict(name="spots", ndim=2, features=features)
+    (written,) = write_multiple(
+        str(tmp_path / "export"), [(coords, meta, "points")]
+    )
+
+    data, add_kwargs, _ = napari_get_reader(written)(written)[0]
+    np.testing.assert_allclose(data, coords)
+    read = add_kwargs["features"]
+    np.testing.assert_array_equal(read["Score"], features["Score"])
+    assert list(read["label"]) == list(features["label"])
+    assert list(read["note"]) == ["a", ""] * 5
@@ -0,0 +1,133 @@
+"""
+Tile and timepoint scheduling for prediction on large movies.
+
+The spatial part of the movie is cut into ``n_tiles`` core regions, each
+read with a halo so that events close to a seam still see the full field of
+view of the network. Tiles of a window of timepoints are run concurrently in
+a bounded thread pool and the detections of each tile are only kept inside
+its core region, so every location in the movie is owned by exactly one
+tile and seams do not produce duplicates.
+"""
+import itertools
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+Tile = namedtuple("Tile", ["read", "core"])
+Tile.__doc__ = """Spatial tile of a movie.
+
+read : tuple of slice
+    Region to read, core region grown by the halo and clipped to the image.
+core : tuple of (int, int)
+    Half open (start, stop) interval per axis owned by this tile.
+"""
+
+
+def halo_from_parameters(parameters, ndim):
+    """Halo per spatial axis sized from the model ``parameters.json``.
+
+    Half of the training patch shape of the network, for ZYX if ``ndim`` is
+    3 and YX otherwise.
+    """
+    keys = ("imagez", "imagey", "imagex")[-ndim:]
+    return tuple(int(parameters.get(k, 0)) // 2 for k in keys)
+
+
+def tile_grid(shape, n_tiles, halo=None):
+    """Split a spatial ``shape`` into tiles.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        Spatial shape (ZYX or YX) of the movie.
+    n_tiles : tuple of int
+        Number of tiles per axis, the trailing entries are used if more are
+        given than the movie has spatial axes.
+    halo : tuple of int, optional
+        Overlap added on both sides of each core region.
+
+    Returns
+    -------
+    tiles : list of Tile
+    """
+    n_tiles = tuple(n_tiles)[-len(shape) :]
+    n_tiles = (1,) * (len(shape) - len(n_tiles)) + n_tiles
+    halo = (0,) * len(shape) if halo is None else tuple(halo)
+    axes = []
+    for size, n, h in zip(shape, n_tiles, halo):
+        # cores must not become smaller than the network field of view
+        n = max(1, min(int(n), size // max(2 * h, 1)))
+        bounds = np.linspace(0, size, n + 1).astype(int)
+        axes.append(
+            [
+                (slice(max(start - h, 0), min(stop + h, size)), (start, stop))
+                for start, stop in zip(bounds[:-1], bounds[1:])
+            ]
+        )
+    return [
+        Tile(
+            read=tuple(read for read, _ in combination),
+            core=tuple(core for _, core in combination),
+        )
+        for combination in itertools.product(*axes)
+    ]
+
+
+def in_core(coordinates, core):
+    """Mask of the ``coordinates`` (N, ndim) that lie in a tile core."""
+    coordinates = np.asarray(coordinates)
+    mask = np.ones(len(coordinates), dtype=bool)
+    for axis, (start, stop) in enumerate(core):
+        mask &= (coordinates[:, axis] >= start) & (coordinates[:, axis] < stop)
+    return mask
+
+
+def default_workers():
+    return max(1, min(32, os.cpu_count() or 1))
+
+
+def schedule(predict_tile, timepoints, tiles, max_workers=None, window=None):
+    """Run ``predict_tile`` for all tiles of all timepoints.
+
+    Parameters
+    ----------
+    predict_tile : callable
+        ``predict_tile(t, tile)`` returning the detections of one tile as an
+        array in global coordinates.
+    timepoints : iterable of int
+        Timepoints to process, results are yielded in this order.
+    tiles : list of Tile
+        Spatial tiles, see ``tile_grid``.
+    max_workers : int, optional
+        Size of the thread pool, defaults to the number of cpus.
+    window : int, optional
+        Number of timepoints whose tiles are in flight at the same time,
+        defaults to ``max_workers``. Bounds the memory used by pending tiles.
+
+    Yields
+    ------
+    (t, results) : tuple
+        Timepoint and the list of per tile results.
+    """
+    max_workers = max_workers or default_workers()
+    window = max(1, window or max_workers)
+    timepoints = iter(timepoints)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            chunk = list(itertools.islice(timepoints, window))
+            if len(chunk) == 0:
+                break
+            futures = [
+                (t, [executor.submit(predict_tile, t, tile) for tile in tiles])
+                for t in chunk
+            ]
+            try:
+                for t, pending in futures:
+                    yield t, [future.result() for future in pending]
+            finally:
+                # generator closed early, e.g. prediction aborted
+                for _, pending in futures:
+                    for future in pending:
+                        future.cancel()
@@ -0,0 +1,215 @@
+"""
+Linking of oneat detections across timepoints into event tracks.
+
+An event such as a mitosis is detected at several consecutive timepoints,
+and NMS only removes the duplicates within ``nms_time``. Here detections
+of the same class are linked from one timepoint to the next, up to
+``max_gap`` missing timepoints in between, if they are closer than
+``max_distance``. Candidate pairs come from a ``SpatialIndex`` for all the
+detections of a timepoint at once, and are matched greedily by increasing
+distance, or optimally with the Hungarian algorithm. Every chain of links
+becomes a track, which can be shown as a napari Tracks layer and collapsed
+into a single detection per event.
+"""
+import numpy as np
+
+from ._prediction import DETECTION_COLUMNS, spatial_columns
+from ._profiling import timed
+from ._spatial import SpatialIndex
+
+_T = DETECTION_COLUMNS.index("T")
+_SCORE = DETECTION_COLUMNS.index("Score")
+_CLASS = DETECTION_COLUMNS.index("Class")
+
+LINK_METHODS = ("greedy", "hungarian")
+# timepoints a track may skip, e.g. when an event is missed once
+MAX_GAP = 1
+
+
+def greedy_matching(i, j, cost):
+    """Greedy minimum cost matching of the candidate pairs ``(i, j)``.
+
+    Pairs are accepted by increasing cost unless one of their ends is
+    already matched. Instead of visiting the pairs one by one, every round
+    accepts all pairs that are the cheapest of both their ends, which gives
+    the same matching in a few vectorized rounds.
+
+    Returns
+    -------
+    chosen : np.ndarray
+        Indices of the accepted pairs.
+    """
+    n = len(cost)
+    if n == 0:
+        return np.zeros(0, dtype=np.intp)
+    # ranks break ties between equal costs in a fixed order
+    rank = np.empty(n, dtype=np.intp)
+    rank[np.argsort(cost, kind="stable")] = np.arange(n)
+    used_i = np.zeros(int(i.max()) + 1, dtype=bool)
+    used_j = np.zeros(int(j.max()) + 1, dtype=bool)
+    alive = np.arange(n)
+    chosen = []
+    while len(alive) > 0:
+        best_i = np.full(len(used_i), n, dtype=np.intp)
+        best_j = np.full(len(used_j), n, dtype=np.intp)
+        np.minimum.at(best_i, i[alive], rank[alive])
+        np.minimum.at(best_j, j[alive], rank[alive])
+        mutual = (best_i[i[alive]] == rank[alive]) & (
+            best_j[j[alive]] == rank[alive]
+        )
+        accepted = alive[mutual]
+        chosen.append(accepted)
+        used_i[i[accepted]] = True
+        used_j[j[accepted]] = True
+        alive = alive[~(used_i[i[alive]] | used_j[j[alive]])]
+    return np.concatenate(chosen)
+
+
+def hungarian_matching(i, j, cost):
+    """Matching of as many candidate pairs ``(i, j)`` as possible, with the
+    smallest total cost among those.
+
+    Only the rows and columns that have a candidate are part of the dense
+    cost matrix, so its size grows with the square of the detections per
+    timepoint. Pairs that are not candidates cost more than any matching.
+    """
+    from scipy.optimize import linear_sum_assignment
+
+    if len(cost) == 0:
+        return np.zeros(0, dtype=np.intp)
+    rows, i_compact = np.unique(i, return_inverse=True)
+    cols, j_compact = np.unique(j, return_inverse=True)
+    forbidden = 2 * float(np.max(cost)) * (len(rows) + len(cols)) + 1
+    matrix = np.full((len(rows), len(cols)), forbidden)
+    pair = np.full((len(rows), len(cols)), -1, dtype=np.intp)
+    matrix[i_compact, j_compact] = cost
+    pair[i_compact, j_compact] = np.arange(len(cost))
+    r, c = linear_sum_assignment(matrix)
+    chosen = pair[r, c]
+    return np.sort(chosen[chosen >= 0])
+
+
+MATCHINGS = dict(greedy=greedy_matching, hungarian=hungarian_matching)
+
+
+@timed("link tracks")
+def link_tracks(
+    detections, ndim, max_distance=20, max_gap=MAX_GAP, method="greedy"
+):
+    """Track of every detection.
+
+    Parameters
+    ----------
+    detections : np.ndarray
+        Array of shape (N, len(DETECTION_COLUMNS)).
+    ndim : int
+        4 for TZYX movies, 3 for TYX movies.
+    max_distance : float
+        Largest distance between two linked detections, e.g. ``nms_space``.
+    max_gap : int
+        Number of timepoints a track may skip.
+    method : str
+        One of ``LINK_METHODS``.
+
+    Returns
+    -------
+    track_ids : np.ndarray
+        Track of each detection, numbered from 0 by first appearance, in
+        the order of ``detections``.
+    """
+    if method not in LINK_METHODS:
+        raise ValueError(
+            f"method must be one of {LINK_METHODS}, got {method!r}"
+        )
+    detections = np.asarray(detections, dtype=np.float32)
+    n = len(detections)
+    index = SpatialIndex(detections, ndim, cell_size=max(max_distance, 1))
+    labels = detections[index.order, _CLASS]
+    # position of the detection each one continues, in index order
+    predecessor = np.full(n, -1, dtype=np.intp)
+    linked = np.zeros(n, dtype=bool)
+    timepoints = np.unique(index.t)
+    for t in timepoints[1:]:
+        current = index.at(t)
+        positions = np.arange(current.start, current.stop)
+        points = index.coordinates[current]
+        i, j, cost = [], [], []
+        for dt in range(1, max_gap + 2):
+            query, found, distance = index.pairs(t - dt, points, max_distance)
+            free = ~linked[found] & (labels[found] == labels[positions[query]])
+            i.append(found[free])
+            j.append(positions[query[free]])
+            # a skipped timepoint costs as much as the largest distance
+            cost.append(distance[free] + (dt - 1) * max_distance)
+        i, j, cost = (np.concatenate(a) for a in (i, j, cost))
+        chosen = MATCHINGS[method](i, j, cost)
+        predecessor[j[chosen]] = i[chosen]
+        linked[i[chosen]] = True
+
+    # tracks are numbered along the sorted index, predecessors come first
+    track = np.full(n, -1, dtype=np.intp)
+    starts = predecessor < 0
+    track[starts] = np.arange(np.count_nonzero(starts))
+    for t in timepoints[1:]:
+        current = np.arange(index.at(t).start, index.at(t).stop)
+        continued = current[predecessor[current] >= 0]
+        track[continued] = track[predecessor[continued]]
+    track_ids = np.empty(n, dtype=np.intp)
+    track_ids[index.order] = track
+    # renumber by first appearance in time
+    first = np.full(track.max() + 1 if n else 0, n, dtype=np.intp)
+    np.minimum.at(first, track, np.arange(n))
+    renumber = np.empty_like(first)
+    renumber[np.argsort(first, kind="stable")] = np.arange(len(first))
+    return renumber[track_ids]
+
+
+def tracks_data(detections, track_ids, ndim):
+    """napari Tracks layer data, rows of (track id, T, Z, Y, X) or without Z.
+
+    Rows are sorted by track and time as napari requires.
+    """
+    detections = np.asarray(detections, dtype=np.float32)
+    columns = [_T] + spatial_columns(ndim - 1)
+    data = np.column_stack([track_ids, detections[:, columns]])
+    order = np.lexsort((data[:, 1], data[:, 0]))
+    return data[order].astype(np.float32)
+
+
+def track_table(detections, track_ids):
+    """Columns describing every track.
+
+    Returns
+    -------
+    columns : dict
+        ``track``, ``start`` and ``end`` timepoints, ``duration`` in
+        timepoints, number of ``detections``, event ``Class``, best
+        ``Score`` and the row of the best scoring detection, ``row``, for
+        every track.
+    """
+    detections = np.asarray(detections, dtype=np.float32)
+    n_tracks = int(track_ids.max()) + 1 if len(track_ids) else 0
+    t = detections[:, _T]
+    start = np.full(n_tracks, np.inf, dtype=np.float32)
+    end = np.full(n_tracks, -np.inf, dtype=np.float32)
+    np.minimum.at(start, track_ids, t)
+    np.maximum.at(end, track_ids, t)
+    # best scoring detection of each track, the last in score order
+    order = np.lexsort((detections[:, _SCORE], track_ids))
+    last = np.r_[track_ids[order][1:] != track_ids[order][:-1], True]
+    row = order[last]
+    return dict(
+        track=np.arange(n_tracks),
+        start=start.astype(np.int32),
+        end=end.astype(np.int32),
+        duration=(end - start + 1).astype(np.int32),
+        detections=np.bincount(track_ids, minlength=n_tracks),
+        Class=detections[row, _CLASS],
+        Score=detections[row, _SCORE],
+        row=row,
+    )
+
+
+def collapse_tracks(detections, track_ids):
+    """One detection per track, its best scoring one, in track order."""
+    return np.asarray(detections)[track_table(detections, track_ids)["row"]]
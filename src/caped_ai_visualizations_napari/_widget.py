@@ -10,7 +10,7 @@ Made by Kapoorlabs, 2022
 """
 
 import functools
-import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
 from typing import List
 
@@ -25,18 +25,40 @@ from qtpy.QtWidgets import QSizePolicy, QTabWidget, QVBoxLayout, QWidget
 
 def plugin_wrapper_caped_ai_visualization():
 
-    import matplotlib.pyplot as plt
-    from matplotlib.backends.backend_qt5agg import (
-        FigureCanvasQTAgg as FigureCanvas,
+    # oneat, and with it tensorflow, and matplotlib are only imported when
+    # they are first needed, mostly from background threads
+    from ._activations import ActivationExtractor
+    from ._boxes import TimepointBoxes
+    from ._coalesce import Pipeline
+    from ._detections import DetectionTable
+    from ._models import MODELS, ModelIndex, build, load_model, read_configs
+    from ._nms import NMS_FUNCTIONS, nms
+    from ._normalization import percentile_stats
+    from ._performance import PerformancePanel
+    from ._plots import EventCountPlot, event_counts
+    from ._prediction import (
+        DETECTION_COLUMNS,
+        predict_timepoints,
+        prediction_timepoints,
+    )
+    from ._profiling import count, timed
+    from ._projection import (
+        END_PROJECT_MID,
+        START_PROJECT_MID,
+        mid_slices,
+        model_input,
+    )
+    from ._pyramid import select_level
+    from ._registry import get_model_folder, load_registries
+    from ._spatial import view_box, viewer_camera
+    from ._tracks import (
+        LINK_METHODS,
+        link_tracks,
+        track_table,
+        tracks_data,
     )
-    from oneat.NEATModels.neat_dynamic_resnet import NEATTResNet
-    from oneat.NEATModels.neat_lstm import NEATLRNet
-    from oneat.NEATModels.neat_static_resnet import NEATResNet
-    from oneat.NEATModels.neat_vollnet import NEATVollNet
-    from oneat.NEATUtils.utils import load_json
-    from oneat.pretrained import get_model_folder, get_registered_models
 
-    DEBUG = True
+    PREVIEW_SIZE = 1024
 
     def _raise(e):
         if isinstance(e, BaseException):
@@ -44,12 +66,44 @@ def plugin_wrapper_caped_ai_visualization():
         else:
             raise ValueError(e)
 
-    def get_data(image, debug=DEBUG):
+    def full_resolution(image):
+        # inference always runs on the full resolution level of a pyramid
+        return image.data[0] if image.multiscale else image.data
+
+    def get_stats(image, x):
+        # intensity histograms are kept as long as the layer data lives, so
+        # runs on the same layer do not compute them again, projections are
+        # cached arrays themselves
+        if not plugin_prediction_parameters.norm_image.value:
+            return None
+        source = full_resolution(image)
+        return percentile_stats(
+            x, source=source if x.shape == source.shape else x
+        )
+
+    def get_input(image, method="sum"):
+        # the movie stays lazy, memory-mapped or in a pyramid, timepoints
+        # are only read by the prediction threads, 2D+t models see a lazy
+        # projection of the middle Z planes of volumetric movies
+        return model_input(
+            full_resolution(image),
+            model_class_selected(),
+            plugin_prediction_parameters.start_project_mid.value,
+            plugin_prediction_parameters.end_project_mid.value,
+            method,
+        )
 
-        image = image.data[0] if image.multiscale else image.data
-        if debug:
-            print("image loaded")
-        return np.asarray(image)
+    def get_projection(image, method="sum"):
+        # None if the model sees the movie as it is
+        x, z_mid = get_input(image, method)
+        return None if z_mid is None else x
+
+    def get_preview(image, max_size=PREVIEW_SIZE):
+        # coarsest pyramid level that still shows the planes at max_size,
+        # returned lazily so that previews never load the full resolution
+        if not image.multiscale:
+            return image.data
+        return image.data[select_level(image.data, max_size)]
 
     def abspath(root, relpath):
         root = Path(root)
@@ -59,79 +113,117 @@ def plugin_wrapper_caped_ai_visualization():
             path = root.parent / relpath
         return str(path.absolute())
 
-    def change_handler(*widgets, init=True, debug=DEBUG):
+    def same_value(a, b):
+        try:
+            return a is b or (type(a) is type(b) and bool(a == b))
+        except ValueError:
+            return False
+
+    # handlers running, changes emitted meanwhile are programmatic
+    handling = []
+
+    def change_handler(*widgets, init=True):
         def decorator_change_handler(handler):
+            # last value handled per widget
+            handled = {}
+            # handler calls, to tell whether a file dialog changed the path
+            calls = []
+
+            def handle(source, change, *args):
+                value = args[0] if args else None
+                # drop changes emitted by the handler itself, and changes
+                # that other handlers make back to the value just handled,
+                # changes made by the user are always handled
+                if handler in handling or (
+                    len(handling) > 0
+                    and not isinstance(source, mw.PushButton)
+                    and id(source) in handled
+                    and same_value(handled[id(source)], value)
+                ):
+                    count(f"dropped {change} {source.name}")
+                    return
+                handled[id(source)] = value
+                calls.append(None)
+                count(f"{change} {source.name}")
+                handling.append(handler)
+                try:
+                    return handler(*args)
+                finally:
+                    handling.pop()
+
             @functools.wraps(handler)
             def wrapper(*args):
-                source = Signal.sender()
-                emitter = Signal.current_emitter()
-                if debug:
-                    print(f"{str(emitter.name).upper()}: {source.name}")
-                return handler(*args)
+                change = str(Signal.current_emitter().name)
+                return handle(Signal.sender(), change, *args)
+
+            def connect_dialog(widget):
+                # the path picked again in the file dialog does not emit a
+                # change, nor does a cancelled one, both handle the path
+                # again, the dialog runs in the first slot of its button
+                before = []
+
+                def dialog_opened():
+                    before[:] = [len(calls)]
+
+                def dialog_closed():
+                    if before == [len(calls)] and widget.value:
+                        handle(widget, "reselected", widget.value)
+
+                widget.choose_btn.changed.connect(dialog_opened, priority=1)
+                widget.choose_btn.changed.connect(dialog_closed)
 
             for widget in widgets:
                 widget.changed.connect(wrapper)
+                if isinstance(widget, mw.FileEdit):
+                    connect_dialog(widget)
                 if init:
                     widget.changed(widget.value)
             return wrapper
 
         return decorator_change_handler
 
-    _models_vollnet, _aliases_vollnet = get_registered_models(NEATVollNet)
-
-    _models_lrnet, _aliases_lrnet = get_registered_models(NEATLRNet)
+    # pretrained model choices are filled in once the registries are loaded
+    models_vollnet = []
+    models_lrnet = []
+    models_tresnet = []
+    models_resnet = []
 
-    _models_tresnet, _aliases_tresnet = get_registered_models(NEATTResNet)
-
-    _models_resnet, _aliases_resnet = get_registered_models(NEATResNet)
-
-    models_vollnet = [
-        ((_aliases_vollnet[m][0] if len(_aliases_vollnet[m]) > 0 else m), m)
-        for m in _models_vollnet
-    ]
-    print(models_vollnet)
-    models_lrnet = [
-        ((_aliases_lrnet[m][0] if len(_aliases_lrnet[m]) > 0 else m), m)
-        for m in _models_lrnet
-    ]
-
-    models_tresnet = [
-        ((_aliases_tresnet[m][0] if len(_aliases_tresnet[m]) > 0 else m), m)
-        for m in _models_tresnet
-    ]
-
-    models_resnet = [
-        ((_aliases_resnet[m][0] if len(_aliases_resnet[m]) > 0 else m), m)
-        for m in _models_resnet
-    ]
-
-    nms_algorithms = ["iou"]
+    nms_algorithms = list(NMS_FUNCTIONS)
 
     model_parameters = dict()
     model_catagories = dict()
     model_cord = dict()
+    model_index = ModelIndex()
 
     model_selected = None
     worker = None
+    # detections of the last prediction, before non maximal suppression
+    detections = dict(
+        data=None, ndim=None, name=None, catagories=None, n_timepoints=None
+    )
+    # boxes of the detections shown, only the current timepoint is drawn
+    boxes = dict(data=None, name=None, viewer=None)
+    # activation maps of the selected model on the selected image
+    activations = dict(key=None, extractor=None)
     CUSTOM_NEAT = "CUSTOM_NEAT"
     CSV_PREDICTIONS = "CSV_PREDICTIONS"
     PRETRAINED = "PRETRAINED"
 
     DEFAULTS_MODEL = dict(
-        oneat_model_class=NEATVollNet,
+        oneat_model_class="NEATVollNet",
         oneat_model_type=CUSTOM_NEAT,
-        model_vollnet=models_vollnet[0][0],
-        model_lrnet=models_lrnet[0][0],
-        model_tresnet=models_tresnet[0][0],
-        model_resnet=models_resnet[0][0],
+        model_vollnet=None,
+        model_lrnet=None,
+        model_tresnet=None,
+        model_resnet=None,
         axes="TZYX",
     )
 
     oneat_model_class_choices = [
-        ("Volumetric (3D+t)", NEATVollNet),
-        ("LSTM (2D+t)", NEATLRNet),
-        ("CNN (2D+t)", NEATTResNet),
-        ("CNN (2D)", NEATResNet),
+        ("Volumetric (3D+t)", "NEATVollNet"),
+        ("LSTM (2D+t)", "NEATLRNet"),
+        ("CNN (2D+t)", "NEATTResNet"),
+        ("CNN (2D)", "NEATResNet"),
     ]
 
     oneat_model_type_choices = [
@@ -147,16 +239,19 @@ def plugin_wrapper_caped_ai_visualization():
     DEFAULTS_NMST_PARAMETERS = dict(
         nms_space=20,
         nms_time=2,
+        link_tracks=False,
+        link_method=LINK_METHODS[0],
     )
 
     DEFAULTS_PRED_PARAMETERS = dict(
         norm_image=True,
+        per_timepoint=False,
         n_tiles=(1, 1, 1),
         event_threshold=0.9,
         event_confidence=0.9,
         nms_function=nms_algorithms[0],
-        start_project_mid=4,
-        end_project_mid=1,
+        start_project_mid=START_PROJECT_MID,
+        end_project_mid=END_PROJECT_MID,
     )
 
     @magicgui(
@@ -194,7 +289,7 @@ def plugin_wrapper_caped_ai_visualization():
 
     @magicgui(
         score_slider=dict(
-            widget_type="Slider",
+            widget_type="FloatSlider",
             label="Score Slider",
             min=0.0,
             max=1.0,
@@ -216,12 +311,27 @@ def plugin_wrapper_caped_ai_visualization():
             step=1,
             value=DEFAULTS_NMST_PARAMETERS["nms_time"],
         ),
+        link_tracks=dict(
+            widget_type="CheckBox",
+            text="Link events into tracks",
+            tooltip="Link detections closer than the NMS veto in space "
+            "across timepoints",
+            value=DEFAULTS_NMST_PARAMETERS["link_tracks"],
+        ),
+        link_method=dict(
+            widget_type="ComboBox",
+            label="Linking",
+            choices=LINK_METHODS,
+            value=DEFAULTS_NMST_PARAMETERS["link_method"],
+        ),
         call_button=False,
     )
     def plugin_nmst_parameters(
         score_slider,
         nms_space,
         nms_time,
+        link_tracks,
+        link_method,
         defaults_nmst_parameters_button,
     ):
 
@@ -233,6 +343,11 @@ def plugin_wrapper_caped_ai_visualization():
             text="Normalize Image",
             value=DEFAULTS_PRED_PARAMETERS["norm_image"],
         ),
+        per_timepoint=dict(
+            widget_type="CheckBox",
+            text="Normalize Each Timepoint",
+            value=DEFAULTS_PRED_PARAMETERS["per_timepoint"],
+        ),
         n_tiles=dict(
             widget_type="LiteralEvalLineEdit",
             label="Number of Tiles",
@@ -278,6 +393,7 @@ def plugin_wrapper_caped_ai_visualization():
     )
     def plugin_prediction_parameters(
         norm_image,
+        per_timepoint,
         n_tiles,
         nms_function,
         event_threshold,
@@ -318,28 +434,24 @@ def plugin_wrapper_caped_ai_visualization():
             visible=False,
             label="Pre-trained VollNet Model",
             choices=models_vollnet,
-            value=DEFAULTS_MODEL["model_vollnet"],
         ),
         model_lrnet=dict(
             widget_type="ComboBox",
             visible=False,
             label="Pre-trained LRNet Model",
             choices=models_lrnet,
-            value=DEFAULTS_MODEL["model_lrnet"],
         ),
         model_tresnet=dict(
             widget_type="ComboBox",
             visible=False,
             label="Pre-trained TresNet Model",
             choices=models_tresnet,
-            value=DEFAULTS_MODEL["model_tresnet"],
         ),
         model_resnet=dict(
             widget_type="ComboBox",
             visible=False,
             label="Pre-trained ResNet Model",
             choices=models_resnet,
-            value=DEFAULTS_MODEL["model_resnet"],
         ),
         model_folder=dict(
             widget_type="FileEdit",
@@ -376,10 +488,82 @@ def plugin_wrapper_caped_ai_visualization():
         defaults_model_button,
         progress_bar: mw.ProgressBar,
     ) -> List[napari.types.LayerDataTuple]:
-        # x = get_data(image)
-
         nonlocal worker
 
+        if worker is not None and worker.is_running:
+            # pressing the button during a run aborts it after the
+            # timepoint that is currently being processed
+            worker.quit()
+            return
+
+        model_selected is not None or _raise(ValueError("No model selected"))
+        # detections on a projection are placed on the middle Z plane
+        x, z_mid = get_input(image)
+        key, model_class = model_selected, model_class_selected()
+        ndim = len(full_resolution(image).shape)
+        detections.update(
+            data=DetectionTable(),
+            ndim=ndim,
+            name=f"{image.name} oneat detections",
+            catagories=model_catagories.get(model_selected),
+            n_timepoints=x.shape[0],
+        )
+
+        @thread_worker
+        def _predict():
+            # a cold load imports tensorflow and builds the network, the
+            # number of timepoints it predicts is known once it is done
+            model = build(get_model(*key, model_class))
+            yield len(prediction_timepoints(model, x.shape[0]))
+            stats = get_stats(image, x)
+            yield from predict_timepoints(
+                model,
+                x,
+                n_tiles=plugin_prediction_parameters.n_tiles.value,
+                event_threshold=(
+                    plugin_prediction_parameters.event_threshold.value
+                ),
+                event_confidence=(
+                    plugin_prediction_parameters.event_confidence.value
+                ),
+                norm_image=plugin_prediction_parameters.norm_image.value,
+                stats=stats,
+                per_timepoint=(
+                    plugin_prediction_parameters.per_timepoint.value
+                ),
+            )
+
+        def _update_detections(value):
+            if not isinstance(value, tuple):
+                progress_bar.label = "Detecting events"
+                progress_bar.max = value
+                return
+            t, found = value
+            progress_bar.increment(1)
+            if len(found) > 0:
+                if z_mid is not None:
+                    found[:, DETECTION_COLUMNS.index("Z")] = z_mid
+                detections["data"].append(found)
+                refresh_detections.invalidate("filter")
+
+        def _finished():
+            plugin.call_button.text = call_button_text
+            progress_bar.hide()
+
+        call_button_text = plugin.call_button.text
+        plugin.call_button.text = "Cancel Prediction"
+        # busy until the model is loaded
+        progress_bar.label = "Loading model"
+        progress_bar.min = 0
+        progress_bar.max = 0
+        progress_bar.value = 0
+        progress_bar.show()
+
+        worker = _predict()
+        worker.yielded.connect(_update_detections)
+        worker.finished.connect(_finished)
+        worker.start()
+
     """
     widget_for_modeltype = {
         NEATVollNet: plugin.model_vollnet,
@@ -398,19 +582,62 @@ def plugin_wrapper_caped_ai_visualization():
     _parameter_tab_layout.addWidget(plugin_prediction_parameters.native)
     tabs.addTab(parameter_tab, "Detection Parameter Selection")
 
-    figure = plt.figure(figsize=(4, 4))
-    multiplot_widget = FigureCanvas(figure)
-    multiplot_widget.setMinimumSize(100, 100)
-    multiplot_widget.figure.subplots(1, 1)
-
     nmst_tab = QWidget()
     _nmst_tab_layout = QVBoxLayout()
 
     nmst_tab.setLayout(_nmst_tab_layout)
     _nmst_tab_layout.addWidget(plugin_nmst_parameters.native)
-    _nmst_tab_layout.addWidget(multiplot_widget)
     tabs.addTab(nmst_tab, "Temporal NMS Selection")
 
+    # detections last shown, plotted once the canvas exists
+    multiplot = dict(widget=None, plot=None, data=None)
+
+    def get_multiplot_widget():
+        # the matplotlib canvas is created when the plot is first shown
+        if multiplot["widget"] is None:
+            import matplotlib.pyplot as plt
+            from matplotlib.backends.backend_qt5agg import (
+                FigureCanvasQTAgg as FigureCanvas,
+            )
+
+            figure = plt.figure(figsize=(4, 4))
+            multiplot_widget = FigureCanvas(figure)
+            multiplot_widget.setMinimumSize(100, 100)
+            multiplot_widget.figure.subplots(1, 1)
+            _nmst_tab_layout.addWidget(multiplot_widget)
+            multiplot["widget"] = multiplot_widget
+            multiplot["plot"] = EventCountPlot(multiplot_widget)
+        return multiplot["widget"]
+
+    @timed("update event counts")
+    def show_event_counts(data=None):
+        if data is not None:
+            multiplot["data"] = data
+        data = multiplot["data"]
+        if multiplot["plot"] is None or data is None:
+            return
+        catagories = detections["catagories"]
+        if catagories:
+            events = sorted(
+                (label, name)
+                for name, label in catagories.items()
+                if label > 0
+            )
+        else:
+            labels = np.unique(data[:, DETECTION_COLUMNS.index("Class")])
+            events = [(int(label), str(int(label))) for label in labels]
+        counts = event_counts(
+            data, detections["n_timepoints"], [label for label, _ in events]
+        )
+        multiplot["plot"].update(counts, [name for _, name in events])
+
+    def _tab_change(index):
+        if tabs.widget(index) is nmst_tab:
+            get_multiplot_widget()
+            show_event_counts()
+
+    tabs.currentChanged.connect(_tab_change)
+
     activation_tab = QWidget()
     _activation_tab_layout = QVBoxLayout()
     activation_tab.setLayout(_activation_tab_layout)
@@ -418,6 +645,7 @@ def plugin_wrapper_caped_ai_visualization():
     tabs.addTab(activation_tab, "Visualize NN Activations")
 
     plugin.native.layout().addWidget(tabs)
+    plugin.native.layout().addWidget(PerformancePanel())
     plugin.label_head.native.setOpenExternalLinks(True)
     plugin.label_head.native.setSizePolicy(
         QSizePolicy.MinimumExpanding, QSizePolicy.Fixed
@@ -435,60 +663,370 @@ def plugin_wrapper_caped_ai_visualization():
 
     class Updater:
         def __init__(self):
-            def __call__(self, model_param, catconfig, cordconfig):
-                setattr(self.model_param, model_param)
-                setattr(self.catconfig, catconfig)
-                setattr(self.cordconfig, cordconfig)
-                self.viewer = plugin.viewer.value
-
-            def _model(valid):
-                widgets_valid(
-                    plugin.oneat_model_class,
-                    plugin.oneat_model_type,
-                    plugin.model_folder.line_edit,
-                    plugin.csv_folder.line_eit,
-                    valid=valid,
+            self.model_param = None
+            self.catconfig = None
+            self.cordconfig = None
+            self.viewer = None
+
+        def __call__(self, model_param, catconfig, cordconfig):
+            self.model_param = model_param
+            self.catconfig = catconfig
+            self.cordconfig = cordconfig
+            self.viewer = plugin.viewer.value
+
+            all_valid = all(
+                config is not None
+                for config in (model_param, catconfig, cordconfig)
+            )
+            self._model(all_valid)
+            plugin.call_button.enabled = all_valid
+
+        def _model(self, valid):
+            widgets_valid(
+                plugin.oneat_model_class,
+                plugin.oneat_model_type,
+                plugin.model_folder.line_edit,
+                plugin.csv_folder.line_edit,
+                valid=valid,
+            )
+
+            if valid:
+                parameters = self.model_param
+                catagories = self.catconfig
+                cord = self.cordconfig
+
+                plugin.model_folder.line_edit.tooltip = ""
+                plugin.csv_folder.line_edit.tooltip = ""
+
+                return parameters, catagories, cord
+            else:
+                plugin.model_folder.line_edit.tooltip = (
+                    "Invalid model directory"
                 )
 
-                if valid:
-                    parameters = self.model_param
-                    catagories = self.catconfig
-                    cord = self.cordconfig
+    update = Updater()
 
-                    plugin.model_folder.line_edit.tooltip = ""
-                    plugin.csv_folder.line_edit.tooltip = ""
+    @timed("filter detections")
+    def filter_detections():
+        if detections["data"] is None:
+            return None
+        return detections["data"].to_array(
+            score=plugin_nmst_parameters.score_slider.value,
+            confidence=plugin_prediction_parameters.event_confidence.value,
+        )
 
-                    return parameters, catagories, cord
-                else:
-                    plugin.model_folder.line_edit.tooltip = (
-                        "Invalid model directory"
-                    )
+    @timed("update tracks")
+    def show_tracks(data):
+        # events that persist over several timepoints, linked before NMS
+        # suppresses all but one of their detections
+        viewer = plugin.viewer.value
+        name = f"{detections['name']} tracks"
+        ndim = detections["ndim"]
+        tracks = np.zeros((0, ndim + 1), dtype=np.float32)
+        if plugin_nmst_parameters.link_tracks.value and len(data) > 0:
+            track_ids = link_tracks(
+                data,
+                ndim,
+                max_distance=plugin_nmst_parameters.nms_space.value,
+                method=plugin_nmst_parameters.link_method.value,
+            )
+            table = track_table(data, track_ids)
+            # single detections are not drawn
+            drawn = table["detections"][track_ids] > 1
+            tracks = tracks_data(data[drawn], track_ids[drawn], ndim)
+            ids = tracks[:, 0].astype(np.intp)
+            features = {
+                "duration": table["duration"][ids],
+                "Class": table["Class"][ids],
+                "Score": table["Score"][ids],
+            }
+            durations = table["duration"]
+            viewer.status = (
+                f"{len(durations)} events, lasting "
+                f"{durations.mean():.1f} timepoints on average "
+                f"(at most {durations.max()})"
+            )
+        if len(tracks) == 0:
+            if name in viewer.layers:
+                viewer.layers.remove(viewer.layers[name])
+        elif name in viewer.layers:
+            layer = viewer.layers[name]
+            # features are reset with the data, track_id always remains
+            layer.color_by = "track_id"
+            layer.data = tracks
+            layer.features = features
+            layer.color_by = "duration"
+        else:
+            viewer.add_tracks(
+                tracks, features=features, name=name, color_by="duration"
+            )
+        return data
+
+    def suppress_detections(data):
+        return data[
+            nms(
+                data,
+                nms_space=plugin_nmst_parameters.nms_space.value,
+                nms_time=plugin_nmst_parameters.nms_time.value,
+                nms_function=plugin_prediction_parameters.nms_function.value,
+            )
+        ]
+
+    @timed("update detections")
+    def show_detections(data):
+        ndim, name = detections["ndim"], detections["name"]
+        # spatial columns of DETECTION_COLUMNS for TZYX or TYX data
+        coords = data[:, :4] if ndim == 4 else data[:, [0, 2, 3]]
+        features = {
+            k: data[:, DETECTION_COLUMNS.index(k)]
+            for k in ("Score", "Size", "Confidence", "Class")
+        }
+        viewer = plugin.viewer.value
+        if name in viewer.layers:
+            layer = viewer.layers[name]
+            layer.data = coords
+            layer.features = features
+        else:
+            viewer.add_points(
+                coords,
+                features=features,
+                name=name,
+                face_color="red",
+                opacity=0.5,
+            )
+        boxes.update(
+            data=TimepointBoxes(data, ndim, detections["catagories"]),
+            name=f"{name} boxes",
+        )
+        if boxes["viewer"] is not viewer:
+            viewer.dims.events.current_step.connect(
+                lambda event: refresh_boxes.invalidate()
+            )
+            # only the boxes in the field of view are drawn
+            camera = viewer_camera(viewer)
+            camera.events.center.connect(
+                lambda event: refresh_boxes.invalidate()
+            )
+            camera.events.zoom.connect(
+                lambda event: refresh_boxes.invalidate()
+            )
+            viewer.mouse_drag_callbacks.append(pick_detection)
+            boxes["viewer"] = viewer
+        show_boxes()
+        show_event_counts(data)
+        return data
+
+    @timed("update boxes")
+    def show_boxes():
+        data, name, viewer = (boxes[k] for k in ("data", "name", "viewer"))
+        if data is None or viewer is None:
+            return
+        # time is the first axis of the movie, after any extra viewer axes
+        axis = viewer.dims.ndim - detections["ndim"]
+        vertices, colors = data.at(
+            viewer.dims.current_step[axis], view=view_box(viewer)
+        )
+        if name in viewer.layers:
+            layer = viewer.layers[name]
+            layer.data = []
+            layer.add_rectangles(vertices, edge_color=colors)
+        else:
+            viewer.add_shapes(
+                vertices,
+                shape_type="rectangle",
+                edge_color=colors,
+                face_color="transparent",
+                edge_width=2,
+                name=name,
+            )
+
+    def pick_detection(viewer, event):
+        # alt-click selects the closest detection of the shown timepoint
+        data, name = boxes["data"], detections["name"]
+        if "Alt" not in event.modifiers or data is None:
+            return
+        if name not in viewer.layers:
+            return
+        ndim = detections["ndim"]
+        position = event.position[-ndim:]
+        found = data.index.nearest(int(round(position[0])), position[1:])
+        layer = viewer.layers[name]
+        if found is None:
+            layer.selected_data = set()
+            return
+        row = int(data.index.order[found])
+        layer.selected_data = {row}
+        features = layer.features.iloc[row]
+        viewer.status = f"{name} {row}: " + ", ".join(
+            f"{k} {v:.3g}" for k, v in features.items()
+        )
 
-            def _n_tiles(valid):
-                n_tiles, image, err = getattr(self.args, "n_tiles", (1, 1, 1))
-                widgets_valid(
-                    plugin_prediction_parameters.n_tiles,
-                    valid=(valid or image is None),
+    # redraw the detections at most once per frame while sliders and
+    # spinboxes are being dragged, instead of once per emitted value, and
+    # only from the first stage that a change affects
+    refresh_detections = Pipeline(
+        [
+            ("filter", filter_detections),
+            ("tracks", show_tracks),
+            ("nms", suppress_detections),
+            ("show", show_detections),
+        ]
+    )
+    refresh_boxes = Pipeline([("boxes", show_boxes)])
+
+    def show_activations():
+        image = plugin.image.value
+        if model_selected is None or image is None:
+            return
+        first = plugin_activation.start_layer_viz.value
+        last = plugin_activation.end_layer_viz.value
+        t = plugin_activation.visualize_point.value
+        n_tiles = plugin_prediction_parameters.n_tiles.value
+        norm_image = plugin_prediction_parameters.norm_image.value
+        per_timepoint = plugin_prediction_parameters.per_timepoint.value
+        projection = get_projection(image)
+        key = (
+            model_selected,
+            plugin.oneat_model_class.value,
+            image.name,
+            id(image.data),
+            id(projection),
+            n_tiles,
+            norm_image,
+            per_timepoint,
+        )
+
+        @thread_worker
+        def _extract():
+            if activations["key"] != key:
+                model = build(get_model(*model_selected))
+                x = (
+                    full_resolution(image)
+                    if projection is None
+                    else projection
                 )
-                if valid:
-                    plugin_prediction_parameters.n_tiles.tooltip = "\n".join(
-                        [
-                            f"{t}: {s}"
-                            for t, s in zip(n_tiles, get_data(image).shape)
-                        ]
-                    )
-                    return n_tiles
+                activations.update(
+                    key=key,
+                    extractor=ActivationExtractor(
+                        model,
+                        x,
+                        key,
+                        n_tiles,
+                        norm_image,
+                        stats=get_stats(image, x),
+                        per_timepoint=per_timepoint,
+                    ),
+                )
+            extractor = activations["extractor"]
+            names = extractor.layer_names()
+            stacks = []
+            for layer in range(first, min(last, len(names) - 1) + 1):
+                stack, scale = extractor.stack(layer, t)
+                maps = extractor.activations(layer, t)[0]
+                # contrast limits of the shown timepoint, napari would
+                # otherwise compute the whole lazy stack to find them
+                limits = (float(maps.min()), float(maps.max()))
+                limits = (limits[0], max(limits[1], limits[0] + 1e-6))
+                stacks.append((names[layer], stack, scale, limits))
+            return stacks
+
+        def _show(stacks):
+            viewer = plugin.viewer.value
+            prefix = f"{image.name} activations "
+            names = [prefix + name for name, *_ in stacks]
+            for layer in list(viewer.layers):
+                if layer.name.startswith(prefix) and layer.name not in names:
+                    viewer.layers.remove(layer)
+            for name, (_, stack, scale, limits) in zip(names, stacks):
+                # activation pixels are centred on the movie pixels they
+                # were computed from
+                translate = tuple((s - 1) / 2 for s in scale)
+                if name in viewer.layers:
+                    layer = viewer.layers[name]
+                    layer.data = stack
+                    layer.scale = scale
+                    layer.translate = translate
+                    layer.contrast_limits = limits
                 else:
-                    msg = str(err) if err is not None else ""
-                    plugin_prediction_parameters.n_tiles.tooltip = msg
+                    viewer.add_image(
+                        stack,
+                        name=name,
+                        scale=scale,
+                        translate=translate,
+                        contrast_limits=limits,
+                        colormap="inferno",
+                        blending="additive",
+                    )
+            viewer.dims.set_current_step(viewer.dims.ndim - image.ndim, t)
+
+        worker = _extract()
+        worker.returned.connect(_show)
+        worker.start()
+
+    refresh_activations = Pipeline([("activations", show_activations)])
+
+    def show_projection():
+        # preview of what a 2D+t model sees of a volumetric movie, spanning
+        # the projected Z planes
+        image = plugin.image.value
+        viewer = plugin.viewer.value
+        if image is None or viewer is None:
+            return
+        name = f"{image.name} mid projection"
+        try:
+            projection = get_projection(image, method="max")
+        except ValueError:
+            projection = None
+        if projection is None:
+            if name in viewer.layers:
+                viewer.layers.remove(viewer.layers[name])
+            return
+        z = mid_slices(
+            full_resolution(image).shape[1],
+            plugin_prediction_parameters.start_project_mid.value,
+            plugin_prediction_parameters.end_project_mid.value,
+        )
+        t = min(viewer.dims.current_step[0], projection.shape[0] - 1)
+
+        @thread_worker
+        def _limits():
+            # of the shown frame only, napari would compute the whole stack
+            frame = np.asarray(projection[t])
+            lo, hi = float(frame.min()), float(frame.max())
+            return lo, max(hi, lo + 1e-6)
+
+        def _show(limits):
+            data = projection[:, None]
+            scale = (1, z.stop - z.start) + tuple(image.scale[-2:])
+            translate = (0, (z.start + z.stop - 1) / 2) + tuple(
+                image.translate[-2:]
+            )
+            if name in viewer.layers:
+                layer = viewer.layers[name]
+                layer.data = data
+                layer.scale = scale
+                layer.translate = translate
+                layer.contrast_limits = limits
+            else:
+                viewer.add_image(
+                    data,
+                    name=name,
+                    scale=scale,
+                    translate=translate,
+                    contrast_limits=limits,
+                    colormap="magenta",
+                    blending="additive",
+                )
 
-            all_valid = True
-            plugin.call_button.enabled = all_valid
+        worker = _limits()
+        worker.returned.connect(_show)
+        worker.start()
 
-    update = Updater()
+    refresh_projection = Pipeline([("projection", show_projection)])
 
-    @functools.lru_cache(maxsize=None)
-    def get_model(model_type, model):
+    def get_model(model_type, model, model_class=None):
+        # instances are shared through the bounded model cache, so switching
+        # back to a model does not load it again
         if model_type == CUSTOM_NEAT:
             path = Path(model)
             path.is_dir() or _raise(
@@ -498,15 +1036,52 @@ def plugin_wrapper_caped_ai_visualization():
             catconfig = model_catagories[(model_type, model)]
             cordconfig = model_cord[(model_type, model)]
 
-            model_class = plugin.oneat_model_class.value
-            return model_class(
-                model_param, str(path.parent), catconfig, cordconfig
+            model_class = model_class or plugin.oneat_model_class.value
+            model_index.set_last_used(
+                model_type, path, model_class=model_class
             )
+            return MODELS.get(
+                (model_type, str(path), model_class),
+                lambda: load_model(
+                    model_class,
+                    folder=path,
+                    configs=dict(
+                        parameters=model_param,
+                        catagories=catconfig,
+                        cord=cordconfig,
+                    ),
+                ),
+            )
+        else:
+            # the folder that download_model verified, fetched again if it
+            # is not in the index
+            entry = model_index.get(model_type, model)
+            model_index.set_last_used(model_type, model)
+            return MODELS.get(
+                (model_type, model),
+                lambda: load_model(
+                    model_type,
+                    model,
+                    folder=None if entry is None else entry["folder"],
+                ),
+            )
+
+    def remember_configs(key, configs):
+        model_parameters[key] = configs["parameters"]
+        model_catagories[key] = configs["catagories"]
+        model_cord[key] = configs["cord"]
+
+    def model_class_selected():
+        model_type = model_selected[0] if model_selected else None
+        if model_type == CUSTOM_NEAT:
+            return plugin.oneat_model_class.value
+        return model_type
 
     def select_model(key):
         nonlocal model_selected
         if key is not None:
             model_selected = key
+            refresh_projection.invalidate()
             model_param = model_parameters.get(key)
             catconfig = model_catagories.get(key)
             cordconfig = model_cord.get(key)
@@ -523,9 +1098,7 @@ def plugin_wrapper_caped_ai_visualization():
         try:
             if not path.is_dir():
                 return
-            model_parameters[key] = load_json(str(path / "parameters.json"))
-            model_catagories[key] = load_json(str(path / "catagories.json"))
-            model_cord[key] = load_json(str(path / "cord.json"))
+            remember_configs(key, read_configs(path))
         except FileNotFoundError:
             pass
         finally:
@@ -541,80 +1114,138 @@ def plugin_wrapper_caped_ai_visualization():
     def _model_change(model_name: str):
 
         model_class = (
-            NEATVollNet
+            "NEATVollNet"
             if Signal.sender() is plugin.model_vollnet
-            else NEATLRNet
+            else "NEATLRNet"
             if Signal.sender() is plugin.model_lrnet
-            else NEATTResNet
+            else "NEATTResNet"
             if Signal.sender() is plugin.model_tresnet
-            else NEATResNet
+            else "NEATResNet"
             if Signal.sender() is plugin.model_resnet
             else None
         )
         key = model_class, model_name
+        if key not in model_parameters:
+            # pretrained folders resolved in an earlier session
+            entry = model_index.get(*key)
+            if entry is not None:
+                remember_configs(key, entry)
+
         if key not in model_parameters:
 
             @thread_worker
             def _get_model_folder():
-                return get_model_folder(*key)
+                # the files are downloaded on their own threads, their
+                # progress is passed on to the GUI thread from here
+                received = [0, 0]
+
+                def _progress(done, total):
+                    received[:] = done, total
+
+                with ThreadPoolExecutor(1) as pool:
+                    future = pool.submit(get_model_folder, *key, _progress)
+                    while not wait([future], timeout=0.1).done:
+                        yield tuple(received)
+                    return future.result()
+
+            def _show_progress(received):
+                done, total = received
+                plugin.progress_bar.value = (
+                    int(100 * done / total) if total > 0 else 0
+                )
+                plugin.progress_bar.label = (
+                    f"Downloading model, {done / 2**20:.1f} of "
+                    f"{total / 2**20:.1f} MiB"
+                )
 
             def _process_model_folder(path):
                 try:
-                    model_parameters[key] = load_json(
-                        str(path / "parameters.json")
-                    )
-                    model_catagories[key] = load_json(
-                        str(path / "catagories.json")
-                    )
-                    model_cord[key] = load_json(str(path / "cord.json"))
+                    configs = read_configs(path)
+                    remember_configs(key, configs)
+                    model_index.put(*key, folder=str(path), **configs)
                 finally:
                     select_model(key)
                     plugin.progress_bar.hide()
 
-            worker = _get_model_folder()
-            worker.returned.connect(_process_model_folder)
-            worker.start()
+            def _download_failed(error):
+                # napari reports the error of the worker
+                select_model(key)
+                plugin.progress_bar.hide()
 
-            time.sleep(0.1)
             plugin.call_button.enabled = False
             plugin.progress_bar.label = "Downloading model"
+            plugin.progress_bar.min = 0
+            plugin.progress_bar.max = 100
+            plugin.progress_bar.value = 0
             plugin.progress_bar.show()
 
+            worker = _get_model_folder()
+            worker.yielded.connect(_show_progress)
+            worker.returned.connect(_process_model_folder)
+            worker.errored.connect(_download_failed)
+            worker.start()
+
         else:
             select_model(key)
 
     @change_handler(plugin_prediction_parameters.event_threshold)
     def _event_threshold_change(value: float):
-        plugin_prediction_parameters.event_threshold.value = value
-
-    @change_handler(plugin_prediction_parameters.event_confidence)
-    def _event_confidence_change(value: float):
-        plugin_prediction_parameters.event_confidence.value = value
+        # the score slider ranges between the chosen threshold and 1
+        plugin_nmst_parameters.score_slider.min = value
 
-    @change_handler(plugin_nmst_parameters.nms_space)
-    def _nms_space_change(value: float):
-        plugin_nmst_parameters.nms_space.value = value
+    @change_handler(
+        plugin_nmst_parameters.score_slider,
+        plugin_prediction_parameters.event_confidence,
+        init=False,
+    )
+    def _threshold_change(value):
+        refresh_detections.invalidate("filter")
 
-    @change_handler(plugin_nmst_parameters.nms_time)
-    def _nms_time_change(value: float):
-        plugin_nmst_parameters.nms_time.value = value
+    @change_handler(
+        plugin_nmst_parameters.nms_space,
+        plugin_nmst_parameters.nms_time,
+        plugin_prediction_parameters.nms_function,
+        init=False,
+    )
+    def _nms_change(value):
+        # tracks are linked within the NMS veto in space
+        if Signal.sender() is plugin_nmst_parameters.nms_space:
+            refresh_detections.invalidate("tracks")
+        else:
+            refresh_detections.invalidate("nms")
 
-    @change_handler(plugin_activation.start_layer_viz)
-    def _start_layer_change(value: int):
-        plugin_activation.start_layer_viz.value = value
+    @change_handler(
+        plugin_nmst_parameters.link_tracks,
+        plugin_nmst_parameters.link_method,
+        init=False,
+    )
+    def _link_change(value):
+        refresh_detections.invalidate("tracks")
 
-    @change_handler(plugin_activation.end_layer_viz)
-    def _end_layer_change(value: int):
-        plugin_activation.end_layer_viz.value = value
+    @change_handler(
+        plugin_activation.start_layer_viz,
+        plugin_activation.end_layer_viz,
+        plugin_activation.visualize_point,
+        init=False,
+    )
+    def _activation_change(value: int):
+        refresh_activations.invalidate()
 
-    @change_handler(plugin_activation.visualize_point)
-    def _visualize_point_change(value: int):
-        plugin_activation.visualize_point.value = value
+    @change_handler(
+        plugin_prediction_parameters.start_project_mid,
+        plugin_prediction_parameters.end_project_mid,
+        plugin.oneat_model_class,
+        init=False,
+    )
+    def _projection_change(value):
+        refresh_projection.invalidate()
 
     @change_handler(plugin.defaults_model_button, init=False)
     def restore_model_defaults():
         for k, v in DEFAULTS_MODEL.items():
-            getattr(plugin, k).value = v
+            # no pretrained defaults until the registries are loaded
+            if v is not None:
+                getattr(plugin, k).value = v
 
     @change_handler(
         plugin_nmst_parameters.defaults_nmst_parameters_button,
@@ -622,7 +1253,7 @@ def plugin_wrapper_caped_ai_visualization():
     )
     def restore_nmst_parameters_defaults():
         for k, v in DEFAULTS_NMST_PARAMETERS.items():
-            getattr(plugin, k).value = v
+            getattr(plugin_nmst_parameters, k).value = v
 
     @change_handler(
         plugin_activation.defaults_activation_button,
@@ -630,7 +1261,7 @@ def plugin_wrapper_caped_ai_visualization():
     )
     def restore_activation_defaults():
         for k, v in DEFAULTS_ACTIVATION_PARAMETERS.items():
-            getattr(plugin, k).value = v
+            getattr(plugin_activation, k).value = v
 
     @change_handler(
         plugin_prediction_parameters.defaults_prediction_parameters_button,
@@ -638,12 +1269,59 @@ def plugin_wrapper_caped_ai_visualization():
     )
     def restore_prediction_parameters_defaults():
         for k, v in DEFAULTS_PRED_PARAMETERS.items():
-            getattr(plugin, k).value = v
+            getattr(plugin_prediction_parameters, k).value = v
 
     @change_handler(plugin.image, init=False)
     def _image_change(image: napari.layers.Image):
+        shape = image.data[0].shape if image.multiscale else image.data.shape
         plugin.image.tooltip = (
-            f"Shape: {get_data(image).shape, str(image.name)}"
+            f"Shape: {shape, str(image.name)}\n"
+            f"Preview shape: {get_preview(image).shape}"
         )
+        refresh_projection.invalidate()
+
+    @thread_worker
+    def _warm_up(last):
+        # best effort, a model that fails to load is reported when used
+        try:
+            if last["model_type"] == CUSTOM_NEAT:
+                path = Path(last["model"])
+                configs = model_index.get(CUSTOM_NEAT, path)
+                if configs is None:
+                    configs = read_configs(path)
+                remember_configs((CUSTOM_NEAT, path), configs)
+                model = get_model(CUSTOM_NEAT, path, last["model_class"])
+            else:
+                model = get_model(last["model_type"], last["model"])
+            build(model)
+        except Exception:
+            count("warm up failed")
+
+    widget_for_model_class = {
+        "NEATVollNet": plugin.model_vollnet,
+        "NEATLRNet": plugin.model_lrnet,
+        "NEATTResNet": plugin.model_tresnet,
+        "NEATResNet": plugin.model_resnet,
+    }
+
+    def _registries_loaded(registries):
+        for name, choices in registries.items():
+            widget = widget_for_model_class[name]
+            default = choices[0][1] if len(choices) > 0 else None
+            DEFAULTS_MODEL[widget.name] = default
+            # filling the choices must not trigger a model download
+            with widget.changed.blocked():
+                widget.choices = choices
+                if default is not None:
+                    widget.value = default
+
+    registries = thread_worker(load_registries)()
+    registries.returned.connect(_registries_loaded)
+    registries.start()
+
+    # load the network used last in the background while the user sets up
+    last_used = model_index.last_used()
+    if last_used is not None:
+        _warm_up(last_used).start()
 
     return plugin
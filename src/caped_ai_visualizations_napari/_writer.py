@@ -1,33 +1,352 @@
 """
-This module is an example of a barebones writer plugin for napari.
+Writers of image and detection layers.
 
 It implements the Writer specification.
 see: https://napari.org/stable/plugins/guides.html?#writers
 
-Replace code below according to your needs.
+Images are written as compressed OME-TIFF or OME-Zarr one plane at a time,
+so that lazy (dask) layers larger than memory are never loaded as a whole
+and numpy layers are never copied. TIFF planes are cut into tiles that
+tifffile compresses on several threads, Zarr planes are written by a pool
+of threads, one chunk each. Points and Shapes layers of detections are
+written as oneat csv files, in chunks of rows, or as structured ``.npy``
+files, both of which the reader opens again.
 """
 from __future__ import annotations
 
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import TYPE_CHECKING, Any, List, Sequence, Tuple, Union
 
+import numpy as np
+
+from ._cache import save_columns
+from ._profiling import timed
+from ._reader import CSV_CHUNKSIZE
+from ._tiling import default_workers
+
 if TYPE_CHECKING:
     DataType = Union[Any, Sequence[Any]]
     FullLayerData = Tuple[DataType, dict, str]
 
+# OME axis names of layers by dimension, 3D layers are TYX movies as for
+# the 2D+t models
+AXES = {2: "YX", 3: "TYX", 4: "TZYX", 5: "CTZYX"}
+TIFF_TILE = (256, 256)
+# deflate is read by every OME-TIFF reader, a low level is much faster at
+# a small cost in size
+TIFF_COMPRESSION = ("zlib", 1)
+ZARR_CHUNK = 1024
+ZARR_SUFFIXES = (".zarr", ".zarr/")
+
+
+def image_axes(ndim, rgb=False):
+    if rgb:
+        return image_axes(ndim - 1) + "S"
+    return AXES.get(ndim, "Q" * (ndim - 5) + AXES[5])
+
+
+def iter_planes(data, n_leading):
+    """Planes of ``data`` over its first ``n_leading`` axes, one at a time."""
+    for index in np.ndindex(*data.shape[:n_leading]):
+        yield np.asarray(data[index])
+
+
+def iter_tiles(planes, tile):
+    for plane in planes:
+        for y in range(0, plane.shape[0], tile[0]):
+            for x in range(0, plane.shape[1], tile[1]):
+                yield plane[y : y + tile[0], x : x + tile[1]]
+
+
+def _atomic_path(path):
+    fd, tmp = tempfile.mkstemp(dir=Path(path).parent, suffix=".tmp")
+    os.close(fd)
+    return tmp
+
+
+def write_ome_tiff(path, data, axes, scale=None, max_workers=None):
+    """Write an image as a tiled, compressed OME-TIFF, plane by plane.
+
+    Parameters
+    ----------
+    path : str
+        Output file, replaced atomically once it is complete.
+    data : array-like
+        numpy or dask array.
+    axes : str
+        OME axis names of ``data``, e.g. ``"TZYX"``.
+    scale : sequence of float, optional
+        Pixel size along each axis, stored as the physical sizes.
+    max_workers : int, optional
+        Threads compressing tiles.
+    """
+    from tifffile import imwrite
+
+    rgb = axes.endswith("S")
+    n_leading = data.ndim - (3 if rgb else 2)
+    metadata = dict(axes=axes)
+    if scale is not None:
+        for axis, size in zip(axes, scale):
+            if axis in "ZYX":
+                metadata[f"PhysicalSize{axis}"] = float(size)
+    planes = iter_planes(data, n_leading)
+    plane_shape = data.shape[n_leading:]
+    tiled = not rgb and all(n >= t for n, t in zip(plane_shape, TIFF_TILE))
+    compression, level = TIFF_COMPRESSION
+
+    tmp = _atomic_path(path)
+    try:
+        imwrite(
+            tmp,
+            iter_tiles(planes, TIFF_TILE) if tiled else planes,
+            shape=data.shape,
+            dtype=data.dtype,
+            tile=TIFF_TILE if tiled else None,
+            photometric="rgb" if rgb else "minisblack",
+            compression=compression,
+            compressionargs=dict(level=level),
+            maxworkers=max_workers or default_workers(),
+            ome=True,
+            metadata=metadata,
+            bigtiff=data.nbytes > 2**31,
+        )
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return str(path)
+
+
+def write_ome_zarr(path, levels, axes, scale=None, max_workers=None):
+    """Write an image, or its pyramid, as compressed OME-Zarr.
+
+    Every level is written plane by plane into chunks of at most
+    ``ZARR_CHUNK`` pixels per side, by ``max_workers`` threads.
+    """
+    try:
+        import zarr
+    except ImportError as e:
+        raise ImportError(
+            "writing .zarr files requires zarr, pip install zarr"
+        ) from e
+
+    zarr_v3 = int(zarr.__version__.split(".")[0]) >= 3
+    scale = [1.0] * len(axes) if scale is None else [float(s) for s in scale]
+    group = zarr.open_group(str(path), mode="w")
+    datasets = []
+    with ThreadPoolExecutor(max_workers or default_workers()) as executor:
+        for level, data in enumerate(levels):
+            n_leading = data.ndim - 2
+            chunks = (1,) * n_leading + tuple(
+                min(n, ZARR_CHUNK) for n in data.shape[n_leading:]
+            )
+            array = zarr.open_array(
+                store=str(Path(path) / str(level)),
+                mode="w",
+                shape=data.shape,
+                chunks=chunks,
+                dtype=data.dtype,
+            )
+
+            def _write(index, data=data, array=array):
+                array[index] = np.asarray(data[index])
+
+            # consume the iterator so that errors are raised here
+            list(executor.map(_write, np.ndindex(*data.shape[:n_leading])))
+            factors = [n / m for n, m in zip(levels[0].shape, data.shape)]
+            datasets.append(
+                dict(
+                    path=str(level),
+                    coordinateTransformations=[
+                        dict(
+                            type="scale",
+                            scale=[s * f for s, f in zip(scale, factors)],
+                        )
+                    ],
+                )
+            )
+    kinds = dict(C="channel", S="channel", T="time")
+    multiscales = [
+        dict(
+            version="0.5" if zarr_v3 else "0.4",
+            axes=[
+                dict(name=a.lower(), type=kinds.get(a, "space")) for a in axes
+            ],
+            datasets=datasets,
+        )
+    ]
+    if zarr_v3:
+        group.attrs["ome"] = dict(version="0.5", multiscales=multiscales)
+    else:
+        group.attrs["multiscales"] = multiscales
+    return str(path)
 
+
+@timed("write image")
 def write_single_image(path: str, data: Any, meta: dict) -> List[str]:
-    """Writes a single image layer"""
+    """Writes a single image layer as OME-TIFF or OME-Zarr.
 
-    # implement your writer logic here ...
+    Paths ending with ``.zarr`` are written as OME-Zarr, which keeps all
+    levels of a multiscale layer. TIFF files only get the full resolution.
+    """
+    levels = list(data) if meta.get("multiscale") else [data]
+    axes = image_axes(levels[0].ndim, meta.get("rgb", False))
+    scale = meta.get("scale")
+    if str(path).endswith(ZARR_SUFFIXES):
+        return [write_ome_zarr(path, levels, axes, scale)]
+    return [write_ome_tiff(path, levels[0], axes, scale)]
 
-    # return path to any file(s) that were successfully written
-    return [path]
+
+def feature_column(values):
+    """Feature values as a column that ``np.load`` can memory-map.
+
+    Numbers and booleans are kept, strings, categories and other objects
+    are stored as fixed width unicode strings instead of pickled objects,
+    missing values as empty strings.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind in "biuf":
+        return values
+    if values.dtype.kind == "U":
+        return values
+    # None and NaN, the only values that differ from themselves
+    return np.array(
+        ["" if v is None or v != v else str(v) for v in values], dtype=str
+    )
+
+
+def points_columns(data, meta):
+    """Detection columns of a points layer, typed as in the reader.
+
+    Coordinates are named after the axes of the layer, see ``AXES``.
+    """
+    ndim = meta.get("ndim") or np.shape(data)[-1]
+    if ndim not in AXES:
+        raise ValueError(f"cannot write {ndim}D points as detections")
+    data = np.asarray(data).reshape(-1, ndim)
+    columns = {}
+    for i, axis in enumerate(AXES[ndim]):
+        if axis in "CT":
+            columns[axis] = np.rint(data[:, i]).astype(np.int32)
+        else:
+            columns[axis] = data[:, i].astype(np.float32)
+    features = meta.get("features")
+    if features is not None:
+        for name in features:
+            columns[str(name)] = feature_column(features[name])
+    return columns
+
+
+def shapes_columns(data, meta):
+    """Detection columns of a shapes layer of boxes.
+
+    Every shape becomes a detection at the centre of its vertices, with the
+    largest side of its YX extent as ``Size``.
+    """
+    shapes = {np.shape(shape) for shape in data}
+    ndim = next(iter(shapes))[-1] if shapes else meta.get("ndim", 3)
+    if len(shapes) <= 1:
+        n_vertices = next(iter(shapes))[0] if shapes else 4
+        vertices = np.asarray(data, dtype=np.float32)
+        vertices = vertices.reshape(len(data), n_vertices, ndim)
+        centres = vertices.mean(axis=1)
+        extent = np.ptp(vertices[:, :, -2:], axis=1)
+    else:
+        centres = np.array([np.mean(s, axis=0) for s in data], np.float32)
+        extent = np.array([np.ptp(s[:, -2:], axis=0) for s in data])
+    columns = points_columns(centres.reshape(-1, ndim), meta)
+    columns.setdefault(
+        "Size", extent.max(axis=1, initial=0).astype(np.float32)
+    )
+    return columns
+
+
+def write_columns_csv(path, columns, chunksize=CSV_CHUNKSIZE):
+    """Write numeric columns as csv, in chunks of rows, atomically."""
+    names = [
+        name
+        for name in columns
+        if np.issubdtype(np.asarray(columns[name]).dtype, np.number)
+    ]
+    n = len(columns[names[0]]) if names else 0
+    fmt = [
+        "%d" if np.issubdtype(columns[name].dtype, np.integer) else "%.6g"
+        for name in names
+    ]
+    tmp = _atomic_path(path)
+    try:
+        with open(tmp, "w") as f:
+            f.write(",".join(names) + "\n")
+            for start in range(0, n, chunksize):
+                chunk = np.column_stack(
+                    [
+                        columns[name][start : start + chunksize]
+                        for name in names
+                    ]
+                )
+                np.savetxt(f, chunk, delimiter=",", fmt=fmt)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return str(path)
+
+
+def write_columns(path, columns):
+    if str(path).endswith(".csv"):
+        return write_columns_csv(path, columns)
+    return save_columns(path, columns)
+
+
+def write_detections(path: str, data: Any, meta: dict) -> str:
+    """Writes a points layer of detections as a csv or structured .npy file.
+
+    The file has one column per coordinate axis (T, Z, Y, X or T, Y, X) and
+    per feature, the layout of the oneat csv files and of the detection
+    cache of the reader, and can be opened again with the reader.
+    """
+    return write_columns(path, points_columns(data, meta))
+
+
+@timed("write detections")
+def write_points(path: str, data: Any, meta: dict) -> List[str]:
+    """Writes a single points layer, see ``write_detections``."""
+    return [write_detections(path, data, meta)]
+
+
+@timed("write detections")
+def write_shapes(path: str, data: Any, meta: dict) -> List[str]:
+    """Writes a single shapes layer of boxes, see ``shapes_columns``."""
+    return [write_columns(path, shapes_columns(data, meta))]
 
 
 def write_multiple(path: str, data: List[FullLayerData]) -> List[str]:
-    """Writes multiple layers of different types."""
+    """Writes multiple layers of different types.
 
-    # implement your writer logic here ...
+    Layers are exported into the folder ``path``, points and shapes layers
+    as ``<layer name>.npy``, see ``write_detections``, and image and labels
+    layers as ``<layer name>.ome.tif``, see ``write_single_image``.
+    """
+    folder = Path(path)
+    folder.mkdir(parents=True, exist_ok=True)
+    written = []
+    for layer_data, meta, layer_type in data:
+        name = meta.get("name", layer_type)
+        if layer_type == "points":
+            written.append(
+                write_detections(str(folder / f"{name}.npy"), layer_data, meta)
+            )
+        elif layer_type == "shapes":
+            written += write_shapes(
+                str(folder / f"{name}.npy"), layer_data, meta
+            )
+        elif layer_type in ("image", "labels"):
+            written += write_single_image(
+                str(folder / f"{name}.ome.tif"), layer_data, meta
+            )
 
     # return path to any file(s) that were successfully written
-    return [path]
+    return written